@@ -6,8 +6,39 @@ load_dotenv()
 class Config:
     """Application configuration"""
     APP_NAME = "AI Data Scientist"
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-    ALLOWED_FILE_TYPES = ["csv"]
+    MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 10MB
+    # Allowed upload extensions come from the reader registry (readers.allowed_file_types)
+
+    # Uploads are spooled to disk in chunks and parsed in row batches
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB
+    UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR')  # None -> system temp dir
+    CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', 100_000))
+    CSV_SNIFF_BYTES = int(os.getenv('CSV_SNIFF_BYTES', 64 * 1024))  # 64KB
+    CSV_ENGINE = os.getenv('CSV_ENGINE', 'auto')  # auto | pyarrow | c
+
+    # Dtype pass after parsing: dates, category/Arrow strings and lossless numeric downcasts
+    DTYPE_OPTIMIZE = os.getenv('DTYPE_OPTIMIZE', 'true').lower() == 'true'
+    DTYPE_PARSE_DATES = os.getenv('DTYPE_PARSE_DATES', 'true').lower() == 'true'
+    DTYPE_ARROW_STRINGS = os.getenv('DTYPE_ARROW_STRINGS', 'true').lower() == 'true'
+    DTYPE_DOWNCAST_NUMERIC = os.getenv('DTYPE_DOWNCAST_NUMERIC', 'true').lower() == 'true'
+    # int64 -> int32 is off by default: arithmetic in generated code (products, cumsum) can
+    # overflow int32 where int64 did not; when on, only columns well inside the range narrow
+    DTYPE_DOWNCAST_INTEGERS = os.getenv('DTYPE_DOWNCAST_INTEGERS', 'false').lower() == 'true'
+    # Text columns with at most this many distinct values per non-null value become category
+    DTYPE_CATEGORY_MAX_RATIO = float(os.getenv('DTYPE_CATEGORY_MAX_RATIO', 0.5))
+
+    # Upper bound on cells copied into one float64 array while profiling numeric columns
+    PROFILE_BATCH_CELLS = int(os.getenv('PROFILE_BATCH_CELLS', 16 * 1024 * 1024))
+    SUMMARY_CACHE_SIZE = int(os.getenv('SUMMARY_CACHE_SIZE', 4))
+
+    # Uploads of at least PROFILE_SAMPLE_MIN_BYTES ('auto') or all of them ('sampled') are first
+    # answered with a profile of a row sample; the exact profile follows in the background.
+    # Uploads never exceed MAX_FILE_SIZE, so the threshold defaults to half of it (a threshold
+    # above MAX_FILE_SIZE means 'auto' never samples)
+    PROFILE_MODE = os.getenv('PROFILE_MODE', 'auto')  # auto | sampled | exact
+    PROFILE_SAMPLE_MIN_BYTES = int(os.getenv('PROFILE_SAMPLE_MIN_BYTES', MAX_FILE_SIZE // 2))
+    PROFILE_SAMPLE_ROWS = int(os.getenv('PROFILE_SAMPLE_ROWS', 50_000))
+    PROFILE_SAMPLE_STRATA = int(os.getenv('PROFILE_SAMPLE_STRATA', 1000))
 
     IS_PRODUCTION = os.getenv('ENVIRONMENT') == 'production'
 
@@ -16,6 +47,104 @@ class Config:
     MAX_TOKENS = 1096
     TEMPERATURE = 0.3
 
+    # Plot critiques: vision model, answer budget per plot, batching and image downscaling
+    CRITIQUE_MODEL = os.getenv('CRITIQUE_MODEL', 'claude-3-haiku-20240307')
+    CRITIQUE_MAX_TOKENS = int(os.getenv('CRITIQUE_MAX_TOKENS', 400))
+    CRITIQUE_BATCH_SIZE = int(os.getenv('CRITIQUE_BATCH_SIZE', 4))
+    CRITIQUE_BATCH_WINDOW = float(os.getenv('CRITIQUE_BATCH_WINDOW', 2.0))  # seconds
+    CRITIQUE_IMAGE_MAX_EDGE = int(os.getenv('CRITIQUE_IMAGE_MAX_EDGE', 1024))  # pixels
+    CRITIQUE_IMAGE_FORMAT = os.getenv('CRITIQUE_IMAGE_FORMAT', 'webp')  # 'webp', 'jpeg' or 'png'
+    CRITIQUE_IMAGE_QUALITY = int(os.getenv('CRITIQUE_IMAGE_QUALITY', 80))
+
+    # Analysis prompts: token budget for the dataset description and provider-side caching
+    PROMPT_DATASET_TOKEN_BUDGET = int(os.getenv('PROMPT_DATASET_TOKEN_BUDGET', 2000))
+    PROMPT_CHARS_PER_TOKEN = float(os.getenv('PROMPT_CHARS_PER_TOKEN', 4))
+    PROMPT_SAMPLE_ROWS = int(os.getenv('PROMPT_SAMPLE_ROWS', 3))
+    PROMPT_CACHING = os.getenv('PROMPT_CACHING', 'true').lower() == 'true'
+
+    # Opt-in cache of analysis responses: 'none', 'memory' or 'sqlite' (shared across processes)
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'none')
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+    RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 24 * 60 * 60))
+    RESPONSE_CACHE_PATH = os.getenv(
+        'RESPONSE_CACHE_PATH',
+        os.path.join(os.path.dirname(__file__), 'cache', 'responses.sqlite3')
+    )
+
+    # Shared async client: base URL override (e.g. a local stub server), timeouts and limits
+    ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL')
+    LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))  # seconds
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+
+    # Generated code execution: 'process' (warm worker pool) or 'inline' (thread in the API process)
+    EXEC_BACKEND = os.getenv('EXEC_BACKEND', 'process')
+    EXEC_WORKERS = int(os.getenv('EXEC_WORKERS', 2))
+    EXEC_TIMEOUT = float(os.getenv('EXEC_TIMEOUT', 120))  # seconds per job
+    EXEC_MEMORY_LIMIT_MB = int(os.getenv('EXEC_MEMORY_LIMIT_MB', 0))  # 0 disables the cap
+    EXEC_START_METHOD = os.getenv('EXEC_START_METHOD', 'spawn')
+    # Startup: pyplot always uses a non-GUI backend; the analysis libraries below are imported
+    # by each execution worker as it starts and, once the API is up, in the background
+    # (workers are started then, or the API process imports them for the inline backend)
+    MPL_BACKEND = os.getenv('MPL_BACKEND', 'Agg')
+    PREWARM_ENABLED = os.getenv('PREWARM_ENABLED', 'true').lower() == 'true'
+    PREWARM_MODULES = [
+        module.strip() for module in os.getenv(
+            'PREWARM_MODULES',
+            'matplotlib.pyplot,seaborn,sklearn.linear_model,sklearn.ensemble,sklearn.preprocessing,'
+            'sklearn.model_selection,sklearn.metrics,xgboost'
+        ).split(',') if module.strip()
+    ]
+    # Code blocks are parsed and compiled once per process, keyed by source hash
+    CODE_CACHE_SIZE = int(os.getenv('CODE_CACHE_SIZE', 256))
+    # Exec namespaces get a lazy copy of the dataset instead of an eager deep copy
+    PANDAS_COPY_ON_WRITE = os.getenv('PANDAS_COPY_ON_WRITE', 'true').lower() == 'true'
+
+    # Number of recent analysis log entries kept in memory for prompt building
+    ANALYSIS_LOG_TAIL = int(os.getenv('ANALYSIS_LOG_TAIL', 50))
+
+    # Parsed datasets persisted as Arrow files by content hash and memory-mapped on reload
+    DATASET_STORE_ENABLED = os.getenv('DATASET_STORE_ENABLED', 'true').lower() == 'true'
+    DATASET_STORE_DIR = os.getenv(
+        'DATASET_STORE_DIR',
+        os.path.join(os.path.dirname(__file__), 'datasets')
+    )
+    DATASET_STORE_MAX_MB = int(os.getenv('DATASET_STORE_MAX_MB', 10 * 1024))
+
+    # Sessions: datasets beyond the memory budget are spilled to disk, least recently used first
+    DEFAULT_SESSION_ID = 'default'
+    SESSION_MEMORY_BUDGET_MB = int(os.getenv('SESSION_MEMORY_BUDGET_MB', 2048))
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 24 * 60 * 60))
+    SESSION_SPILL_DIR = os.getenv(
+        'SESSION_SPILL_DIR',
+        os.path.join(os.path.dirname(__file__), 'sessions')
+    )
+
+    # Rendered figures, content-addressed by hash(code, dataset fingerprint) and shared by
+    # /execute and report generation
+    PLOT_CACHE_DIR = os.getenv(
+        'PLOT_CACHE_DIR',
+        os.path.join(os.path.dirname(__file__), 'plot_cache')
+    )
+    PLOT_CACHE_MAX_MB = int(os.getenv('PLOT_CACHE_MAX_MB', 512))
+    # UI figures are served by GET /plots/{id}.{format}: 'png' (optionally optimized), 'webp' or 'svg'
+    PLOT_FORMAT = os.getenv('PLOT_FORMAT', 'png')
+    PLOT_DPI = int(os.getenv('PLOT_DPI', 100))
+    PLOT_PNG_OPTIMIZE = os.getenv('PLOT_PNG_OPTIMIZE', 'true').lower() == 'true'
+    PLOT_WEBP_QUALITY = int(os.getenv('PLOT_WEBP_QUALITY', 80))
+    # Oversized artists are binned, sampled or downsampled before rendering (see plot_acceleration)
+    PLOT_ACCELERATION = os.getenv('PLOT_ACCELERATION', 'true').lower() == 'true'
+    PLOT_MAX_SCATTER_POINTS = int(os.getenv('PLOT_MAX_SCATTER_POINTS', 50000))
+    PLOT_HEXBIN_GRIDSIZE = int(os.getenv('PLOT_HEXBIN_GRIDSIZE', 100))
+    PLOT_MAX_LINE_POINTS = int(os.getenv('PLOT_MAX_LINE_POINTS', 5000))
+    PLOT_RASTERIZE_POINTS = int(os.getenv('PLOT_RASTERIZE_POINTS', 10000))
+
+    # Report generation runs as background jobs; pdflatex runs are bounded and time-limited
+    REPORT_MAX_ACTIVE_JOBS = int(os.getenv('REPORT_MAX_ACTIVE_JOBS', 4))
+    REPORT_COMPILE_CONCURRENCY = int(os.getenv('REPORT_COMPILE_CONCURRENCY', 2))
+    REPORT_COMPILE_TIMEOUT = float(os.getenv('REPORT_COMPILE_TIMEOUT', 120))  # seconds per pass
+    REPORT_JOB_TTL_SECONDS = int(os.getenv('REPORT_JOB_TTL_SECONDS', 60 * 60))
+
     CORS_ORIGINS = (
         os.getenv('CORS_ORIGINS', '*').split(',')
         if IS_PRODUCTION
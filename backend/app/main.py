@@ -1,17 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+_started = time.perf_counter()  # Startup timings (GET /metrics/startup) are measured from here
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
-from typing import Dict, Any
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, Response, StreamingResponse
+from typing import Dict, Any, List, Optional
+import asyncio
 import traceback
 import json
+import os
+import re
 
 from .config import config
 from .models import AnalysisRequest, ExecuteCodeRequest, GenerateReportRequest
-from .services.data_service import DataService, NpEncoder
-from .services.llm_service import LLMService
-from .services.plot_analysis_service import PlotAnalysisService
-from .services.report_service import ReportService
+from .services.data_service import NpEncoder, UploadTooLargeError, upload_key
+from .services.readers import allowed_file_types
+from .services.session_service import Session, SessionManager
+from .services.llm_client import get_llm_client
+from .services.plot_cache import PLOT_MEDIA_TYPES, get_plot_cache
+from .services.prewarm import configure_matplotlib, get_startup_metrics
+from .services.report_jobs import ReportJob, ReportJobQueue
+from .services.response_cache import get_response_cache
 
+configure_matplotlib()
 app = FastAPI(title=config.APP_NAME)
 
 # Configure CORS
@@ -23,11 +34,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-data_service = DataService()
-plot_analysis_service = PlotAnalysisService()
-llm_service = LLMService(data_service, plot_analysis_service)
-report_service = ReportService(plot_analysis_service, data_service, llm_service)
+# Initialize services: one isolated set per session, sharing the LLM client and executor
+session_manager = SessionManager()
+report_jobs = ReportJobQueue()
+startup_metrics = get_startup_metrics()
+prewarm_task: Optional[asyncio.Task] = None
+
+async def get_session(x_session_id: Optional[str] = Header(None)) -> Session:
+    """Resolve the caller's session from the X-Session-ID header (default session if absent)"""
+    try:
+        return await session_manager.get(x_session_id)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+async def get_ready_session(session: Session = Depends(get_session)) -> Session:
+    """The caller's session, once the exact profile of its latest upload is available"""
+    if session.refinement is not None and not session.refinement.done():
+        await asyncio.shield(session.refinement)
+    return session
+
+async def prewarm() -> None:
+    """Import the heavy analysis libraries (or start the warm workers) off the critical path"""
+    startup_metrics.prewarm_started()
+    started = time.perf_counter()
+    try:
+        modules = await session_manager.executor.prewarm()
+        startup_metrics.prewarm_finished(time.perf_counter() - started, modules)
+        print(f"Prewarm finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"Prewarm failed: {str(e)}")
+        traceback.print_exc()
+        startup_metrics.prewarm_finished(time.perf_counter() - started, {}, str(e))
+
+@app.on_event("startup")
+async def start_prewarm():
+    """Serve right away; heavy imports happen in the background once the API is up"""
+    global prewarm_task
+    startup_metrics.mark_ready()
+    print(f"API ready in {startup_metrics.ready_seconds:.2f}s")
+    if config.PREWARM_ENABLED:
+        prewarm_task = asyncio.create_task(prewarm())
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """Release the pooled LLM connections and stop code execution workers"""
+    if prewarm_task is not None and not prewarm_task.done():
+        prewarm_task.cancel()
+    await report_jobs.shutdown()
+    await get_llm_client().close()
+    await session_manager.shutdown()
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -95,26 +150,95 @@ async def root():
     </html>
     """
 
+async def activate_dataset(session: Session) -> None:
+    """Make the session's freshly analyzed dataset available to code execution"""
+    session.llm_service.reset_namespace()
+    session_manager.remember_dataset(session)
+    await session_manager.enforce_budget(keep=session.session_id)
+
+async def refine_upload(session: Session, upload_path: str, upload_hash: str,
+                        columns: Optional[List[str]]) -> None:
+    """Parse and profile the whole upload after a sampled summary was returned for it.
+
+    The work happens in a thread on a new ParsedDataset; the session's DataService is only
+    changed afterwards, on the event loop, in one step.
+    """
+    try:
+        try:
+            parsed = await asyncio.to_thread(
+                session.data_service.prepare_data, upload_path, upload_hash, columns
+            )
+        except Exception as e:
+            print("Error refining sampled profile, keeping the sample:")
+            traceback.print_exc()
+            session.data_service.refinement_failed(str(e))
+        else:
+            session.data_service.adopt(parsed)
+            print(f"Exact profile ready for session {session.session_id}")
+        await activate_dataset(session)
+    except Exception:
+        print("Error activating refined dataset:")
+        traceback.print_exc()
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """Handle file upload and initial analysis"""
-    if not file.filename.endswith('.csv'):
+async def upload_file(file: UploadFile = File(...), columns: Optional[str] = Form(None),
+                      session: Session = Depends(get_ready_session)):
+    """Handle file upload and initial analysis.
+
+    Accepts CSV (plain, gzip or zstd), Parquet, Feather/Arrow and Excel files; `columns`
+    (comma-separated) keeps only those columns. Large CSV files get a summary of a row
+    sample right away (profile.status 'refining'); the exact summary is computed in the
+    background and served by GET /data/summary when ready.
+    """
+    file_types = allowed_file_types()
+    if not file.filename.lower().endswith(tuple(f".{ext}" for ext in file_types)):
         return JSONResponse(
             status_code=400,
-            content={"error": "Please upload a CSV file"}
+            content={"error": f"Please upload one of: {', '.join(file_types)}"}
         )
+    selected = [column.strip() for column in columns.split(',') if column.strip()] if columns else None
 
+    upload_path = None
     try:
-        plot_analysis_service.clear_log()
-        contents = await file.read()
-        summary_stats = data_service.analyze_data(contents)
-        llm_service.reset_namespace()
+        session.plot_analysis_service.clear_log()
+        upload_path, content_hash = await session.data_service.spool_upload(file)
+        upload_hash = upload_key(content_hash, selected)
+
+        if session.data_service.should_sample(upload_path, upload_hash):
+            try:
+                summary_stats = session.data_service.sample_profile(upload_path, selected)
+            except Exception as e:
+                print(f"Sampled profile failed, profiling exactly: {str(e)}")
+            else:
+                session.refinement = asyncio.create_task(
+                    refine_upload(session, upload_path, upload_hash, selected)
+                )
+                upload_path = None  # Removed by the refinement task
+                return JSONResponse(
+                    content=json.loads(json.dumps(summary_stats, cls=NpEncoder)),
+                    status_code=200
+                )
+
+        summary_stats = session.data_service.analyze_data(upload_path, upload_hash, selected)
+        await activate_dataset(session)
 
         return JSONResponse(
             content=json.loads(json.dumps(summary_stats, cls=NpEncoder)),
             status_code=200
         )
 
+    except UploadTooLargeError as e:
+        return JSONResponse(
+            status_code=413,
+            content={
+                "success": False,
+                "error": str(e)
+            }
+        )
+
     except Exception as e:
         print("Error processing file:")
         traceback.print_exc()
@@ -126,18 +250,31 @@ async def upload_file(file: UploadFile = File(...)):
             }
         )
 
+    finally:
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+@app.get("/data/summary")
+async def data_summary(session: Session = Depends(get_session)):
+    """Summary of the current dataset; sampled (profile.status 'refining') until the exact one is ready"""
+    try:
+        summary_stats = session.data_service.get_profile()
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    return JSONResponse(content=json.loads(json.dumps(summary_stats, cls=NpEncoder)))
+
 @app.post("/analyze")
-async def analyze_data(request: AnalysisRequest):
+async def analyze_data(request: AnalysisRequest, session: Session = Depends(get_ready_session)):
     """Analyze data using LLM"""
-    try:
-        if not data_service.current_df is not None:
-            raise HTTPException(400, "No data has been uploaded yet")
+    if not session.data_service.has_data:
+        raise HTTPException(400, "No data has been uploaded yet")
 
-        # Get current data info
-        df_info = data_service.get_summary_stats(data_service.current_df)
+    try:
+        # Get current data info (cached per dataset version)
+        df_info = session.data_service.get_current_summary()
 
         # Call AI Data Scientist
-        response = await llm_service.analyze(
+        response = await session.llm_service.analyze(
             query=request.query,
             data_info=df_info,
             chat_history=request.chat_history
@@ -153,11 +290,50 @@ async def analyze_data(request: AnalysisRequest):
         traceback.print_exc()
         raise HTTPException(500, f"Error analyzing data: {str(e)}")
 
+@app.post("/analyze/stream")
+async def analyze_data_stream(request: AnalysisRequest, session: Session = Depends(get_ready_session)):
+    """Analyze data using LLM, streaming text and code blocks as server-sent events"""
+    if not session.data_service.has_data:
+        raise HTTPException(400, "No data has been uploaded yet")
+
+    df_info = session.data_service.get_current_summary()
+
+    async def stream():
+        async for event in session.llm_service.analyze_stream(
+            query=request.query,
+            data_info=df_info,
+            chat_history=request.chat_history
+        ):
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/analyze/pipeline")
+async def analyze_pipeline(request: AnalysisRequest, session: Session = Depends(get_ready_session)):
+    """Analyze, execute every code block and critique its plot in one server-sent event stream"""
+    if not session.data_service.has_data:
+        raise HTTPException(400, "No data has been uploaded yet")
+
+    df_info = session.data_service.get_current_summary()
+
+    async def stream():
+        async for event in session.llm_service.analyze_pipeline(
+            query=request.query,
+            data_info=df_info,
+            chat_history=request.chat_history
+        ):
+            yield f"data: {json.dumps(event, cls=NpEncoder)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/execute")
-async def execute_code(request: ExecuteCodeRequest):
+async def execute_code(request: ExecuteCodeRequest, session: Session = Depends(get_ready_session)):
     """Execute Python code and return visualization with analysis"""
     try:
-        result = await llm_service.execute_code(request.code)
+        job_id = f"{session.session_id}:{request.job_id}" if request.job_id else None
+        result = await session.llm_service.execute_code(request.code, job_id=job_id)
 
         if not result["success"]:
             raise HTTPException(500, result.get("error", "Code execution failed"))
@@ -165,39 +341,119 @@ async def execute_code(request: ExecuteCodeRequest):
         return {
             "success": True,
             "result": result["result"],
-            "type": "visualization" if result["result"].get("plot") else "text"
+            "type": "visualization" if result["result"].get("plot_id") else "text"
         }
     except Exception as e:
         raise HTTPException(500, f"Error executing code: {str(e)}")
 
-@app.post("/generate-report")
-async def generate_report(request: GenerateReportRequest):
-    try:
-        if data_service.current_df is None:
-            raise HTTPException(400, "No data has been analyzed yet")
+PLOT_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
 
-        report = await report_service.generate_report(request.chat_history)
+@app.get("/plots/{plot_id}.{fmt}")
+async def get_plot(plot_id: str, fmt: str, if_none_match: Optional[str] = Header(None)):
+    """A rendered figure referenced by /execute results, served as a binary image.
 
-        if "pdf_path" in report:
-            # Return PDF file
-            return FileResponse(
-                report["pdf_path"],
-                media_type="application/pdf",
-                filename="analysis_report.pdf"
-            )
-        else:
-            return JSONResponse(
-                content={
-                    "success": False,
-                    "error": "PDF generation failed"
-                },
-                status_code=500
-            )
+    Figures are content-addressed (code + dataset), so they are cacheable indefinitely and
+    revalidated by ETag.
+    """
+    cache = get_plot_cache()
+    ui_fmt, dpi = cache.ui_variant()
+    if not PLOT_ID_PATTERN.match(plot_id) or fmt != ui_fmt:
+        raise HTTPException(404, "No such plot")
 
-    except Exception as e:
-        print(f"Error generating report: {str(e)}")
-        traceback.print_exc()
-        raise HTTPException(500, f"Error generating report: {str(e)}")
+    etag = f'"{plot_id}-{fmt}-{dpi or 0}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    path = cache.get(plot_id, fmt, dpi)
+    if path is None:
+        raise HTTPException(404, "Plot not found; it may have been evicted, re-run the code")
+    return FileResponse(path, media_type=PLOT_MEDIA_TYPES[fmt], headers=headers)
+
+@app.post("/execute/{job_id}/cancel")
+async def cancel_execution(job_id: str, session: Session = Depends(get_session)):
+    """Cancel a running /execute job started with the given job_id"""
+    if not session_manager.executor.cancel(f"{session.session_id}:{job_id}"):
+        raise HTTPException(404, "No running job with this id")
+    return {"success": True, "job_id": job_id}
+
+@app.post("/generate-report", status_code=202)
+async def generate_report(request: GenerateReportRequest, session: Session = Depends(get_ready_session)):
+    """Start generating a report in the background; poll /reports/{job_id} for its status"""
+    if not session.data_service.has_data:
+        raise HTTPException(400, "No data has been analyzed yet")
+
+    job = report_jobs.submit(session, request.chat_history)
+    return job.to_dict()
+
+def get_report_job(job_id: str, session: Session = Depends(get_session)) -> ReportJob:
+    job = report_jobs.get(job_id, session.session_id)
+    if job is None:
+        raise HTTPException(404, "No report job with this id")
+    return job
+
+@app.get("/reports/{job_id}")
+async def report_status(job: ReportJob = Depends(get_report_job)):
+    """Current status and stage of a report job"""
+    return job.to_dict()
+
+@app.get("/reports/{job_id}/events")
+async def report_events(job: ReportJob = Depends(get_report_job)):
+    """Server-sent events with the job's status, until it completes, fails or is cancelled"""
+    async def stream():
+        async for state in job.updates():
+            yield f"data: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/reports/{job_id}/pdf")
+async def download_report(job: ReportJob = Depends(get_report_job)):
+    """Download a completed report"""
+    if job.status != 'completed':
+        raise HTTPException(409, f"Report is not ready (status: {job.status})")
+    if not os.path.exists(job.pdf_path):
+        raise HTTPException(410, "Report file is no longer available")
+    return FileResponse(
+        job.pdf_path,
+        media_type="application/pdf",
+        filename="analysis_report.pdf"
+    )
+
+@app.post("/reports/{job_id}/cancel")
+async def cancel_report(job_id: str, session: Session = Depends(get_session)):
+    """Cancel a queued or running report job"""
+    if not report_jobs.cancel(job_id, session.session_id):
+        raise HTTPException(404, "No pending report job with this id")
+    return {"success": True, "job_id": job_id}
+
+@app.get("/sessions")
+async def list_sessions():
+    """Memory and residency of the active sessions"""
+    # Measuring frames and namespaces can take a while; keep it off the event loop
+    return await asyncio.to_thread(session_manager.stats)
+
+@app.get("/sessions/current")
+async def current_session_memory(session: Session = Depends(get_session)):
+    """Memory held by the caller's dataset and exec namespace"""
+    return await asyncio.to_thread(session.memory_stats)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the analysis response cache"""
+    cache = get_response_cache()
+    return {"response_cache": cache.stats() if cache else {"backend": "none"}}
+
+@app.get("/metrics/startup")
+async def startup_stats():
+    """Startup and prewarm timings, plus imports that requests still had to wait for"""
+    return startup_metrics.stats()
+
+startup_metrics.mark_imported(_started)
 
 if __name__ == "__main__":
     import uvicorn
@@ -22,6 +22,7 @@ class AnalysisRequest(BaseModel):
 
 class ExecuteCodeRequest(BaseModel):
     code: Any
+    job_id: Optional[str] = None
 
     model_config = {
         "extra": "allow",
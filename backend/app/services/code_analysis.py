@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+import ast
+import hashlib
+import importlib
+import threading
+
+from ..config import config
+
+# Names generated code may use without importing them, and where they come from
+ML_TOOLS: Dict[str, Tuple[str, str]] = {
+    **{name: ('sklearn.linear_model', name) for name in ('LinearRegression', 'LogisticRegression', 'Lasso', 'Ridge')},
+    **{name: ('sklearn.ensemble', name) for name in (
+        'RandomForestClassifier', 'RandomForestRegressor',
+        'GradientBoostingClassifier', 'GradientBoostingRegressor',
+        'AdaBoostClassifier', 'AdaBoostRegressor'
+    )},
+    'XGBClassifier': ('xgboost', 'XGBClassifier'),
+    'XGBRegressor': ('xgboost', 'XGBRegressor'),
+    **{name: ('sklearn.preprocessing', name) for name in ('OneHotEncoder', 'StandardScaler', 'LabelEncoder')},
+    **{name: ('sklearn.model_selection', name) for name in ('train_test_split', 'GridSearchCV', 'cross_val_score')},
+    **{name: ('sklearn.metrics', name) for name in (
+        'accuracy_score', 'precision_score', 'recall_score', 'f1_score',
+        'mean_squared_error', 'r2_score', 'confusion_matrix', 'classification_report'
+    )},
+}
+
+PYPLOT_MODULE = 'matplotlib.pyplot'
+CODE_FILENAME = '<generated code>'
+
+
+class AnalyzedCode:
+    """A code block parsed once: its compiled code object and the names it needs"""
+
+    def __init__(self, key: str, code_object, free_names: Set[str], modules: Set[str]):
+        self.key = key
+        self.code_object = code_object
+        self.free_names = free_names
+        self.modules = modules
+
+    @property
+    def ml_tools(self) -> Set[str]:
+        """Injectable names the code uses without defining or importing them itself"""
+        return self.free_names & ML_TOOLS.keys()
+
+
+class _NameCollector(ast.NodeVisitor):
+    """Names the code reads, names it binds anywhere, and the modules it imports"""
+
+    def __init__(self):
+        self.loaded = set()
+        self.bound = set()
+        self.modules = set()
+        self.pyplot_aliases = {'plt'}
+        self.show_aliases = set()
+
+    def visit_Name(self, node: ast.Name) -> None:
+        (self.loaded if isinstance(node.ctx, ast.Load) else self.bound).add(node.id)
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            self.modules.add(alias.name)
+            self.bound.add(alias.asname or alias.name.partition('.')[0])
+            if alias.name == PYPLOT_MODULE and alias.asname:
+                self.pyplot_aliases.add(alias.asname)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        if node.module:
+            self.modules.add(node.module)
+        for alias in node.names:
+            self.bound.add(alias.asname or alias.name)
+            if node.module == PYPLOT_MODULE and alias.name == 'show':
+                self.show_aliases.add(alias.asname or alias.name)
+            if node.module == 'matplotlib' and alias.name == 'pyplot':
+                self.pyplot_aliases.add(alias.asname or alias.name)
+
+    def _bind_definition(self, node) -> None:
+        self.bound.add(node.name)
+        self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _bind_definition
+
+    def visit_arg(self, node: ast.arg) -> None:
+        self.bound.add(node.arg)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+
+class _ShowRemover(ast.NodeTransformer):
+    """Turns bare `plt.show(...)` statements into `pass` (figures are saved, not shown)"""
+
+    def __init__(self, pyplot_aliases: Set[str], show_aliases: Set[str]):
+        self.pyplot_aliases = pyplot_aliases
+        self.show_aliases = show_aliases
+
+    def _is_show(self, call: ast.AST) -> bool:
+        if not isinstance(call, ast.Call):
+            return False
+        function = call.func
+        if isinstance(function, ast.Attribute):
+            return (function.attr == 'show' and isinstance(function.value, ast.Name)
+                    and function.value.id in self.pyplot_aliases)
+        return isinstance(function, ast.Name) and function.id in self.show_aliases
+
+    def visit_Expr(self, node: ast.Expr) -> ast.AST:
+        if self._is_show(node.value):
+            return ast.copy_location(ast.Pass(), node)
+        return node
+
+
+def source_hash(source: str) -> str:
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def analyze_code(source: str) -> AnalyzedCode:
+    """Parse source, resolve the names and modules it uses, drop plt.show() calls and compile it.
+
+    Raises SyntaxError for code that does not parse.
+    """
+    tree = ast.parse(source, filename=CODE_FILENAME, mode='exec')
+    names = _NameCollector()
+    names.visit(tree)
+    tree = ast.fix_missing_locations(_ShowRemover(names.pyplot_aliases, names.show_aliases).visit(tree))
+    return AnalyzedCode(
+        key=source_hash(source),
+        code_object=compile(tree, CODE_FILENAME, 'exec'),
+        free_names=names.loaded - names.bound,
+        modules=names.modules
+    )
+
+def inject_ml_tools(analyzed: AnalyzedCode, namespace: Dict[str, Any]) -> Set[str]:
+    """Bind the ML tools the code uses but the namespace lacks; returns the names injected"""
+    injected = set()
+    for name in sorted(analyzed.ml_tools - namespace.keys()):
+        module_name, attribute = ML_TOOLS[name]
+        namespace[name] = getattr(importlib.import_module(module_name), attribute)
+        injected.add(name)
+    return injected
+
+
+class CompiledCodeCache:
+    """LRU of AnalyzedCode by source hash, so repeated blocks are parsed and compiled once"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or config.CODE_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze(self, source: str) -> AnalyzedCode:
+        key = source_hash(source)
+        with self._lock:
+            analyzed = self._entries.get(key)
+            if analyzed is not None:
+                self._entries.move_to_end(key)
+                return analyzed
+        analyzed = analyze_code(source)
+        with self._lock:
+            self._entries[key] = analyzed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analyzed
+
+
+_shared_cache: Optional[CompiledCodeCache] = None
+
+def get_code_cache() -> CompiledCodeCache:
+    """Return this process's compiled-code cache"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = CompiledCodeCache()
+    return _shared_cache
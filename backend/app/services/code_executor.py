@@ -0,0 +1,611 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+import uuid
+
+from ..config import config
+from .code_analysis import get_code_cache, inject_ml_tools
+from .plot_acceleration import accelerate_figures, point_plot_sampling
+from .prewarm import get_startup_metrics, prewarm_imports, timed_imports
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; memory caps are skipped there
+    resource = None
+
+
+def enable_copy_on_write() -> bool:
+    """Switch pandas to copy-on-write (PANDAS_COPY_ON_WRITE); returns whether it is on"""
+    import pandas as pd
+    if config.PANDAS_COPY_ON_WRITE:
+        pd.set_option('mode.copy_on_write', True)
+    return bool(pd.get_option('mode.copy_on_write'))
+
+
+def isolated_copy(df):
+    """A copy of df that generated code may modify without touching the original.
+
+    Under copy-on-write this is a lazy copy: columns are only duplicated once generated
+    code writes to them.
+    """
+    import pandas as pd
+    return df.copy(deep=not pd.get_option('mode.copy_on_write'))
+
+
+def build_namespace(df=None) -> Dict[str, Any]:
+    """Fresh exec namespace with the analysis libraries and an isolated df"""
+    import pandas as pd
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    namespace = {
+        'pd': pd,
+        'plt': plt,
+        'sns': sns,
+        'np': np,
+        '__builtins__': __builtins__,
+    }
+    if df is not None:
+        namespace['df'] = isolated_copy(df)
+    return namespace
+
+
+def _extension_buffers(array) -> List[Tuple[int, int]]:
+    """(address, size) of the memory behind one column's values"""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(array, np.ndarray):
+        return [(_buffer_address(array), array.nbytes)]
+    if isinstance(array, pd.Categorical):
+        return _extension_buffers(array.codes) + _extension_buffers(array.categories.array)
+    if hasattr(array, '_pa_array'):  # Arrow-backed (string[pyarrow] and ArrowDtype columns)
+        return [
+            (buffer.address, buffer.size)
+            for chunk in array._pa_array.chunks for buffer in chunk.buffers() if buffer is not None
+        ]
+    if hasattr(array, '_data') and hasattr(array, '_mask'):  # Nullable Int64/Float64/boolean
+        return _extension_buffers(array._data) + _extension_buffers(array._mask)
+    if hasattr(array, '_ndarray'):  # Timezone-aware datetimes, python-backed strings
+        return _extension_buffers(array._ndarray)
+    return []
+
+
+def _array_buffers(value) -> List[Tuple[int, int]]:
+    """(address, size) of the buffers behind a DataFrame, Series or ndarray (empty for anything else)"""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(value, np.ndarray):
+        return _extension_buffers(value)
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if not isinstance(value, pd.DataFrame):
+        return []
+    buffers = []
+    for position in range(value.shape[1]):
+        column = value.iloc[:, position]
+        if isinstance(column.dtype, np.dtype):
+            buffers.extend(_extension_buffers(column.to_numpy(copy=False)))
+        else:
+            buffers.extend(_extension_buffers(column.array))
+    return buffers
+
+
+def _buffer_address(array) -> int:
+    return array.__array_interface__['data'][0]
+
+
+def namespace_memory(namespace: Optional[Dict[str, Any]], dataset=None) -> Dict[str, int]:
+    """Bytes held by the frames and arrays in a namespace.
+
+    shared_bytes is the part still backed by dataset's own buffers (untouched copy-on-write
+    columns, including the codes and categories of category columns and the buffers of
+    Arrow-backed ones), so private_bytes is what the namespace costs on top of the dataset.
+    Object columns are counted by their pointer arrays only; columns of any other extension
+    type are counted as private.
+    """
+    import numpy as np
+    import pandas as pd
+
+    shared_addresses = {address for address, _ in _array_buffers(dataset)} if dataset is not None else set()
+    seen = set()
+    total = shared = variables = 0
+    for name, value in (namespace or {}).items():
+        if name.startswith('__'):
+            continue
+        buffers = _array_buffers(value)
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            # Whatever no buffer was found for (unknown extension types) counts as private
+            usage = int(np.sum(value.memory_usage(index=False, deep=False)))
+            total += max(0, usage - sum(size for _, size in buffers))
+        if buffers:
+            variables += 1
+        for address, size in buffers:
+            if (address, size) in seen:
+                continue
+            seen.add((address, size))
+            total += size
+            if address in shared_addresses:
+                shared += size
+    return {
+        'variables': variables,
+        'total_bytes': total,
+        'shared_bytes': shared,
+        'private_bytes': total - shared
+    }
+
+
+def savefig_options(fmt: str) -> Dict[str, Any]:
+    """Encoder settings for UI figures (PLOT_PNG_OPTIMIZE, PLOT_WEBP_QUALITY)"""
+    if fmt == 'png' and config.PLOT_PNG_OPTIMIZE:
+        return {'pil_kwargs': {'optimize': True}}
+    if fmt == 'webp':
+        # Lossy at the configured quality; 100 keeps WebP lossless
+        return {'pil_kwargs': {'quality': config.PLOT_WEBP_QUALITY, 'lossless': config.PLOT_WEBP_QUALITY >= 100}}
+    return {}
+
+
+def run_code(namespace: Dict[str, Any], code: str, plot_path: Optional[str] = None,
+             extra_figures: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Execute code in namespace, capturing printed output and the resulting figure.
+
+    The code is compiled once per source (plt.show() calls removed) and only the ML tools it
+    actually references are imported into the namespace.
+
+    Returns the figure encoded as PLOT_FORMAT at PLOT_DPI (or saves it to plot_path at report
+    resolution). Oversized artists are thinned first; 'render_notes' says what was changed.
+    extra_figures lists additional renderings ({'path', 'format', 'dpi'}) to write to disk,
+    e.g. a vector PDF for the plot cache.
+    """
+    import matplotlib.pyplot as plt
+
+    try:
+        analyzed = get_code_cache().analyze(code)
+        with timed_imports() as imports:
+            inject_ml_tools(analyzed, namespace)
+        plt.close('all')
+
+        output_buffer = []
+        def custom_print(*args, **kwargs):
+            output_buffer.append(' '.join(map(str, args)))
+
+        namespace['print'] = custom_print
+
+        sampling_notes = []
+        if config.PLOT_ACCELERATION:
+            with point_plot_sampling() as sampling_notes:
+                exec(analyzed.code_object, namespace)
+        else:
+            exec(analyzed.code_object, namespace)
+
+        result = {
+            "success": True,
+            "text_output": '\n'.join(output_buffer) if output_buffer else None,
+            "plot": None,
+            "render_notes": [],
+            "imports": imports,
+            "error": None
+        }
+
+        if plt.get_fignums():
+            if config.PLOT_ACCELERATION:
+                result["render_notes"] = sampling_notes + accelerate_figures(
+                    [plt.figure(number) for number in plt.get_fignums()]
+                )
+            if plot_path:
+                plt.savefig(plot_path, bbox_inches="tight", dpi=300)
+            else:
+                buf = io.BytesIO()
+                plt.savefig(buf, format=config.PLOT_FORMAT, bbox_inches='tight', dpi=config.PLOT_DPI,
+                            **savefig_options(config.PLOT_FORMAT))
+                result["plot"] = buf.getvalue()
+            for figure in extra_figures or []:
+                try:
+                    plt.savefig(figure['path'], format=figure['format'], bbox_inches='tight',
+                                dpi=figure.get('dpi') or 'figure')
+                except Exception as e:
+                    print(f"Could not save {figure['format']} rendering: {str(e)}")
+                    # A partial file must not be taken for a finished rendering
+                    if os.path.exists(figure['path']):
+                        os.remove(figure['path'])
+            plt.close('all')
+
+        return result
+
+    except Exception as e:
+        print(f"Code execution error: {str(e)}")
+        traceback.print_exc()
+        plt.close('all')
+        return {
+            "success": False,
+            "text_output": None,
+            "plot": None,
+            "render_notes": [],
+            "error": str(e) or e.__class__.__name__
+        }
+
+
+class CodeExecutor:
+    """Backend that runs generated code for /execute off the event loop.
+
+    Datasets are registered under a key (the session ID) and every job names the dataset
+    it runs against, so one executor serves all sessions.
+    """
+
+    def get_namespace(self, dataset_key: str) -> Optional[Dict[str, Any]]:
+        """Exec namespace held in the API process for dataset_key, if any"""
+        return None
+
+    def set_dataset(self, dataset_key: str, df, source_path: Optional[str] = None) -> None:
+        """Make df the dataset seen by code subsequently run against dataset_key.
+
+        source_path, if given, is a stored copy of df (see read_dataset) that may be loaded
+        instead of serializing df again.
+        """
+        raise NotImplementedError
+
+    def drop_dataset(self, dataset_key: str) -> None:
+        """Release everything held for dataset_key"""
+        raise NotImplementedError
+
+    def namespace_memory(self, dataset_key: str) -> Dict[str, int]:
+        """Memory held by the exec namespace(s) of dataset_key (see namespace_memory())"""
+        return namespace_memory(None)
+
+    async def run(self, code: str, dataset_key: str, plot_path: Optional[str] = None,
+                  job_id: Optional[str] = None, timeout: Optional[float] = None,
+                  extra_figures: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a running job; returns False if the job is unknown or finished"""
+        return False
+
+    async def prewarm(self) -> Dict[str, Optional[float]]:
+        """Get the analysis libraries imported ahead of the first job; returns seconds per module"""
+        return {}
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class InlineExecutor(CodeExecutor):
+    """Runs code in a thread of the API process with one namespace per dataset.
+
+    Matplotlib's pyplot state is global, so jobs are serialized; timeouts only stop waiting,
+    they cannot interrupt the running code. Every job gets a fresh isolated df, so what a
+    block does to df never leaks into the next one.
+    """
+
+    def __init__(self):
+        self.namespaces = {}
+        self._datasets = {}
+        self._lock = threading.Lock()  # Held for the whole of each job
+        self._namespaces_lock = threading.Lock()  # Only guards the two dicts above
+        enable_copy_on_write()
+
+    def get_namespace(self, dataset_key: str) -> Optional[Dict[str, Any]]:
+        return self.namespaces.get(dataset_key)
+
+    def set_dataset(self, dataset_key: str, df, source_path: Optional[str] = None) -> None:
+        with timed_imports() as imports:
+            namespace = build_namespace(df)
+        get_startup_metrics().record_request_imports('upload', imports)
+        with self._namespaces_lock:
+            self.namespaces[dataset_key] = namespace
+            self._datasets[dataset_key] = df
+
+    def drop_dataset(self, dataset_key: str) -> None:
+        with self._namespaces_lock:
+            self.namespaces.pop(dataset_key, None)
+            self._datasets.pop(dataset_key, None)
+
+    def namespace_memory(self, dataset_key: str) -> Dict[str, int]:
+        """Measured on a snapshot of the namespace, without waiting for a running job"""
+        with self._namespaces_lock:
+            namespace = dict(self.namespaces.get(dataset_key) or {})
+            dataset = self._datasets.get(dataset_key)
+        return namespace_memory(namespace, dataset)
+
+    def _run_locked(self, code: str, dataset_key: str, plot_path: Optional[str],
+                    extra_figures: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        with self._lock:
+            with self._namespaces_lock:
+                namespace = self.namespaces.get(dataset_key)
+                dataset = self._datasets.get(dataset_key)
+            if namespace is None:
+                with timed_imports() as imports:
+                    namespace = build_namespace()
+                get_startup_metrics().record_request_imports('execute', imports)
+                with self._namespaces_lock:
+                    namespace = self.namespaces.setdefault(dataset_key, namespace)
+            if dataset is not None:
+                namespace['df'] = isolated_copy(dataset)
+            result = run_code(namespace, code, plot_path, extra_figures)
+        get_startup_metrics().record_request_imports('execute', result.pop('imports', None))
+        return result
+
+    async def prewarm(self) -> Dict[str, Optional[float]]:
+        # Same process: a thread imports them while the event loop keeps serving
+        return await asyncio.to_thread(prewarm_imports)
+
+    async def run(self, code: str, dataset_key: str, plot_path: Optional[str] = None,
+                  job_id: Optional[str] = None, timeout: Optional[float] = None,
+                  extra_figures: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(None, self._run_locked, code, dataset_key, plot_path, extra_figures),
+                timeout or config.EXEC_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return _failure(f"Code execution timed out after {timeout or config.EXEC_TIMEOUT}s")
+
+
+def _failure(error: str) -> Dict[str, Any]:
+    return {"success": False, "text_output": None, "plot": None, "error": error}
+
+
+def _apply_memory_limit(memory_limit_mb: int) -> None:
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, memory_limit_mb: int) -> None:
+    """Worker process loop: warm imports once, then execute jobs sent over the pipe"""
+    _apply_memory_limit(memory_limit_mb)
+
+    import matplotlib
+    matplotlib.use(config.MPL_BACKEND)
+    enable_copy_on_write()
+    from .dataset_store import read_dataset
+    imports = prewarm_imports()
+
+    namespace = build_namespace()
+    dataset_key = None
+    dataset_path = None
+    dataset = None
+    conn.send({"ready": True, "imports": imports})
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        # The namespace belongs to one session: sessions that uploaded the same file share
+        # the stored dataset path, but must never see each other's variables
+        if (job['dataset_key'], job['dataset_path']) != (dataset_key, dataset_path):
+            try:
+                if job['dataset_path'] != dataset_path:
+                    # Kept pristine (for memory-mapped files, keeping it referenced also makes
+                    # pandas copy columns before writing to them); code only sees isolated copies
+                    dataset = read_dataset(job['dataset_path']) if job['dataset_path'] else None
+                namespace = build_namespace(dataset)
+            except Exception as e:
+                dataset_key = dataset_path = dataset = None
+                conn.send(_failure(f"Could not load dataset: {str(e)}"))
+                continue
+            dataset_key, dataset_path = job['dataset_key'], job['dataset_path']
+
+        if job['code'] is None:  # Preload only
+            result = {"success": True, "text_output": None, "plot": None, "error": None}
+        else:
+            if dataset is not None:
+                # Any worker may get the next job, so none may see what earlier jobs did to df
+                namespace['df'] = isolated_copy(dataset)
+            result = run_code(namespace, job['code'], job['plot_path'], job['extra_figures'])
+        result['namespace_memory'] = namespace_memory(namespace, dataset)
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.imports = {}
+
+    def wait_ready(self) -> None:
+        """Block until the worker has finished its warm-up imports"""
+        if not self.ready:
+            self.imports = self.conn.recv().get('imports', {})
+            self.ready = True
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class WorkerPoolExecutor(CodeExecutor):
+    """Pool of warm worker processes with per-job timeouts, memory caps and cancellation.
+
+    Each worker pre-imports pandas and PREWARM_MODULES and keeps a namespace for the session
+    it last ran a job for (with df reset to the pristine dataset before every job), so
+    several code blocks can run in parallel on different cores without touching the event
+    loop. Each dataset is handed over as a file that workers load when a job targets a
+    different dataset than the one they hold (or right after upload, as a preload): the
+    dataset store's Arrow file, memory-mapped and shared between workers, or else a pickle.
+    A job for another session always gets a fresh namespace, even on the same file.
+    """
+
+    def __init__(self, workers: Optional[int] = None, memory_limit_mb: Optional[int] = None):
+        self.workers = workers or config.EXEC_WORKERS
+        self.memory_limit_mb = config.EXEC_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        self._context = multiprocessing.get_context(config.EXEC_START_METHOD)
+        self._idle = None
+        self._running = {}
+        self._dataset_dir = tempfile.mkdtemp(prefix='exec-dataset-')
+        self._dataset_paths = {}
+        self._dataset_version = 0
+        self._worker_memory = {}  # worker pid -> (dataset key, namespace_memory() after its last job)
+        self._preloads = set()
+
+    def _ensure_started(self) -> None:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self._idle.put_nowait(_Worker(self._context, self.memory_limit_mb))
+
+    def set_dataset(self, dataset_key: str, df, source_path: Optional[str] = None) -> None:
+        self.drop_dataset(dataset_key)
+        if source_path:
+            path = source_path
+        else:
+            self._dataset_version += 1
+            path = os.path.join(self._dataset_dir, f"dataset_{self._dataset_version}.pkl")
+            df.to_pickle(path)
+        self._dataset_paths[dataset_key] = path
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # Load the new dataset in every worker now rather than on their first job
+        for _ in range(self.workers):
+            task = loop.create_task(self.run(None, dataset_key))
+            self._preloads.add(task)
+            task.add_done_callback(self._preload_done)
+
+    def _preload_done(self, task: asyncio.Task) -> None:
+        self._preloads.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            print(f"Dataset preload failed: {task.exception()!r}")
+        elif not task.result()["success"]:
+            print(f"Dataset preload failed: {task.result()['error']}")
+
+    def drop_dataset(self, dataset_key: str) -> None:
+        path = self._dataset_paths.pop(dataset_key, None)
+        # Only our own pickles are removed; stored datasets belong to the dataset store
+        if path and path.startswith(self._dataset_dir) and os.path.exists(path):
+            os.remove(path)
+
+    def namespace_memory(self, dataset_key: str) -> Dict[str, int]:
+        """Summed over the workers currently holding dataset_key (each has its own copy)"""
+        totals = namespace_memory(None)
+        for key, memory in self._worker_memory.values():
+            if key == dataset_key:
+                for name in totals:
+                    totals[name] += memory[name]
+        return totals
+
+    async def run(self, code: Optional[str], dataset_key: str, plot_path: Optional[str] = None,
+                  job_id: Optional[str] = None, timeout: Optional[float] = None,
+                  extra_figures: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        self._ensure_started()
+        timeout = timeout or config.EXEC_TIMEOUT
+        job_id = job_id or uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+
+        worker = await self._idle.get()
+        task = asyncio.current_task()
+        self._running[job_id] = task
+        healthy = False
+        try:
+            # Warm-up imports are not charged to the job's timeout
+            await self._wait_ready(worker)
+            worker.conn.send({
+                'code': code,
+                'plot_path': plot_path,
+                'extra_figures': extra_figures,
+                'dataset_key': dataset_key,
+                'dataset_path': self._dataset_paths.get(dataset_key)
+            })
+            result = await asyncio.wait_for(loop.run_in_executor(None, worker.conn.recv), timeout)
+            healthy = True
+            get_startup_metrics().record_request_imports(f"worker {worker.process.pid}", result.pop('imports', None))
+            memory = result.pop('namespace_memory', None)
+            if memory is not None:
+                self._worker_memory[worker.process.pid] = (dataset_key, memory)
+            return result
+        except asyncio.TimeoutError:
+            return _failure(f"Code execution timed out after {timeout}s")
+        except asyncio.CancelledError:
+            if self._running.get(job_id) is None:
+                # Cancelled through cancel(): report it instead of propagating
+                if hasattr(task, 'uncancel'):
+                    task.uncancel()
+                return _failure("Code execution was cancelled")
+            raise
+        except (EOFError, OSError):
+            return _failure("Code execution worker crashed (likely exceeded its memory limit)")
+        finally:
+            self._running.pop(job_id, None)
+            if not healthy:
+                # The worker may still be running the job; replace it to reclaim the slot
+                self._worker_memory.pop(worker.process.pid, None)
+                worker.kill()
+                worker = _Worker(self._context, self.memory_limit_mb)
+            self._idle.put_nowait(worker)
+
+    async def _wait_ready(self, worker: _Worker) -> None:
+        if not worker.ready:
+            await asyncio.get_running_loop().run_in_executor(None, worker.wait_ready)
+            get_startup_metrics().record_worker(worker.process.pid, worker.imports)
+
+    async def prewarm(self) -> Dict[str, Optional[float]]:
+        """Start the workers now instead of on the first upload or job, and wait for their imports"""
+        self._ensure_started()
+        imports = {}
+        for _ in range(self.workers):
+            worker = await self._idle.get()
+            try:
+                await self._wait_ready(worker)
+                imports = worker.imports
+            except (EOFError, OSError):
+                worker.kill()
+                worker = _Worker(self._context, self.memory_limit_mb)
+            finally:
+                self._idle.put_nowait(worker)
+        return imports
+
+    def cancel(self, job_id: str) -> bool:
+        task = self._running.pop(job_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def shutdown(self) -> None:
+        if self._idle is not None:
+            while not self._idle.empty():
+                worker = self._idle.get_nowait()
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.kill()
+        for task in list(self._running.values()) + list(self._preloads):
+            task.cancel()
+        shutil.rmtree(self._dataset_dir, ignore_errors=True)
+
+
+def create_executor() -> CodeExecutor:
+    """Executor backend selected by Config.EXEC_BACKEND"""
+    if config.EXEC_BACKEND == 'inline':
+        return InlineExecutor()
+    if config.EXEC_BACKEND == 'process':
+        return WorkerPoolExecutor()
+    raise ValueError(f"Unknown EXEC_BACKEND: {config.EXEC_BACKEND}")
@@ -1,10 +1,25 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, Any
-import io
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import nullcontext
+import os
+import hashlib
 import json
+import datetime
+import io
+import tempfile
 import traceback
+import warnings
 import csv
+from ..config import config
+from .dtype_optimizer import optimize_dtypes
+from .readers import detect_reader, open_decompressed, upload_suffix
+
+try:
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow is optional; pandas' C engine is used without it
+    pa_csv = None
 
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -14,119 +29,775 @@ class NpEncoder(json.JSONEncoder):
             return float(obj)
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
         if pd.isna(obj):
             return None
         return super(NpEncoder, self).default(obj)
 
-class DataService:
+def count_duplicate_rows(row_hashes: np.ndarray) -> int:
+    """Count duplicate rows from 64-bit row hashes (one sort instead of df.duplicated())"""
+    return len(row_hashes) - len(np.unique(row_hashes))
+
+def normalized_row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """64-bit row hashes with numerics hashed as float64 so int/float inference doesn't matter"""
+    numeric_cols = [column for column, dtype in df.dtypes.items() if pd.api.types.is_numeric_dtype(dtype)]
+    hashable = df.astype({column: 'float64' for column in numeric_cols}) if numeric_cols else df
+    return pd.util.hash_pandas_object(hashable, index=False).to_numpy()
+
+def dataset_fingerprint(df: pd.DataFrame, row_hashes: Optional[np.ndarray] = None) -> str:
+    """Content hash of a frame's schema and rows"""
+    if row_hashes is None:
+        row_hashes = normalized_row_hashes(df)
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in df.dtypes.items()]).encode())
+    digest.update(np.ascontiguousarray(row_hashes).tobytes())
+    return digest.hexdigest()
+
+def estimate_distinct(counts: pd.Series, sample_size: int, population: int) -> int:
+    """Distinct values in a population from value counts in a uniform sample of it.
+
+    Haas-Stokes Duj1 estimator (as used by PostgreSQL's ANALYZE): n*d / (n - f1 + f1*n/N),
+    with d the distinct values in the sample and f1 those seen exactly once.
+    """
+    if sample_size == 0 or population == 0:
+        return 0
+    distinct = len(counts)
+    singletons = int((counts == 1).sum())
+    estimate = sample_size * distinct / (sample_size - singletons + singletons * sample_size / population)
+    return int(min(max(round(estimate), distinct), population))
+
+def upload_key(content_hash: str, columns: Optional[List[str]] = None) -> str:
+    """Key identifying what an upload parses into: its content and the columns requested"""
+    if not columns:
+        return content_hash
+    return hashlib.sha256(json.dumps([content_hash, columns]).encode()).hexdigest()
+
+def select_columns(df: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+    if not columns:
+        return df
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Columns not found in the file: {', '.join(map(str, missing))}")
+    return df[columns]
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds Config.MAX_FILE_SIZE while streaming"""
+    pass
+
+class IncrementalSummary:
+    """Accumulate summary statistics chunk by chunk while a CSV is parsed"""
+
     def __init__(self):
+        self.total_rows = 0
+        self.null_counts = pd.Series(dtype='int64')
+        self._row_hashes = []
+        self._kinds = {}
+        self._value_counts = {}
+        # Per numeric column: non-null count, running mean, sum of squared deviations, min, max
+        self._count = pd.Series(dtype='float64')
+        self._mean = pd.Series(dtype='float64')
+        self._m2 = pd.Series(dtype='float64')
+        self._min = pd.Series(dtype='float64')
+        self._max = pd.Series(dtype='float64')
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Fold one parsed chunk into the running statistics"""
+        self.total_rows += len(chunk)
+        self.null_counts = self.null_counts.add(chunk.isnull().sum(), fill_value=0)
+
+        numeric_cols = []
+        for column in chunk.columns:
+            is_numeric = pd.api.types.is_numeric_dtype(chunk[column])
+            self._kinds.setdefault(column, set()).add('numeric' if is_numeric else 'other')
+            if is_numeric:
+                numeric_cols.append(column)
+            else:
+                counts = chunk[column].value_counts()
+                previous = self._value_counts.get(column)
+                self._value_counts[column] = counts if previous is None else previous.add(counts, fill_value=0)
+
+        # Hashed with numerics as float64 so rows match even when a later chunk infers int vs float
+        self._row_hashes.append(normalized_row_hashes(chunk))
+
+        if numeric_cols:
+            self._merge_moments(chunk[numeric_cols].astype('float64'))
+
+    def _merge_moments(self, block: pd.DataFrame) -> None:
+        """Combine chunk moments with the running ones (Chan et al. parallel variance)"""
+        count_b = block.count().astype('float64')
+        mean_b = block.mean()
+        m2_b = ((block - mean_b) ** 2).sum()
+
+        columns = self._count.index.union(block.columns, sort=False)
+        count_a = self._count.reindex(columns, fill_value=0.0)
+        mean_a = self._mean.reindex(columns).fillna(0.0)
+        m2_a = self._m2.reindex(columns, fill_value=0.0)
+        count_b = count_b.reindex(columns, fill_value=0.0)
+        mean_b = mean_b.reindex(columns).fillna(0.0)
+        m2_b = m2_b.reindex(columns, fill_value=0.0)
+
+        count = count_a + count_b
+        safe_count = count.where(count > 0, 1.0)
+        delta = mean_b - mean_a
+        self._mean = (mean_a + delta * count_b / safe_count).where(count > 0)
+        self._m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / safe_count
+        self._count = count
+        self._min = pd.concat([self._min.reindex(columns), block.min()], axis=1).min(axis=1)
+        self._max = pd.concat([self._max.reindex(columns), block.max()], axis=1).max(axis=1)
+
+    def row_hashes(self) -> np.ndarray:
+        """All row hashes seen so far, in file order"""
+        if not self._row_hashes:
+            return np.array([], dtype='uint64')
+        if len(self._row_hashes) > 1:
+            self._row_hashes = [np.concatenate(self._row_hashes)]
+        return self._row_hashes[0]
+
+    def finalize(self, df: pd.DataFrame, get_column_info) -> Dict:
+        """Build the get_summary_stats payload for the fully assembled frame"""
+        total_cells = self.total_rows * len(df.columns)
+        missing_cells = int(self.null_counts.sum())
+
+        duplicate_rows = count_duplicate_rows(self.row_hashes())
+
+        numeric_cols = [
+            column for column in df.columns
+            if self._kinds.get(column) == {'numeric'} and pd.api.types.is_numeric_dtype(df[column])
+        ]
+        medians = df[numeric_cols].median() if numeric_cols else pd.Series(dtype='float64')
+
+        # Columns whose dtype changed between chunks are profiled exactly from the final frame
+        mixed_cols = [
+            column for column in df.columns
+            if column not in numeric_cols and self._kinds.get(column) != {'other'}
+        ]
+        column_info = get_column_info(df[mixed_cols], self.null_counts) if mixed_cols else {}
+
+        for column in df.columns:
+            if column in column_info:
+                continue
+
+            null_count = int(self.null_counts.get(column, 0))
+            info = {
+                'dtype': str(df[column].dtype),
+                'null_count': null_count,
+                'total_count': self.total_rows,
+                'null_percentage': round(null_count / self.total_rows * 100, 2) if self.total_rows else 0.0
+            }
+
+            if column in numeric_cols:
+                count = self._count[column]
+                if count > 0:
+                    info.update({
+                        'mean': float(self._mean[column]),
+                        'median': float(medians[column]),
+                        'std': float(np.sqrt(self._m2[column] / (count - 1))) if count > 1 else float('nan'),
+                        'min': float(self._min[column]),
+                        'max': float(self._max[column])
+                    })
+            else:
+                counts = self._value_counts.get(column, pd.Series(dtype='int64'))
+                info.update({
+                    'unique_count': len(counts),
+                    'top_values': {
+                        str(value): int(count)
+                        for value, count in counts.sort_values(ascending=False, kind='stable').head(5).items()
+                    }
+                })
+
+            column_info[column] = info
+
+        return {
+            'total_rows': self.total_rows,
+            'total_columns': len(df.columns),
+            'total_cells': total_cells,
+            'missing_cells': missing_cells,
+            'missing_percentage': round(missing_cells / total_cells * 100, 2) if total_cells else 0.0,
+            'duplicate_rows': duplicate_rows,
+            'column_info': {column: column_info[column] for column in df.columns},
+            'columns': df.columns.tolist(),
+            'sample_rows': df.head().replace({np.nan: None}).to_dict(orient='records')
+        }
+
+class ParsedDataset:
+    """An upload parsed and profiled, ready to be made the current dataset in one step"""
+
+    def __init__(self, df: pd.DataFrame, summary: Dict[str, Any], fingerprint: str):
+        self.df = df
+        self.summary = summary
+        self.fingerprint = fingerprint
+
+
+class DataService:
+    def __init__(self, store=None):
         self._current_df = None
+        self._dataset_version = 0
+        self._dataset_fingerprint = None
+        # Summaries keyed by dataset fingerprint; re-uploading the same data reuses its entry
+        self._summary_cache = OrderedDict()
+        self._memory_usage = None
+        self._spill_path = None
+        # Sample-based summary served while the exact profile of the same upload is computed,
+        # and the sample it describes (made current if the exact profile fails)
+        self._sampled_summary = None
+        self._sample_df = None
+        # Optional DatasetStore: parsed frames persisted by fingerprint and memory-mapped back
+        self.store = store
+
+    def set_current_df(self, df: pd.DataFrame, summary: Optional[Dict] = None,
+                       fingerprint: Optional[str] = None) -> None:
+        """Replace the current dataset, bumping its version and invalidating the cached summary"""
+        self.discard_spill()
+        self._current_df = df
+        self._dataset_version += 1
+        self._dataset_fingerprint = fingerprint or dataset_fingerprint(df)
+        self._memory_usage = None
+        if summary is not None:
+            self._cache_summary(self._dataset_fingerprint, summary)
+
+    def _cache_summary(self, fingerprint: str, summary: Dict) -> None:
+        self._summary_cache[fingerprint] = summary
+        self._summary_cache.move_to_end(fingerprint)
+        while len(self._summary_cache) > config.SUMMARY_CACHE_SIZE:
+            self._summary_cache.popitem(last=False)
 
-    def clean_column_names(self, df: pd.DataFrame) -> pd.DataFrame:
+    def get_current_summary(self) -> Dict:
+        """Summary statistics of the current dataset, computed once per dataset version"""
+        df = self.current_df
+        summary = self._summary_cache.get(self._dataset_fingerprint)
+        if summary is None:
+            summary = self.get_summary_stats(df)
+            self._cache_summary(self._dataset_fingerprint, summary)
+        else:
+            self._summary_cache.move_to_end(self._dataset_fingerprint)
+        return summary
+
+    def get_profile(self) -> Dict:
+        """The sampled summary while the exact one is being computed, else the exact summary"""
+        if self._sampled_summary is not None:
+            return self._sampled_summary
+        return self.get_current_summary()
+
+    @property
+    def is_refining(self) -> bool:
+        return self._sampled_summary is not None and self._sampled_summary['profile']['status'] == 'refining'
+
+    def memory_usage(self) -> int:
+        """Bytes held by the in-memory frame (0 when nothing is loaded or it was spilled)"""
+        if self._current_df is None:
+            return 0
+        if self._memory_usage is None:
+            self._memory_usage = int(self._current_df.memory_usage(deep=True).sum())
+        return self._memory_usage
+
+    @property
+    def is_spilled(self) -> bool:
+        return self._spill_path is not None
+
+    @property
+    def dataset_path(self) -> Optional[str]:
+        """Path of the current dataset in the dataset store, if it is stored"""
+        if self.store is None or not self._dataset_fingerprint or not self.store.has(self._dataset_fingerprint):
+            return None
+        return str(self.store.dataset_path(self._dataset_fingerprint))
+
+    def load_stored(self, fingerprint: str) -> bool:
+        """Make a stored dataset current (memory-mapped, with its stored summary)"""
+        stored = self.store.load(fingerprint) if self.store is not None else None
+        if stored is None:
+            return False
+        df, summary = stored
+        self.set_current_df(df, summary, fingerprint)
+        return True
+
+    def spill(self, path: str) -> None:
+        """Release the frame from memory, writing it to Parquet (pickle if Arrow can't encode it)
+        unless the dataset store already holds it"""
+        if self._current_df is None:
+            return
+        if self.dataset_path:
+            self._spill_path = self.dataset_path
+            self._current_df = None
+            return
+        path = os.path.splitext(str(path))[0]
+        try:
+            self._current_df.to_parquet(path + '.parquet')
+            self._spill_path = path + '.parquet'
+        except Exception as e:
+            print(f"Parquet spill failed, falling back to pickle: {str(e)}")
+            self._current_df.to_pickle(path + '.pkl')
+            self._spill_path = path + '.pkl'
+        self._current_df = None
+
+    def restore(self) -> None:
+        """Reload a spilled frame; its version, fingerprint and cached summary are unchanged"""
+        if self._spill_path is None:
+            return
+        if self._spill_path == self.dataset_path:
+            self._current_df = self.store.load(self._dataset_fingerprint)[0]
+        elif self._spill_path.endswith('.parquet'):
+            self._current_df = pd.read_parquet(self._spill_path)
+        else:
+            self._current_df = pd.read_pickle(self._spill_path)
+        self.discard_spill()
+
+    def discard_spill(self) -> None:
+        # Stored datasets outlive the spill; only our own spill files are removed
+        if self._spill_path and self._spill_path != self.dataset_path and os.path.exists(self._spill_path):
+            os.remove(self._spill_path)
+        self._spill_path = None
+
+    @property
+    def dataset_fingerprint(self) -> Optional[str]:
+        return self._dataset_fingerprint
+
+    @property
+    def dataset_version(self) -> int:
+        return self._dataset_version
+
+    def clean_column_names(self, df: pd.DataFrame, quote_wrapped: bool = False) -> pd.DataFrame:
         """Clean column names by removing unnecessary quotes and handling commas"""
 
+        # Headers read from spreadsheets may be numbers (e.g. years); names are always strings
+        df.columns = df.columns.astype(str)
         if len(df.columns) == 1 and ',' in df.columns[0]:
+            # Sniffing missed a quote-wrapped export: split the single column in one vectorized pass
             new_columns = df.columns[0].replace('"', '').split(',')
-
-            df = pd.DataFrame([
-                row[0].replace('"', '').split(',')
-                for row in df.values
-            ], columns=new_columns)
-
-            # Convert numeric columns
-            for col in df.columns:
-                try:
-                    if not col in ['Entity', 'Code']:  # Keep these as strings
-                        df[col] = pd.to_numeric(df[col], errors='coerce')
-                except:
-                    pass
+            df = df.iloc[:, 0].str.replace('"', '', regex=False).str.split(',', expand=True)
+            df.columns = new_columns[:len(df.columns)]
+            quote_wrapped = True
         else:
             # Clean existing column names
             df.columns = df.columns.str.strip().str.replace('"', '').str.replace("'", "")
 
+        if quote_wrapped:
+            # Each row was wrapped in one pair of quotes, so stray quotes can only be left on
+            # the outer columns; strip them and re-infer those columns' types
+            for column in df.select_dtypes(include='object').columns:
+                values = df[column].str.replace('"', '', regex=False)
+                numeric = pd.to_numeric(values, errors='coerce')
+                df[column] = numeric if numeric.notna().sum() == values.notna().sum() else values
+
         return df
 
-    def get_column_info(self, df: pd.DataFrame) -> Dict:
+    def sniff_dialect(self, path: str, compression: Optional[str] = None) -> Dict[str, Any]:
+        """Probe the first CSV_SNIFF_BYTES of a file for encoding, delimiter and quoting"""
+        with open_decompressed(path, compression) as f:
+            sample = f.read(config.CSV_SNIFF_BYTES)
+            truncated = bool(f.read(1))
+
+        if sample.startswith(b'\xef\xbb\xbf'):
+            encoding = 'utf-8-sig'
+        elif sample.startswith((b'\xff\xfe', b'\xfe\xff')):
+            encoding = 'utf-16'
+        else:
+            encoding = 'utf-8'
+
+        try:
+            text = sample.decode(encoding)
+        except UnicodeDecodeError as e:
+            if truncated and e.start >= len(sample) - 3:
+                # The probe cut a multi-byte character in half
+                text = sample[:e.start].decode(encoding)
+            else:
+                encoding = 'latin-1'
+                text = sample.decode(encoding)
+
+        lines = text.splitlines()
+        if truncated and len(lines) > 1:
+            lines = lines[:-1]
+        lines = [line for line in lines if line.strip()]
+        print("Raw content first line:", lines[0] if lines else '')
+
+        dialect = {
+            'encoding': encoding,
+            'delimiter': ',',
+            'quotechar': '"',
+            'escapechar': None,
+            'doublequote': True,
+            'quote_wrapped': False
+        }
+
+        # Exports that wrap every row in a single pair of quotes: "a,b,c"
+        if lines and all(
+            line.startswith('"') and line.endswith('"') and line.count('"') == 2 and ',' in line
+            for line in lines
+        ):
+            dialect['quote_wrapped'] = True
+            return dialect
+
+        try:
+            sniffed = csv.Sniffer().sniff('\n'.join(lines), delimiters=',;\t|')
+            dialect.update({
+                'delimiter': sniffed.delimiter,
+                'quotechar': sniffed.quotechar or '"',
+                'escapechar': sniffed.escapechar,
+                # The Sniffer reports doublequote=False whenever the probe has no "" in it;
+                # RFC 4180 doubling only gives way to an escape character it actually found
+                'doublequote': sniffed.doublequote if sniffed.escapechar else True
+            })
+        except csv.Error:
+            pass
+
+        return dialect
+
+    def _numeric_profile(self, block: pd.DataFrame) -> Dict[str, Dict[str, float]]:
+        """Compute mean/median/std/min/max for a numeric block with batched NumPy reductions"""
+        stats = {}
+        if block.shape[1] == 0:
+            return stats
+
+        # Convert column batches to 2D float arrays, bounding the size of each copy
+        batch_cols = max(1, config.PROFILE_BATCH_CELLS // max(len(block), 1))
+        for start in range(0, block.shape[1], batch_cols):
+            part = block.iloc[:, start:start + batch_cols]
+            values = part.to_numpy(dtype='float64', na_value=np.nan)
+
+            with warnings.catch_warnings():
+                # All-NaN columns are skipped below; silence NumPy's empty-slice warnings
+                warnings.simplefilter('ignore', RuntimeWarning)
+                counts = np.count_nonzero(~np.isnan(values), axis=0)
+                means = np.nanmean(values, axis=0)
+                medians = np.nanmedian(values, axis=0)
+                stds = np.nanstd(values, axis=0, ddof=1)
+                mins = np.nanmin(values, axis=0)
+                maxs = np.nanmax(values, axis=0)
+
+            for i, column in enumerate(part.columns):
+                if counts[i]:
+                    stats[column] = {
+                        'mean': float(means[i]),
+                        'median': float(medians[i]),
+                        'std': float(stds[i]),
+                        'min': float(mins[i]),
+                        'max': float(maxs[i])
+                    }
+
+        return stats
+
+    def _categorical_profile(self, series: pd.Series) -> Dict[str, Any]:
+        """Distinct count and top values from a single hashed value_counts pass"""
+        counts = series.value_counts()
+        counts = counts[counts > 0]  # Categoricals also list their unused categories
+        return {
+            'unique_count': len(counts),
+            'top_values': {
+                str(value): count
+                for value, count in counts.head(5).items()
+            }
+        }
+
+    def get_column_info(self, df: pd.DataFrame, null_counts: Optional[pd.Series] = None) -> Dict:
         """Get detailed information about each column"""
+        if null_counts is None:
+            null_counts = df.isnull().sum()
+
+        total_count = len(df)
+        numeric_cols = [
+            column for column, dtype in df.dtypes.items()
+            if pd.api.types.is_numeric_dtype(dtype)
+        ]
+        numeric_stats = self._numeric_profile(df[numeric_cols])
+        numeric_cols = set(numeric_cols)
+
         column_info = {}
-        for column in df.columns:
+        for column, dtype in df.dtypes.items():
+            null_count = int(null_counts[column])
             info = {
-                'dtype': str(df[column].dtype),
-                'null_count': int(df[column].isnull().sum()),
-                'total_count': len(df[column]),
-                'null_percentage': round(df[column].isnull().sum() / len(df[column]) * 100, 2)
+                'dtype': str(dtype),
+                'null_count': null_count,
+                'total_count': total_count,
+                'null_percentage': round(null_count / total_count * 100, 2) if total_count else 0.0
             }
 
-            if pd.api.types.is_numeric_dtype(df[column]):
-                not_null_series = df[column].dropna()
-                if not not_null_series.empty:
-                    info.update({
-                        'mean': float(not_null_series.mean()),
-                        'median': float(not_null_series.median()),
-                        'std': float(not_null_series.std()),
-                        'min': float(not_null_series.min()),
-                        'max': float(not_null_series.max())
-                    })
+            if column in numeric_cols:
+                info.update(numeric_stats.get(column, {}))
             else:
-                not_null_series = df[column].dropna()
-                info.update({
-                    'unique_count': len(not_null_series.unique()),
-                    'top_values': not_null_series.value_counts().head(5).to_dict()
-                })
+                info.update(self._categorical_profile(df[column]))
 
             column_info[column] = info
 
         return column_info
 
-    def get_summary_stats(self, df: pd.DataFrame) -> Dict:
-        """Generate initial summary statistics"""
+    def get_summary_stats(self, df: pd.DataFrame, row_hashes: Optional[np.ndarray] = None) -> Dict:
+        """Generate initial summary statistics (row_hashes: normalized_row_hashes(df), if known)"""
+        if row_hashes is None:
+            row_hashes = normalized_row_hashes(df)
+        null_counts = df.isnull().sum()
+        missing_cells = int(null_counts.sum())
         return {
             'total_rows': len(df),
             'total_columns': len(df.columns),
             'total_cells': df.size,
-            'missing_cells': df.isnull().sum().sum(),
-            'missing_percentage': round(df.isnull().sum().sum() / df.size * 100, 2),
-            'duplicate_rows': df.duplicated().sum(),
-            'column_info': self.get_column_info(df),
+            'missing_cells': missing_cells,
+            'missing_percentage': round(missing_cells / df.size * 100, 2) if df.size else 0.0,
+            'duplicate_rows': count_duplicate_rows(row_hashes),
+            'column_info': self.get_column_info(df, null_counts),
             'columns': df.columns.tolist(),
             'sample_rows': df.head().replace({np.nan: None}).to_dict(orient='records')
         }
 
-    def analyze_data(self, contents: bytes) -> Dict[str, Any]:
-        """Analyze uploaded data file"""
+    def should_sample(self, path: str, upload_hash: Optional[str] = None) -> bool:
+        """Whether to answer an upload with a sampled profile first (see PROFILE_MODE)"""
+        if config.PROFILE_MODE == 'exact':
+            return False
+        if detect_reader(path).name != 'csv':
+            return False  # Byte-offset sampling needs uncompressed delimited text
+        if upload_hash and self.store is not None and self.store.lookup_upload(upload_hash):
+            return False  # Already parsed once; the exact summary is stored
+        if config.PROFILE_MODE == 'auto' and os.path.getsize(path) < config.PROFILE_SAMPLE_MIN_BYTES:
+            return False
+        return True
+
+    def _sample_lines(self, path: str) -> Tuple[bytes, int]:
+        """Header plus about PROFILE_SAMPLE_ROWS lines taken from PROFILE_SAMPLE_STRATA evenly
+        spaced byte ranges (the first one at the top of the file), and the estimated row count"""
+        size = os.path.getsize(path)
+        strata = max(1, config.PROFILE_SAMPLE_STRATA)
+        per_stratum = max(1, config.PROFILE_SAMPLE_ROWS // strata)
+        rng = np.random.default_rng(size)  # Same file, same sample
+
+        lines = []
+        with open(path, 'rb') as f:
+            header = f.readline()
+            start = f.tell()
+            span = (size - start) / strata
+            for stratum in range(strata):
+                offset = start if stratum == 0 else start + int(span * (stratum + rng.random()))
+                if offset > start:
+                    # Skip the rest of the line the offset landed in
+                    f.seek(offset - 1)
+                    f.readline()
+                for _ in range(per_stratum):
+                    line = f.readline()
+                    if not line:
+                        break
+                    lines.append(line)
+
+        if not lines:
+            return header, 0
+        average_line = sum(len(line) for line in lines) / len(lines)
+        return header + b''.join(lines), max(len(lines), round((size - start) / average_line))
+
+    def sample_profile(self, path: str, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Approximate summary of an upload from a sample of its rows, without parsing it all.
+
+        Counts are scaled to the estimated row count, distinct counts use estimate_distinct()
+        and medians are those of the sample. The summary is served by get_profile() until
+        adopt() replaces it with the exact one.
+        """
+        dialect = self.sniff_dialect(path)
+        if dialect['encoding'] not in ('utf-8', 'utf-8-sig', 'latin-1'):
+            raise ValueError(f"Cannot sample {dialect['encoding']} files by byte offset")
+
+        content, estimated_rows = self._sample_lines(path)
+        sample = pd.read_csv(
+            io.BytesIO(content),
+            encoding=dialect['encoding'],
+            sep=dialect['delimiter'],
+            quotechar=dialect['quotechar'],
+            quoting=csv.QUOTE_NONE if dialect['quote_wrapped'] else csv.QUOTE_MINIMAL,
+            escapechar=dialect['escapechar'],
+            doublequote=dialect['doublequote'],
+            on_bad_lines='skip'  # A range may start inside a quoted multi-line field
+        )
+        sample = select_columns(self.clean_column_names(sample, dialect['quote_wrapped']), columns)
+        if config.DTYPE_OPTIMIZE:
+            sample, _ = optimize_dtypes(sample)
+
+        summary = self.get_summary_stats(sample)
+        scale = estimated_rows / len(sample) if len(sample) else 0.0
+        for column, info in summary['column_info'].items():
+            info['null_count'] = round(info['null_count'] * scale)
+            info['total_count'] = estimated_rows
+            if 'unique_count' in info:
+                values = sample[column]
+                info['unique_count'] = estimate_distinct(
+                    values.value_counts(), int(values.count()), round(values.count() * scale)
+                )
+                info['top_values'] = {value: round(count * scale) for value, count in info['top_values'].items()}
+
+        row_counts = pd.Series(normalized_row_hashes(sample)).value_counts()
+        summary.update({
+            'total_rows': estimated_rows,
+            'total_cells': estimated_rows * len(sample.columns),
+            'missing_cells': round(summary['missing_cells'] * scale),
+            'duplicate_rows': estimated_rows - estimate_distinct(row_counts, len(sample), estimated_rows),
+            'profile': {
+                'mode': 'sampled',
+                'status': 'refining',
+                'sample_rows': len(sample),
+                'estimated_rows': estimated_rows
+            }
+        })
+        self._sampled_summary = summary
+        self._sample_df = sample
+        return summary
+
+    def refinement_failed(self, error: str) -> None:
+        """Fall back to the sample when the exact profile fails: its summary, marked as failed,
+        stays served and the sample becomes the current dataset (the previous dataset must not
+        be analyzed in place of the one that failed)"""
+        if self._sampled_summary is None or self._sample_df is None:
+            return
+        self._sampled_summary['profile'].update({'status': 'failed', 'error': error})
+        self.set_current_df(self._sample_df, self._sampled_summary)
+        self._sample_df = None
+
+    async def spool_upload(self, file) -> Tuple[str, str]:
+        """Stream an upload to a temporary file in fixed-size chunks, enforcing MAX_FILE_SIZE.
+
+        Returns the file's path and the SHA-256 of its content.
+        """
+        size = 0
+        digest = hashlib.sha256()
+        # The spool file keeps the upload's extension so its reader can be found by name too
+        spool = tempfile.NamedTemporaryFile(delete=False, suffix=upload_suffix(file.filename or ''),
+                                            dir=config.UPLOAD_SPOOL_DIR)
         try:
-            # Decode content
-            text_content = contents.decode("UTF8")
-            print("Raw content first line:", text_content.split('\n')[0])
+            with spool:
+                while True:
+                    chunk = await file.read(config.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > config.MAX_FILE_SIZE:
+                        raise UploadTooLargeError(
+                            f"File exceeds the maximum upload size of {config.MAX_FILE_SIZE} bytes"
+                        )
+                    spool.write(chunk)
+                    digest.update(chunk)
+        except Exception:
+            os.remove(spool.name)
+            raise
+
+        return spool.name, digest.hexdigest()
 
-            # Try different parsing approaches
+    def _read_arrow(self, path: str, dialect: Dict[str, Any], compression: Optional[str] = None) -> pd.DataFrame:
+        """Parse the whole file in one multi-threaded pass with pyarrow"""
+        quoting = not dialect['quote_wrapped']
+        with open_decompressed(path, compression) if compression else nullcontext(path) as source:
+            table = pa_csv.read_csv(
+                source,
+                read_options=pa_csv.ReadOptions(encoding=dialect['encoding']),
+                parse_options=pa_csv.ParseOptions(
+                    delimiter=dialect['delimiter'],
+                    quote_char=dialect['quotechar'] if quoting else False,
+                    double_quote=dialect['doublequote'],
+                    escape_char=dialect['escapechar'] or False
+                ),
+                convert_options=pa_csv.ConvertOptions(strings_can_be_null=True)
+            )
+        return table.to_pandas()
+
+    def _read_chunks(self, path: str, dialect: Dict[str, Any], compression: Optional[str] = None,
+                     columns: Optional[List[str]] = None):
+        """Parse a CSV file in row batches with pandas, profiling each batch as it arrives"""
+        summary = IncrementalSummary()
+        chunks = []
+        with open_decompressed(path, compression) if compression else nullcontext(path) as source:
+            with pd.read_csv(
+                source,
+                chunksize=config.CSV_CHUNK_ROWS,
+                encoding=dialect['encoding'],
+                sep=dialect['delimiter'],
+                quotechar=dialect['quotechar'],
+                quoting=csv.QUOTE_NONE if dialect['quote_wrapped'] else csv.QUOTE_MINIMAL,
+                escapechar=dialect['escapechar'],
+                doublequote=dialect['doublequote']
+            ) as reader:
+                for chunk in reader:
+                    chunk = select_columns(self.clean_column_names(chunk, dialect['quote_wrapped']), columns)
+                    summary.update(chunk)
+                    chunks.append(chunk)
+
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        return df, summary
+
+    def _parse_csv(self, path: str, dialect: Dict[str, Any], compression: Optional[str] = None,
+                   columns: Optional[List[str]] = None):
+        """Parse the file exactly once, preferring the pyarrow engine when it is installed"""
+        if pa_csv is not None and config.CSV_ENGINE in ('auto', 'pyarrow'):
             try:
-                # First attempt: standard read_csv
-                df = pd.read_csv(io.StringIO(text_content))
-            except:
-                try:
-                    # Second attempt: with explicit separator
-                    df = pd.read_csv(io.StringIO(text_content), sep=',', quotechar='"', escapechar='\\')
-                except:
-                    # Last attempt: read as single column and split
-                    df = pd.read_csv(io.StringIO(text_content), header=0)
-
-            # Clean up the column names and data
-            df = self.clean_column_names(df)
-
-            # Store the dataframe
-            self._current_df = df
+                df = self._read_arrow(path, dialect, compression)
+            except Exception as e:
+                print(f"pyarrow could not parse the file, falling back to pandas: {str(e)}")
+            else:
+                # Parsed in one piece, so prepare_data profiles it with get_summary_stats()
+                return select_columns(self.clean_column_names(df, dialect['quote_wrapped']), columns), None
+
+        return self._read_chunks(path, dialect, compression, columns)
+
+    def analyze_data(self, path: str, upload_hash: Optional[str] = None,
+                     columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Analyze an uploaded data file and make it the current dataset (see prepare_data)"""
+        return self.adopt(self.prepare_data(path, upload_hash, columns))
+
+    def adopt(self, parsed: ParsedDataset) -> Dict[str, Any]:
+        """Make a prepared dataset current, replacing any sampled summary; returns its summary"""
+        self.set_current_df(parsed.df, parsed.summary, parsed.fingerprint)
+        self._sampled_summary = None
+        self._sample_df = None
+        return parsed.summary
+
+    def prepare_data(self, path: str, upload_hash: Optional[str] = None,
+                     columns: Optional[List[str]] = None) -> ParsedDataset:
+        """Parse and profile an upload spooled to disk, in any format with a registered reader.
+
+        Leaves the current dataset untouched, so it can run in a thread while requests keep
+        reading it; adopt() swaps the result in. Only `columns` are kept when given. With a
+        dataset store, an upload whose upload_key() was seen before is not parsed again: its
+        stored frame is memory-mapped and its stored summary returned.
+        """
+        try:
+            if upload_hash and self.store is not None:
+                fingerprint = self.store.lookup_upload(upload_hash)
+                stored = self.store.load(fingerprint) if fingerprint else None
+                if stored is not None:
+                    print(f"Reusing stored dataset {fingerprint[:12]} for identical upload")
+                    return ParsedDataset(stored[0], stored[1], fingerprint)
+
+            reader = detect_reader(path)
+            print(f"Reading upload as {reader.name}")
+            df, summary = reader.read(self, path, columns)
+            if summary is None:
+                df = select_columns(df, columns)
+            # Hashed before dtype optimization, like the chunks of a streamed parse
+            row_hashes = summary.row_hashes() if summary is not None else normalized_row_hashes(df)
 
             # Print debug information
             print("Final columns:", df.columns.tolist())
             print("Sample data:\n", df.head())
 
-            return self.get_summary_stats(df)
+            dtype_report = None
+            if config.DTYPE_OPTIMIZE:
+                df, dtype_report = optimize_dtypes(df)
+
+            if summary is not None:
+                summary_stats = summary.finalize(df, self.get_column_info)
+            else:
+                # Frames parsed in one piece are profiled with the vectorized reductions
+                summary_stats = self.get_summary_stats(df, row_hashes)
+            if dtype_report is not None:
+                summary_stats['dtype_optimization'] = dtype_report
+
+            # Keep the summary with the dataframe so /analyze never recomputes it
+            fingerprint = dataset_fingerprint(df, row_hashes)
+            if self.store is not None and self.store.put(df, fingerprint, summary_stats) and upload_hash:
+                self.store.index_upload(upload_hash, fingerprint)
+
+            return ParsedDataset(df, summary_stats, fingerprint)
 
         except Exception as e:
             traceback.print_exc()
             raise ValueError(f"Error analyzing data: {str(e)}")
 
+    @property
+    def has_data(self) -> bool:
+        """Whether a dataset is loaded (in memory or spilled to disk)"""
+        return self._current_df is not None or self.is_spilled
+
     @property
     def current_df(self):
         if self._current_df is None:
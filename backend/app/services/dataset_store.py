@@ -0,0 +1,160 @@
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+import json
+import os
+import threading
+import uuid
+
+import pandas as pd
+
+from ..config import config
+from .data_service import NpEncoder
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional; without it nothing is persisted
+    pa = None
+    feather = None
+else:
+    ARROW_STRING_TYPES = {
+        pa.string(): pd.StringDtype('pyarrow'),
+        pa.large_string(): pd.StringDtype('pyarrow')
+    }
+
+
+def read_dataset(path: str) -> pd.DataFrame:
+    """Load a stored dataset; Arrow files are memory-mapped and numeric columns stay zero-copy.
+
+    Zero-copy columns are read-only views of the file, so callers that let code write to the
+    frame must hand out a copy-on-write copy (and keep this frame referenced) rather than it.
+    """
+    if str(path).endswith('.arrow'):
+        source = pa.memory_map(str(path))
+        # Text comes back as Arrow-backed strings (mapped, not copied) unless those are disabled
+        types_mapper = ARROW_STRING_TYPES.get if config.DTYPE_ARROW_STRINGS else None
+        return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True, types_mapper=types_mapper)
+    return pd.read_pickle(path)
+
+
+class DatasetStore:
+    """Parsed datasets on disk, keyed by dataset fingerprint.
+
+    Frames are written once as uncompressed, single-chunk Arrow IPC (Feather v2) files so
+    any process can memory-map them without parsing or copying, alongside their summary
+    JSON. Two small indexes map a raw upload's hash to the dataset it parsed into (so the
+    same file is never parsed twice) and a session to its dataset (so it survives restarts).
+    Datasets no session refers to are pruned oldest-first beyond DATASET_STORE_MAX_MB.
+    """
+
+    def __init__(self, store_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.store_dir = Path(store_dir or config.DATASET_STORE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else config.DATASET_STORE_MAX_MB * 1024 * 1024
+        for subdir in ('data', 'uploads', 'sessions'):
+            (self.store_dir / subdir).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def dataset_path(self, fingerprint: str) -> Path:
+        return self.store_dir / 'data' / f"{fingerprint}.arrow"
+
+    def _summary_path(self, fingerprint: str) -> Path:
+        return self.store_dir / 'data' / f"{fingerprint}.json"
+
+    def has(self, fingerprint: str) -> bool:
+        return self.dataset_path(fingerprint).exists() and self._summary_path(fingerprint).exists()
+
+    def put(self, df: pd.DataFrame, fingerprint: str, summary: Dict[str, Any]) -> Optional[Path]:
+        """Persist a parsed dataset; returns its path, or None if Arrow cannot encode the frame"""
+        path = self.dataset_path(fingerprint)
+        if not self.has(fingerprint):
+            tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+            try:
+                tmp_path = path.with_name(path.name + tmp_suffix)
+                feather.write_feather(df, str(tmp_path), compression='uncompressed',
+                                      chunksize=max(len(df), 1))
+                summary_tmp = self._summary_path(fingerprint).with_name(f"{fingerprint}.json{tmp_suffix}")
+                summary_tmp.write_text(json.dumps(summary, cls=NpEncoder))
+                os.replace(summary_tmp, self._summary_path(fingerprint))
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Could not store dataset {fingerprint[:12]}: {str(e)}")
+                for leftover in path.parent.glob(f"*{tmp_suffix}"):
+                    leftover.unlink(missing_ok=True)
+                return None
+            self._prune()
+        return path
+
+    def load(self, fingerprint: str) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+        """Memory-map a stored dataset and read its summary"""
+        if not self.has(fingerprint):
+            return None
+        try:
+            path = self.dataset_path(fingerprint)
+            os.utime(path)  # Mark as recently used
+            df = read_dataset(str(path))
+            summary = json.loads(self._summary_path(fingerprint).read_text())
+            return df, summary
+        except Exception as e:
+            print(f"Could not load stored dataset {fingerprint[:12]}: {str(e)}")
+            return None
+
+    def lookup_upload(self, upload_hash: str) -> Optional[str]:
+        """Fingerprint of the dataset a previous identical upload parsed into, if still stored"""
+        fingerprint = self._read_index('uploads', upload_hash)
+        return fingerprint if fingerprint and self.has(fingerprint) else None
+
+    def index_upload(self, upload_hash: str, fingerprint: str) -> None:
+        self._write_index('uploads', upload_hash, fingerprint)
+
+    def session_dataset(self, session_id: str) -> Optional[str]:
+        return self._read_index('sessions', session_id)
+
+    def bind_session(self, session_id: str, fingerprint: str) -> None:
+        self._write_index('sessions', session_id, fingerprint)
+
+    def unbind_session(self, session_id: str) -> None:
+        (self.store_dir / 'sessions' / f"{session_id}.json").unlink(missing_ok=True)
+
+    def _read_index(self, kind: str, key: str) -> Optional[str]:
+        try:
+            return json.loads((self.store_dir / kind / f"{key}.json").read_text())['fingerprint']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_index(self, kind: str, key: str, fingerprint: str) -> None:
+        path = self.store_dir / kind / f"{key}.json"
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(json.dumps({'fingerprint': fingerprint}))
+        os.replace(tmp_path, path)
+
+    def _prune(self) -> None:
+        with self._lock:
+            datasets = sorted(
+                (self.store_dir / 'data').glob('*.arrow'),
+                key=lambda path: path.stat().st_mtime
+            )
+            size = sum(path.stat().st_size for path in datasets)
+            if size <= self.max_bytes:
+                return
+            in_use = {
+                self._read_index('sessions', path.stem)
+                for path in (self.store_dir / 'sessions').glob('*.json')
+            }
+            for path in datasets:
+                if size <= self.max_bytes:
+                    break
+                if path.stem in in_use:
+                    continue
+                size -= path.stat().st_size
+                path.unlink(missing_ok=True)
+                self._summary_path(path.stem).unlink(missing_ok=True)
+
+
+_shared_store: Optional[DatasetStore] = None
+
+def get_dataset_store() -> Optional[DatasetStore]:
+    """Return the process-wide DatasetStore, or None when disabled or pyarrow is missing"""
+    global _shared_store
+    if _shared_store is None and config.DATASET_STORE_ENABLED and pa is not None:
+        _shared_store = DatasetStore()
+    return _shared_store
@@ -0,0 +1,127 @@
+from typing import Dict, Any, Tuple
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ..config import config
+
+try:
+    import pyarrow  # noqa: F401  (needed for the 'string[pyarrow]' dtype)
+    ARROW_STRINGS_AVAILABLE = True
+except ImportError:
+    ARROW_STRINGS_AVAILABLE = False
+
+# Values that look like dates or timestamps: 2024-01-31, 31/01/2024, 2024-01-31T08:00:00, ...
+DATE_PATTERN = re.compile(r'^\s*\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?')
+DATE_SAMPLE_SIZE = 100
+
+# Integers are only narrowed to int32 when the product of any two values still fits in it
+INT32_SAFE_LIMIT = int(np.sqrt(np.iinfo('int32').max))
+
+
+def _is_text(series: pd.Series) -> bool:
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string'
+
+def _parse_dates(series: pd.Series) -> Any:
+    """The column as datetime64 if every non-null value is a date, else None"""
+    non_null = series.dropna()
+    if non_null.empty:
+        return None
+    sample = non_null.iloc[:DATE_SAMPLE_SIZE].astype(str)
+    if not sample.str.match(DATE_PATTERN).all():
+        return None
+    with warnings.catch_warnings():
+        # Format inference falls back to per-value parsing with a warning; failures show as NaT
+        warnings.simplefilter('ignore', UserWarning)
+        try:
+            parsed = pd.to_datetime(series, errors='coerce')
+            if parsed.notna().sum() < len(non_null):
+                # Month-first failed somewhere; the column may be day-first (31/01/2024)
+                parsed = pd.to_datetime(series, errors='coerce', dayfirst=True)
+        except (ValueError, TypeError, OverflowError):
+            return None
+    return parsed if parsed.notna().sum() == len(non_null) else None
+
+def _downcast_int(series: pd.Series) -> Any:
+    # Not narrower than int32, and only with headroom: values that merely fit would overflow
+    # in generated arithmetic (df.a * df.b) that worked in int64
+    if series.empty:
+        return None
+    if -INT32_SAFE_LIMIT <= series.min() and series.max() <= INT32_SAFE_LIMIT:
+        return series.astype('int32')
+    return None
+
+def _downcast_float(series: pd.Series) -> Any:
+    with np.errstate(over='ignore'):
+        narrowed = series.astype('float32')
+        values = series.to_numpy()
+        exact = (narrowed.to_numpy().astype('float64') == values) | np.isnan(values)
+    return narrowed if exact.all() else None
+
+def _convert(series: pd.Series) -> Any:
+    """The column in a smaller dtype holding exactly the same values, or None"""
+    if series.dtype == 'int64':
+        return _downcast_int(series) if config.DTYPE_DOWNCAST_NUMERIC and config.DTYPE_DOWNCAST_INTEGERS else None
+    if series.dtype == 'float64':
+        return _downcast_float(series) if config.DTYPE_DOWNCAST_NUMERIC else None
+    if not _is_text(series):
+        return None
+
+    if config.DTYPE_PARSE_DATES:
+        dates = _parse_dates(series)
+        if dates is not None:
+            return dates
+
+    non_null = series.count()
+    if non_null and series.nunique() <= non_null * config.DTYPE_CATEGORY_MAX_RATIO:
+        return series.astype('category')
+    if config.DTYPE_ARROW_STRINGS and ARROW_STRINGS_AVAILABLE:
+        return series.astype('string[pyarrow]')
+    return None
+
+def optimize_dtypes(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Shrink a freshly parsed frame without changing its values.
+
+    Date-like text columns become datetime64, repetitive text becomes category, other text
+    becomes Arrow-backed strings, and float64 columns (int64 ones too with
+    DTYPE_DOWNCAST_INTEGERS) are narrowed where every value fits exactly. Returns the frame and a report of the conversions and bytes saved.
+    """
+    bytes_before = 0
+    bytes_after = 0
+    converted = {}
+    columns = {}
+    for position, column in enumerate(df.columns):
+        series = df.iloc[:, position]
+        size = int(series.memory_usage(index=False, deep=True))
+        bytes_before += size
+        try:
+            optimized = _convert(series)
+        except Exception as e:
+            print(f"Could not optimize column {column}: {str(e)}")
+            optimized = None
+        if optimized is None:
+            bytes_after += size
+            columns[position] = series
+            continue
+        bytes_after += int(optimized.memory_usage(index=False, deep=True))
+        converted[str(column)] = f"{series.dtype} -> {optimized.dtype}"
+        columns[position] = optimized
+
+    if converted:
+        result = pd.concat(columns, axis=1)
+        result.columns = df.columns
+        df = result
+
+    report = {
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_saved': bytes_before - bytes_after,
+        'converted': converted
+    }
+    print(
+        f"Dtype optimization: {bytes_before / 1024 / 1024:.1f} MB -> {bytes_after / 1024 / 1024:.1f} MB "
+        f"({len(converted)} columns converted)"
+    )
+    return df, report
@@ -0,0 +1,52 @@
+from anthropic import AsyncAnthropic
+from typing import Any, AsyncIterator, Callable, Optional
+import asyncio
+from ..config import config
+
+class LLMClient:
+    """Shared async Anthropic client.
+
+    One AsyncAnthropic instance (and therefore one pooled HTTP connection set) is used by
+    every service, with a semaphore bounding concurrent requests so a burst of users cannot
+    exhaust the pool or the provider's rate limits.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, base_url: Optional[str] = None):
+        self.client = AsyncAnthropic(
+            api_key=config.ANTHROPIC_API_KEY,
+            base_url=base_url or config.ANTHROPIC_BASE_URL,
+            timeout=config.LLM_TIMEOUT,
+            max_retries=config.LLM_MAX_RETRIES,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency or config.LLM_MAX_CONCURRENCY)
+
+    async def create_message(self, **kwargs: Any):
+        """messages.create, waiting for a free slot when the concurrency limit is reached"""
+        async with self._semaphore:
+            return await self.client.messages.create(**kwargs)
+
+    async def stream_text(self, on_final: Optional[Callable[[Any], None]] = None,
+                          **kwargs: Any) -> AsyncIterator[str]:
+        """messages.stream, yielding text deltas as they arrive (holds a slot until finished).
+
+        on_final receives the complete message (with usage) once the stream has ended.
+        """
+        async with self._semaphore:
+            async with self.client.messages.stream(**kwargs) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                if on_final is not None:
+                    on_final(await stream.get_final_message())
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+_shared_client: Optional[LLMClient] = None
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLMClient, creating it on first use"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = LLMClient()
+    return _shared_client
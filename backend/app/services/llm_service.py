@@ -1,154 +1,24 @@
-from anthropic import Anthropic
-from typing import Dict, Any, List, Optional
-import json
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import asyncio
 import re
 from ..config import config
+from .llm_client import get_llm_client
 from ..models import ChatMessage
-from .data_service import NpEncoder
+from .code_executor import create_executor
+from .plot_cache import PLOT_MEDIA_TYPES, get_plot_cache
+from .prompt_context import build_dataset_context, estimate_tokens, report_prompt_size
+from .response_cache import get_response_cache, response_cache_key
+from pathlib import Path
 import traceback
+import shutil
+import uuid
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-import io
 import base64
 
-class LLMService:
-    def __init__(self, data_service, plot_analysis_service):
-        self.data_service = data_service
-        self.plot_analysis_service = plot_analysis_service
-        self.client = Anthropic(api_key=config.ANTHROPIC_API_KEY)
-        self.model = config.MODEL_NAME
-
-        self.namespace = {
-            'pd': pd,
-            'plt': plt,
-            'sns': sns,
-            'np': np,
-            '__builtins__': __builtins__,
-        }
-
-    def _import_ml_tools(self, code: str):
-        """Dynamically import only needed libraries based on code content"""
-        # Linear Models
-        if any(model in code for model in ['LinearRegression', 'LogisticRegression', 'Lasso', 'Ridge']):
-            from sklearn.linear_model import LinearRegression, LogisticRegression, Lasso, Ridge
-            self.namespace.update({
-                'LinearRegression': LinearRegression,
-                'LogisticRegression': LogisticRegression,
-                'Lasso': Lasso,
-                'Ridge': Ridge
-            })
-
-        # Forest Models
-        if 'RandomForest' in code:
-            from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-            self.namespace.update({
-                'RandomForestClassifier': RandomForestClassifier,
-                'RandomForestRegressor': RandomForestRegressor
-            })
-
-        # Boosting Models
-        if any(model in code for model in ['GradientBoosting', 'XGBoost', 'AdaBoost']):
-            from sklearn.ensemble import (
-                GradientBoostingClassifier, GradientBoostingRegressor,
-                AdaBoostClassifier, AdaBoostRegressor
-            )
-            import xgboost as xgb
-            self.namespace.update({
-                'GradientBoostingClassifier': GradientBoostingClassifier,
-                'GradientBoostingRegressor': GradientBoostingRegressor,
-                'AdaBoostClassifier': AdaBoostClassifier,
-                'AdaBoostRegressor': AdaBoostRegressor,
-                'XGBClassifier': xgb.XGBClassifier,
-                'XGBRegressor': xgb.XGBRegressor
-            })
-
-        # Preprocessing
-        if any(prep in code for prep in ['OneHotEncoder', 'StandardScaler', 'LabelEncoder']):
-            from sklearn.preprocessing import OneHotEncoder, StandardScaler, LabelEncoder
-            self.namespace.update({
-                'OneHotEncoder': OneHotEncoder,
-                'StandardScaler': StandardScaler,
-                'LabelEncoder': LabelEncoder
-            })
-
-        # Model Selection
-        if any(sel in code for sel in ['train_test_split', 'GridSearchCV', 'cross_val_score']):
-            from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score
-            self.namespace.update({
-                'train_test_split': train_test_split,
-                'GridSearchCV': GridSearchCV,
-                'cross_val_score': cross_val_score
-            })
-
-        # Metrics
-        if any(metric in code for metric in ['accuracy_score', 'precision_score', 'r2_score', 'mean_squared_error']):
-            from sklearn.metrics import (
-                accuracy_score, precision_score, recall_score, f1_score,
-                mean_squared_error, r2_score, confusion_matrix,
-                classification_report
-            )
-            self.namespace.update({
-                'accuracy_score': accuracy_score,
-                'precision_score': precision_score,
-                'recall_score': recall_score,
-                'f1_score': f1_score,
-                'mean_squared_error': mean_squared_error,
-                'r2_score': r2_score,
-                'confusion_matrix': confusion_matrix,
-                'classification_report': classification_report
-            })
-
-    def reset_namespace(self):
-        """Reset namespace when new data is loaded"""
-        try:
-            df = self.data_service.current_df.copy()
-            self.namespace = {
-                'pd': pd,
-                'plt': plt,
-                'sns': sns,
-                'np': np,
-                'df': df,
-                '__builtins__': __builtins__,
-            }
-        except ValueError:
-            self.namespace = {
-                'pd': pd,
-                'plt': plt,
-                'sns': sns,
-                'np': np,
-                '__builtins__': __builtins__,
-            }
-
-        if hasattr(self.data_service, '_current_df') and self.data_service._current_df is not None:
-            self.namespace['df'] = self.data_service.current_df.copy()
-
-    def _create_system_prompt(self, data_info: Dict[str, Any]) -> str:
-        try:
-            with open(self.plot_analysis_service.analysis_log_path, 'r') as f:
-                analysis_log = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            analysis_log = []
-
-        previous_analyses = ""
-        if analysis_log:
-            previous_analyses = "\nPrevious visualization analyses:\n"
-            for analysis in analysis_log[-10:]:
-                previous_analyses += f"""
-- {analysis['title']} (Relevance: {analysis['relevance']}/10)
-  {analysis['description']}
-"""
-
-        return f"""You are a seasoned AI Data Scientist analyzing a dataset with the following properties:
-Dataset Information:
-{json.dumps(data_info, cls=NpEncoder, indent=2)}
-
-{previous_analyses}
+ANALYSIS_INSTRUCTIONS = """You are a seasoned AI Data Scientist analyzing the dataset described after these instructions.
 
 Important Instructions:
-1. The DataFrame is already loaded as 'df'
+1. The DataFrame is already loaded as 'df', with the dtypes listed below (text may be 'category' or 'string', dates are already datetime64)
 2. Treat each code block as INDEPENDENT. Do not assume previous variables YOU create exist.
     - Example: You create a visualization using a new variables Z_types.
     - Mistake to avoid: referencing Z_types in a later visualization.
@@ -190,10 +60,124 @@ Bad practices to avoid:
 - Do not create more than four plots.
 - Do not add code after the return statement
 - Do not create sample, dummy data or a new dataframe under any circumstance.
+"""
 
-Now listen to the user's query and answer considering all the previous requirements.
+CODE_FENCE_OPEN = '```python\n'
+CODE_FENCE_CLOSE = '\n```'
+
+class CodeBlockStream:
+    """Splits streamed model text into prose and fenced python blocks as the text arrives.
+
+    feed() returns the prose that is safe to show so far and the raw source of every
+    block whose closing fence has been seen. Matches the fences _extract_code_blocks uses.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.in_code = False
+
+    def feed(self, text: str):
+        self.buffer += text
+        prose, blocks = '', []
+        while True:
+            if self.in_code:
+                end = self.buffer.find(CODE_FENCE_CLOSE)
+                if end == -1:
+                    break
+                blocks.append(self.buffer[:end])
+                self.buffer = self.buffer[end + len(CODE_FENCE_CLOSE):]
+                self.in_code = False
+            else:
+                start = self.buffer.find(CODE_FENCE_OPEN)
+                if start == -1:
+                    # Hold back a trailing partial fence until the next delta decides it
+                    held = next((k for k in range(min(len(self.buffer), len(CODE_FENCE_OPEN) - 1), 0, -1)
+                                 if CODE_FENCE_OPEN.startswith(self.buffer[-k:])), 0)
+                    prose += self.buffer[:len(self.buffer) - held]
+                    self.buffer = self.buffer[len(self.buffer) - held:]
+                    break
+                prose += self.buffer[:start]
+                self.buffer = self.buffer[start + len(CODE_FENCE_OPEN):]
+                self.in_code = True
+        return prose, blocks
+
+    def flush(self) -> str:
+        """Remaining prose once the stream has ended (an unclosed block is dropped)"""
+        prose = '' if self.in_code else self.buffer
+        self.buffer = ''
+        return prose
+
+
+class LLMService:
+    def __init__(self, data_service, plot_analysis_service, executor=None, session_id: str = 'default'):
+        self.data_service = data_service
+        self.plot_analysis_service = plot_analysis_service
+        self.client = get_llm_client()
+        self.model = config.MODEL_NAME
+        self.executor = executor or create_executor()
+        self.session_id = session_id
+
+    @property
+    def namespace(self) -> Optional[Dict[str, Any]]:
+        """Exec namespace of this session in the inline executor (worker processes keep their own)"""
+        return self.executor.get_namespace(self.session_id)
+
+    def reset_namespace(self):
+        """Reset namespace when new data is loaded"""
+        try:
+            self.executor.set_dataset(self.session_id, self.data_service.current_df,
+                                      self.data_service.dataset_path)
+        except ValueError:
+            self.executor.drop_dataset(self.session_id)
+
+    def _create_system_prompt(self, data_info: Dict[str, Any], query: Any = '') -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """System prompt as content blocks, most stable first, plus dataset context stats.
+
+        The instructions never change and the dataset block only changes with the dataset,
+        so the cache breakpoint goes after the dataset block. When the dataset block had to
+        be trimmed for this query it differs per query, and the instructions alone are below
+        the provider's minimum cacheable prefix, so no breakpoint is set.
+        """
+        analysis_log = self.plot_analysis_service.analysis_log.tail(10)
+
+        previous_analyses = ""
+        if analysis_log:
+            previous_analyses = "\nPrevious visualization analyses:\n"
+            for analysis in analysis_log:
+                previous_analyses += f"""
+- {analysis['title']} (Relevance: {analysis['relevance']}/10)
+  {analysis['description']}
 """
 
+        dataset_context, context_stats = build_dataset_context(data_info, query)
+        blocks = [
+            {"type": "text", "text": ANALYSIS_INSTRUCTIONS},
+            {"type": "text", "text": f"Dataset Information:\n{dataset_context}"},
+            {"type": "text", "text": f"""{previous_analyses}
+Now listen to the user's query and answer considering all the previous requirements.
+"""}
+        ]
+        if config.PROMPT_CACHING and not context_stats['ranked']:
+            blocks[1]["cache_control"] = {"type": "ephemeral"}
+        return blocks, context_stats
+
+    def _report_prompt(self, endpoint: str, system: List[Dict[str, Any]], messages: List[Dict[str, Any]],
+                       context_stats: Dict[str, Any], usage: Any = None) -> None:
+        """Pass this request's prompt size (estimated, and actual when known) to the prompt hooks"""
+        stats = {
+            'session_id': self.session_id,
+            'endpoint': endpoint,
+            'system_tokens_estimate': sum(estimate_tokens(block['text']) for block in system),
+            'message_tokens_estimate': sum(estimate_tokens(str(message['content'])) for message in messages),
+            **context_stats
+        }
+        if usage is not None:
+            stats['input_tokens'] = usage.input_tokens
+            stats['output_tokens'] = usage.output_tokens
+            stats['cache_read_input_tokens'] = getattr(usage, 'cache_read_input_tokens', None)
+            stats['cache_creation_input_tokens'] = getattr(usage, 'cache_creation_input_tokens', None)
+        report_prompt_size(stats)
+
     def _clean_code_block(self, code: str) -> str:
         """Clean a code block to ensure it works with matplotlib while preserving indentation"""
 
@@ -255,110 +239,378 @@ Now listen to the user's query and answer considering all the previous requireme
 
         return cleaned_blocks
 
-    async def analyze(self, query: str, data_info: Dict[str, Any], chat_history: Optional[List[ChatMessage]] = None) -> Dict[str, Any]:
-        """Analyze data based on user query and chat history"""
-        try:
-            messages = []
+    def _build_messages(self, chat_history: Optional[List[ChatMessage]]) -> List[Dict[str, Any]]:
+        messages = []
+
+        if chat_history:
+            for msg in chat_history:
+                if isinstance(msg.content, str):
 
-            if chat_history:
-                for msg in chat_history:
-                    if isinstance(msg.content, str):
+                    messages.append({
+                        "role": "user",
+                        "content": msg.content
+                    })
+                elif isinstance(msg.content, dict) and 'analysis' in msg.content:
 
-                        messages.append({
-                            "role": "user",
-                            "content": msg.content
-                        })
-                    elif isinstance(msg.content, dict) and 'analysis' in msg.content:
+                    messages.append({
+                        "role": "assistant",
+                        "content": msg.content['analysis']
+                    })
 
-                        messages.append({
-                            "role": "assistant",
-                            "content": msg.content['analysis']
-                        })
+        return messages
 
-            response = self.client.messages.create(
+    def _response_cache_key(self, query: Any, messages: List[Dict[str, Any]],
+                            system: List[Dict[str, Any]]) -> Optional[str]:
+        """Response cache key for this analysis, or None when caching is off or no dataset is loaded"""
+        fingerprint = self.data_service.dataset_fingerprint
+        if get_response_cache() is None or not fingerprint:
+            return None
+        # The latest user message is the query itself; key on the conversation before it
+        history = messages[:-1] if messages and messages[-1]['role'] == 'user' else messages
+        return response_cache_key(fingerprint, query, history, self.model, config.TEMPERATURE, system)
+
+    async def analyze(self, query: str, data_info: Dict[str, Any], chat_history: Optional[List[ChatMessage]] = None) -> Dict[str, Any]:
+        """Analyze data based on user query and chat history"""
+        try:
+            messages = self._build_messages(chat_history)
+            system, context_stats = self._create_system_prompt(data_info, query)
+            cache_key = self._response_cache_key(query, messages, system)
+            if cache_key:
+                cached = get_response_cache().get(cache_key)
+                if cached is not None:
+                    return cached
+
+            response = await self.client.create_message(
                 model=self.model,
-                system=self._create_system_prompt(data_info),
+                system=system,
                 messages=messages,
                 max_tokens=config.MAX_TOKENS,
                 temperature=config.TEMPERATURE
             )
+            self._report_prompt('analyze', system, messages, context_stats, response.usage)
 
             analysis_text = response.content[0].text
             clean_analysis = self._clean_analysis_text(analysis_text)
             code_blocks = self._extract_code_blocks(analysis_text)
 
-            return {
+            result = {
                 "analysis": clean_analysis,
                 "code_blocks": code_blocks
             }
+            if cache_key:
+                get_response_cache().set(cache_key, result)
+            return result
 
         except Exception as e:
             print(f"LLM Error: {str(e)}")
             traceback.print_exc()
             raise Exception(f"Error in LLM analysis: {str(e)}")
 
-    async def execute_code(self, code: str, plot_path: str = None) -> Dict[str, Any]:
-        """Execute code and capture plots properly"""
+    async def analyze_stream(self, query: str, data_info: Dict[str, Any],
+                             chat_history: Optional[List[ChatMessage]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream an analysis as events: 'text' deltas (code removed), each 'code_block' as
+        soon as its fence closes, then 'done' with the same payload analyze() returns."""
+        parser = CodeBlockStream()
+        analysis_text = ''
+        block_count = 0
         try:
-            self._import_ml_tools(code)
-            plt.close('all')
-
-            output_buffer = []
-            def custom_print(*args, **kwargs):
-                output_buffer.append(' '.join(map(str, args)))
+            messages = self._build_messages(chat_history)
+            system, context_stats = self._create_system_prompt(data_info, query)
+            cache_key = self._response_cache_key(query, messages, system)
+            cached = get_response_cache().get(cache_key) if cache_key else None
+            if cached is not None:
+                # Replay the cached analysis as one text event and its blocks
+                yield {"type": "text", "text": cached["analysis"]}
+                for index, code in enumerate(cached["code_blocks"]):
+                    yield {"type": "code_block", "index": index, "code": code}
+                yield {"type": "done", **cached}
+                return
+
+            async for delta in self.client.stream_text(
+                on_final=lambda message: self._report_prompt(
+                    'analyze_stream', system, messages, context_stats, message.usage
+                ),
+                model=self.model,
+                system=system,
+                messages=messages,
+                max_tokens=config.MAX_TOKENS,
+                temperature=config.TEMPERATURE
+            ):
+                analysis_text += delta
+                prose, blocks = parser.feed(delta)
+                if prose:
+                    yield {"type": "text", "text": prose}
+                for block in blocks:
+                    for code in self._extract_code_blocks(f"{CODE_FENCE_OPEN}{block}{CODE_FENCE_CLOSE}"):
+                        yield {"type": "code_block", "index": block_count, "code": code}
+                        block_count += 1
+
+            prose = parser.flush()
+            if prose:
+                yield {"type": "text", "text": prose}
+            result = {
+                "analysis": self._clean_analysis_text(analysis_text),
+                "code_blocks": self._extract_code_blocks(analysis_text)
+            }
+            if cache_key:
+                get_response_cache().set(cache_key, result)
+            yield {"type": "done", **result}
 
-            self.namespace['print'] = custom_print
-            code = code.replace('plt.show()', '')
+        except Exception as e:
+            print(f"LLM Error: {str(e)}")
+            traceback.print_exc()
+            yield {"type": "error", "error": f"Error in LLM analysis: {str(e)}"}
+
+    async def _run_cached(self, code: str, job_id: str = None) -> Dict[str, Any]:
+        """Run code for the UI, serving identical code on identical data from the plot cache.
+
+        On a miss the figure is rendered once in PLOT_FORMAT for the UI (plus a PNG for the
+        vision model when that is SVG) and as a vector PDF for reports. Figures are left in
+        the cache: the result carries their 'plot_id' instead of image bytes.
+        """
+        cache = get_plot_cache()
+        fmt, dpi = cache.ui_variant()
+        vision_fmt, vision_dpi = cache.vision_variant()
+        fingerprint = self.data_service.dataset_fingerprint
+        # Without a dataset the figure still gets a (single-use) key to be served under
+        key = cache.figure_key(code, fingerprint or uuid.uuid4().hex)
+
+        meta = cache.get_meta(key) if fingerprint else None
+        if meta is not None:
+            rendered = cache.get(key, fmt, dpi) is not None and cache.get(key, vision_fmt, vision_dpi) is not None
+            if rendered or not meta['has_plot']:
+                print(f"Plot cache hit: {key[:12]}")
+                return {
+                    "success": True,
+                    "text_output": meta['text_output'],
+                    "plot_id": key if meta['has_plot'] else None,
+                    "render_notes": meta.get('render_notes', []),
+                    "error": None
+                }
 
-            exec(code, self.namespace)
+        extra_figures = []
+        if fingerprint:
+            extra_figures.append({'path': str(cache.reserve(key, 'pdf')), 'format': 'pdf'})
+        if (vision_fmt, vision_dpi) != (fmt, dpi):
+            extra_figures.append({
+                'path': str(cache.reserve(key, vision_fmt, vision_dpi)), 'format': vision_fmt, 'dpi': vision_dpi
+            })
+        execution = await self.executor.run(code, self.session_id, job_id=job_id, extra_figures=extra_figures)
+        plot = execution.pop("plot", None)
+        execution["plot_id"] = None
+        if not execution["success"]:
+            # A timed out or cancelled job may have left partial renderings
+            for figure in extra_figures:
+                cache.discard(Path(figure['path']))
+        else:
+            try:
+                for figure in extra_figures:
+                    cache.added(Path(figure['path']))
+                if plot:
+                    cache.put_bytes(key, fmt, plot, dpi)
+                    execution["plot_id"] = key
+                if fingerprint:
+                    cache.put_meta(key, {
+                        'text_output': execution["text_output"],
+                        'has_plot': plot is not None,
+                        'render_notes': execution.get("render_notes", [])
+                    })
+            except OSError as e:
+                print(f"Could not write plot cache entry: {str(e)}")
+        return execution
+
+    def plot_for_vision(self, plot_id: str) -> Optional[Tuple[str, str]]:
+        """Base64 data and media type of a cached figure, as the vision model takes it"""
+        cache = get_plot_cache()
+        fmt, dpi = cache.vision_variant()
+        path = cache.get(plot_id, fmt, dpi)
+        if path is None:
+            return None
+        return base64.b64encode(path.read_bytes()).decode('utf-8'), PLOT_MEDIA_TYPES[fmt]
+
+    async def render_figure(self, code: str, output_stem: Path) -> Optional[Path]:
+        """Write a report-quality rendering of code's figure next to output_stem.
+
+        Reuses a cached PDF (or 300 dpi PNG) when this code was already rendered on this
+        dataset; otherwise executes it once and caches the result. Returns the file written.
+        """
+        fingerprint = self.data_service.dataset_fingerprint
+        cache = get_plot_cache() if fingerprint else None
+        key = cache.figure_key(code, fingerprint) if cache else None
+
+        if cache:
+            for fmt, dpi in (('pdf', None), ('png', 300)):
+                cached = cache.get(key, fmt, dpi)
+                if cached is not None:
+                    target = output_stem.with_suffix(f'.{fmt}')
+                    shutil.copyfile(cached, target)
+                    print(f"Plot cache hit for report figure: {target.name}")
+                    return target
+
+        png_path = output_stem.with_suffix('.png')
+        extra_figures = [{'path': str(cache.reserve(key, 'pdf')), 'format': 'pdf'}] if cache else None
+        execution = await self.executor.run(
+            code, self.session_id, plot_path=str(png_path), extra_figures=extra_figures
+        )
+        if not execution["success"] or not png_path.exists():
+            if cache:
+                cache.discard(Path(extra_figures[0]['path']))
+            if not execution["success"]:
+                print(f"Error rendering figure {output_stem.name}: {execution['error']}")
+            return None
+        if cache:
+            try:
+                cache.added(Path(extra_figures[0]['path']))
+                cache.put_file(key, 'png', png_path, dpi=300)
+            except OSError as e:
+                print(f"Could not write plot cache entry: {str(e)}")
+        return png_path
+
+    async def run_block(self, code: str, plot_path: str = None, job_id: str = None) -> Dict[str, Any]:
+        """Execute code off the event loop and capture its figure, without critiquing it"""
+        try:
+            if plot_path:
+                execution = await self.executor.run(code, self.session_id, plot_path=plot_path, job_id=job_id)
+            else:
+                execution = await self._run_cached(code, job_id)
+            if not execution["success"]:
+                return {
+                    "success": False,
+                    "result": None,
+                    "error": execution["error"]
+                }
 
             # Log statistical output if present
-            output_text = '\n'.join(output_buffer) if output_buffer else ''
+            output_text = execution["text_output"] or ''
             if output_text and any(metric in output_text.lower() for metric in ['r-squared', 'mse', 'error', 'score', 'accuracy, MSE, Mean Squared Error, RMSE, R-squared Score, R, Mean, f, t, F']):
                 await self.plot_analysis_service.log_statistical_analysis(output_text, code)
 
-            # Capture and analyze the plot if exists
-            if plt.get_fignums():
-                if plot_path:
-                    plt.savefig(plot_path, bbox_inches="tight", dpi=300)
-                    plt.close('all')
-
-                    return {"success": True}
-
-                else:
-                    buf = io.BytesIO()
-                    plt.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-                    buf.seek(0)
-                    plot_data = base64.b64encode(buf.getvalue()).decode('utf-8')
-                    plt.close('all')
-
-                    # Get plot analysis
-                    plot_analysis = await self.plot_analysis_service.analyze_plot(plot_data, code)
-
-                    return {
-                        "success": True,
-                        "result": {
-                            "plot": plot_data,
-                            "text_output": '\n'.join(output_buffer) if output_buffer else None,
-                            "analysis": plot_analysis
-                        },
-                        "error": None
-                    }
-            else:
-                return {
-                    "success": True,
-                    "result": {
-                        "text_output": '\n'.join(output_buffer) if output_buffer else None
-                    },
-                    "error": None
-                }
+            result = {"text_output": execution["text_output"]}
+            if execution.get("plot_id"):
+                result.update(get_plot_cache().reference(execution["plot_id"]))
+            if execution.get("render_notes"):
+                result["render_notes"] = execution["render_notes"]
+            return {
+                "success": True,
+                "result": result,
+                "error": None
+            }
 
         except Exception as e:
             print(f"Code execution error: {str(e)}")
             traceback.print_exc()
-            plt.close('all')
             return {
                 "success": False,
                 "result": None,
                 "error": str(e)
             }
+
+    async def execute_code(self, code: str, plot_path: str = None, job_id: str = None) -> Dict[str, Any]:
+        """Execute code and, if it produced a plot, analyze the plot.
+
+        /execute runs one block at a time, so its critique is requested right away rather
+        than waiting out CRITIQUE_BATCH_WINDOW for plots that will not come; batching is
+        left to analyze_pipeline().
+        """
+        execution = await self.run_block(code, plot_path, job_id)
+        if not execution["success"] or plot_path:
+            return execution
+
+        result = execution["result"]
+        image = self.plot_for_vision(result["plot_id"]) if "plot_id" in result else None
+        if image is not None:
+            plot_data, media_type = image
+            try:
+                result["analysis"] = await self.plot_analysis_service.analyze_plot(plot_data, code, media_type)
+            except Exception as e:
+                print(f"Code execution error: {str(e)}")
+                traceback.print_exc()
+                return {
+                    "success": False,
+                    "result": None,
+                    "error": str(e)
+                }
+        return execution
+
+    async def analyze_pipeline(self, query: str, data_info: Dict[str, Any],
+                               chat_history: Optional[List[ChatMessage]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream an analysis, executing each code block as soon as it is written.
+
+        Yields the analyze_stream() events plus, per block, an 'output' event once it has run
+        (plot and printed text) and a 'critique' event once its plot has been analyzed.
+        Blocks run and are critiqued concurrently; critiques never hold back a plot. Plots of
+        the turn are critiqued in batches, sent as soon as no further plot can join them.
+        """
+        events = asyncio.Queue()
+        tasks = set()
+        # Blocks whose plot (if any) has not been queued for critique yet, and whether more may come
+        uncritiqued = {'blocks': 0, 'streaming': True}
+
+        def flush_if_last() -> None:
+            if not uncritiqued['streaming'] and uncritiqued['blocks'] == 0:
+                self.plot_analysis_service.flush_critiques()
+
+        def block_settled() -> None:
+            uncritiqued['blocks'] -= 1
+            flush_if_last()
+
+        def finished(task) -> None:
+            tasks.discard(task)
+            if not tasks:
+                # Tasks spawn their successors before finishing, so this is the end
+                events.put_nowait(None)
+
+        def spawn(coro) -> None:
+            task = asyncio.get_running_loop().create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(finished)
+
+        async def critique(index: int, code: str, plot_id: str) -> None:
+            try:
+                try:
+                    image = self.plot_for_vision(plot_id)
+                    if image is None:
+                        raise ValueError("The rendered figure is no longer cached")
+                    plot_data, media_type = image
+                    pending = self.plot_analysis_service.submit_critique(plot_data, code, media_type)
+                finally:
+                    block_settled()
+                analysis = await pending
+                await events.put({"type": "critique", "index": index, "analysis": analysis})
+            except Exception as e:
+                print(f"Plot analysis error: {str(e)}")
+                await events.put({"type": "critique", "index": index, "analysis": None, "error": str(e)})
+
+        async def execute(index: int, code: str) -> None:
+            execution = await self.run_block(code)
+            await events.put({
+                "type": "output",
+                "index": index,
+                "success": execution["success"],
+                "result": execution["result"],
+                "error": execution["error"]
+            })
+            if execution["success"] and "plot_id" in execution["result"]:
+                spawn(critique(index, code, execution["result"]["plot_id"]))
+            else:
+                block_settled()
+
+        async def produce() -> None:
+            try:
+                async for event in self.analyze_stream(query, data_info, chat_history):
+                    await events.put(event)
+                    if event["type"] == "code_block":
+                        uncritiqued['blocks'] += 1
+                        spawn(execute(event["index"], event["code"]))
+            finally:
+                uncritiqued['streaming'] = False
+                flush_if_last()
+
+        spawn(produce())
+        try:
+            # Done once the analysis has finished and every execution/critique has reported
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            for task in list(tasks):
+                task.cancel()
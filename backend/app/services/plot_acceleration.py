@@ -0,0 +1,251 @@
+from contextlib import contextmanager
+from typing import Any, Callable, List
+import functools
+import threading
+
+import numpy as np
+
+from ..config import config
+
+# seaborn functions that draw one marker per row, and whether they only need sampling when
+# per-point semantics (hue/size/style) make their own per-row work expensive. pairplot draws
+# a scatter per pair of columns plus a histogram/KDE per column, so it is always sampled.
+POINT_PLOTS = {'scatterplot': True, 'relplot': True, 'stripplot': False, 'swarmplot': False, 'pairplot': False}
+SEMANTIC_ARGUMENTS = ('hue', 'size', 'style')
+
+# Threads currently inside point_plot_sampling() have a list of notes here; the wrappers
+# pass calls from any other thread straight through
+_active = threading.local()
+_install_lock = threading.Lock()
+_installs = 0
+_originals = {}
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps when reducing to threshold.
+
+    x must be sorted. The first and last points are always kept; each bucket in between
+    contributes the point forming the largest triangle with the previously kept point and
+    the next bucket's average, which preserves peaks and troughs.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = np.nanmean(y[end:next_end]) if np.isfinite(y[end:next_end]).any() else y[previous]
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        area = np.where(np.isnan(area), -1.0, area)
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+def _sampled(plot_function: Callable, only_with_semantics: bool) -> Callable:
+    @functools.wraps(plot_function)
+    def wrapper(*args, **kwargs):
+        import pandas as pd
+
+        notes = getattr(_active, 'notes', None)
+        data = kwargs['data'] if 'data' in kwargs else (args[0] if args else None)
+        if (notes is not None and isinstance(data, pd.DataFrame)
+                and len(data) > config.PLOT_MAX_SCATTER_POINTS
+                and kwargs.get('kind', 'scatter') == 'scatter'
+                and (not only_with_semantics or any(kwargs.get(name) is not None for name in SEMANTIC_ARGUMENTS))):
+            rng = np.random.default_rng(0)
+            keep = np.sort(rng.choice(len(data), size=config.PLOT_MAX_SCATTER_POINTS, replace=False))
+            sample = data.iloc[keep]
+            if 'data' in kwargs:
+                kwargs['data'] = sample
+            else:
+                args = (sample,) + args[1:]
+            notes.append(
+                f"{plot_function.__name__} of {len(data):,} rows drawn from a random sample of {len(sample):,}"
+            )
+        return plot_function(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def point_plot_sampling():
+    """Within the block, seaborn's per-row point plots sample oversized frames first.
+
+    Marker-level thinning in accelerate_figures() only bounds drawing; these functions also
+    map hue/size/style row by row (and pairplot draws every pair) before that, which costs
+    seconds per million rows. Only calls made from this thread inside the block are sampled,
+    and the original functions are put back once no block is active. Yields the list that
+    collects a note per sampled call.
+    """
+    import seaborn as sns
+
+    global _installs
+    with _install_lock:
+        if _installs == 0:
+            for name, only_with_semantics in POINT_PLOTS.items():
+                _originals[name] = getattr(sns, name)
+                setattr(sns, name, _sampled(_originals[name], only_with_semantics))
+        _installs += 1
+    _active.notes = []
+    try:
+        yield _active.notes
+    finally:
+        del _active.notes
+        with _install_lock:
+            _installs -= 1
+            if _installs == 0:
+                for name, plot_function in _originals.items():
+                    setattr(sns, name, plot_function)
+                _originals.clear()
+
+def _sample_indices(offsets: np.ndarray, size: int) -> np.ndarray:
+    """A fixed random sample of rows, plus the extreme points so axis limits do not move"""
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(offsets), size=size, replace=False)
+    with np.errstate(invalid='ignore'):
+        finite = np.where(np.isfinite(offsets), offsets, np.nan)
+    extremes = [
+        pick(finite[:, axis]) for axis in (0, 1) for pick in (np.nanargmin, np.nanargmax)
+        if np.isfinite(finite[:, axis]).any()
+    ]
+    return np.unique(np.concatenate([sample, np.asarray(extremes, dtype=np.int64)]))
+
+def _per_point(values: Any, n: int) -> bool:
+    return values is not None and len(values) == n and n > 1
+
+def _is_uniform(collection) -> bool:
+    """Whether every point looks the same, so a density plot loses nothing but overplotting"""
+    if collection.get_array() is not None:
+        return False
+    facecolors = collection.get_facecolors()
+    sizes = collection.get_sizes()
+    if len(facecolors) > 1 and not (facecolors == facecolors[0]).all():
+        return False
+    if len(sizes) > 1 and not (sizes == sizes[0]).all():
+        return False
+    return len(collection.get_paths()) <= 1
+
+def _as_hexbin(ax, collection, offsets: np.ndarray) -> bool:
+    """Replace a uniform scatter with a hexbin of the same points, shaded in its own color"""
+    from matplotlib.colors import LinearSegmentedColormap, to_rgba
+
+    if ax.get_xscale() != 'linear' or ax.get_yscale() != 'linear':
+        return False
+    finite = offsets[np.isfinite(offsets).all(axis=1)]
+    if not len(finite):
+        return False
+    facecolors = collection.get_facecolors()
+    color = to_rgba(facecolors[0]) if len(facecolors) else to_rgba('C0')
+    pale = tuple(0.85 + 0.15 * channel for channel in color[:3])
+    cmap = LinearSegmentedColormap.from_list('density', [pale, color[:3]])
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    ax.hexbin(
+        finite[:, 0], finite[:, 1], gridsize=config.PLOT_HEXBIN_GRIDSIZE, bins='log', mincnt=1,
+        cmap=cmap, linewidths=0, edgecolors='face', alpha=collection.get_alpha(), zorder=collection.get_zorder(),
+        label=collection.get_label()
+    )
+    collection.remove()
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    return True
+
+def _subsample(collection, offsets: np.ndarray, size: int) -> int:
+    """Keep a sample of a scatter's points along with their per-point colors, sizes and markers"""
+    n = len(offsets)
+    keep = _sample_indices(offsets, size)
+    array = collection.get_array()
+    facecolors = collection.get_facecolors()
+    edgecolors = collection.get_edgecolors()
+    sizes = collection.get_sizes()
+    linewidths = collection.get_linewidths()
+    paths = collection.get_paths()
+
+    collection.set_offsets(offsets[keep])
+    if _per_point(array, n):
+        collection.set_array(np.asarray(array)[keep])
+    elif _per_point(facecolors, n):
+        collection.set_facecolors(facecolors[keep])
+    if _per_point(edgecolors, n):
+        collection.set_edgecolors(edgecolors[keep])
+    if _per_point(sizes, n):
+        collection.set_sizes(sizes[keep])
+    if _per_point(linewidths, n):
+        collection.set_linewidths(np.asarray(linewidths)[keep])
+    if _per_point(paths, n):
+        collection.set_paths([paths[index] for index in keep])
+    return len(keep)
+
+def _accelerate_scatter(ax, collection, notes: List[str]) -> None:
+    if collection.get_offset_transform() != ax.transData:
+        return
+    offsets = np.ma.filled(np.ma.asarray(collection.get_offsets(), dtype=float), np.nan)
+    n = len(offsets)
+    if n <= config.PLOT_MAX_SCATTER_POINTS:
+        return
+    if _is_uniform(collection) and _as_hexbin(ax, collection, offsets):
+        notes.append(
+            f"Scatter of {n:,} points drawn as a hexbin density plot "
+            f"(gridsize {config.PLOT_HEXBIN_GRIDSIZE}, log-scaled counts)"
+        )
+        return
+    kept = _subsample(collection, offsets, config.PLOT_MAX_SCATTER_POINTS)
+    notes.append(f"Scatter of {n:,} points drawn from a random sample of {kept:,}")
+
+def _accelerate_line(line, notes: List[str]) -> None:
+    xy = line.get_xydata()
+    n = len(xy)
+    if n <= config.PLOT_MAX_LINE_POINTS:
+        return
+    x, y = xy[:, 0], xy[:, 1]
+    # LTTB only makes sense along a sorted x; anything else is left as drawn
+    if not np.isfinite(x).all() or (np.diff(x) < 0).any():
+        return
+    keep = lttb_indices(x, y, config.PLOT_MAX_LINE_POINTS)
+    line.set_data(np.asarray(line.get_xdata(orig=True))[keep], np.asarray(line.get_ydata(orig=True))[keep])
+    notes.append(f"Line of {n:,} points downsampled to {len(keep):,} with LTTB")
+
+def _size(artist) -> int:
+    from matplotlib.collections import Collection
+
+    if isinstance(artist, Collection):
+        return max(len(artist.get_offsets()), len(artist.get_paths()))
+    return len(artist.get_xydata())
+
+def accelerate_figures(figures: List[Any]) -> List[str]:
+    """Bound the rendering cost of finished figures, returning a note per change made.
+
+    Scatters above PLOT_MAX_SCATTER_POINTS become hexbin densities when every point looks
+    alike, or a random sample (keeping per-point styling and the extremes) otherwise. Sorted
+    line series above PLOT_MAX_LINE_POINTS are reduced with LTTB. Collections and lines still
+    above PLOT_RASTERIZE_POINTS are rasterized so vector output stays small.
+    """
+    from matplotlib.collections import PathCollection
+
+    notes = []
+    rasterized = 0
+    for figure in figures:
+        for ax in figure.axes:
+            for collection in list(ax.collections):
+                if isinstance(collection, PathCollection):
+                    try:
+                        _accelerate_scatter(ax, collection, notes)
+                    except Exception as e:
+                        print(f"Could not accelerate scatter: {str(e)}")
+            for line in list(ax.lines):
+                try:
+                    _accelerate_line(line, notes)
+                except Exception as e:
+                    print(f"Could not downsample line: {str(e)}")
+            for artist in list(ax.collections) + list(ax.lines):
+                if not artist.get_rasterized() and _size(artist) > config.PLOT_RASTERIZE_POINTS:
+                    artist.set_rasterized(True)
+                    rasterized += 1
+    if rasterized:
+        notes.append(f"{rasterized} large artist{'s' if rasterized > 1 else ''} rasterized")
+    return notes
@@ -1,40 +1,90 @@
-from anthropic import Anthropic
+import asyncio
+import base64
+import io
 import json
-from typing import Dict, Any
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
 from ..config import config
+from .llm_client import get_llm_client
 
-class PlotAnalysisService:
-    def __init__(self):
-        self.client = Anthropic(api_key=config.ANTHROPIC_API_KEY)
-        # Create logs directory if it doesn't exist
-        self.logs_dir = Path(__file__).parent.parent / 'logs'
-        self.logs_dir.mkdir(exist_ok=True)
-        self.analysis_log_path = self.logs_dir / 'analysis_log.json'
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still serialized within the process
+    fcntl = None
+
+class AnalysisLog:
+    """Append-only JSONL analysis log.
+
+    Each entry is one line written with a single O_APPEND write (under flock where
+    available), so appends are O(1) and concurrent writers cannot drop entries. The most
+    recent entries are mirrored in memory for prompt building; full reads parse the file.
+    """
+
+    def __init__(self, path: Path, tail_size: Optional[int] = None):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._tail = deque(maxlen=tail_size or config.ANALYSIS_LOG_TAIL)
+        try:
+            with open(self.path, 'r') as f:
+                for line in deque(f, maxlen=self._tail.maxlen):
+                    entry = self._parse(line)
+                    if entry is not None:
+                        self._tail.append(entry)
+        except FileNotFoundError:
+            pass
 
-    async def analyze_plot(self, plot_base64: str, code: str) -> Dict[str, Any]:
-        """Simple version for initial testing"""
+    @staticmethod
+    def _parse(line: str) -> Optional[Dict[str, Any]]:
         try:
-            response = self.client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=config.MAX_TOKENS,
-                temperature=config.TEMPERATURE,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": plot_base64
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text":
-"""Analyze this visualization as a data scientist and critic. Provide:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None  # Torn or corrupt line; skip it
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._tail.append(entry)
+
+    def tail(self, n: int) -> List[Dict[str, Any]]:
+        """The last n entries, without touching the file"""
+        with self._lock:
+            entries = list(self._tail)
+        return entries[-n:] if n else []
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Every entry in the log, oldest first"""
+        try:
+            with open(self.path, 'r') as f:
+                return [entry for entry in map(self._parse, f) if entry is not None]
+        except FileNotFoundError:
+            return []
+
+    def clear(self) -> None:
+        with self._lock:
+            open(self.path, 'w').close()
+            self._tail.clear()
+
+    def delete(self) -> None:
+        with self._lock:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            self._tail.clear()
+
+CRITIQUE_CRITERIA = """Analyze {subject} as a data scientist and critic. Provide:
 
 1. Title: Describe what the plot shows
 2. Relevance Score (0-10):
@@ -53,7 +103,9 @@ Common issues that should reduce scores:
 - Lack of clear patterns or insights
 - Single-value histograms
 - Uninformative correlations (<0.3)
+"""
 
+SINGLE_PLOT_PROMPT = CRITIQUE_CRITERIA.format(subject="this visualization") + """
 Output ONLY valid JSON with keys: title, relevance, description
 
 Example:
@@ -63,10 +115,88 @@ Example:
     "description": "Basic boxplot showing sleep duration differences between weekdays and weekends. While it shows slightly longer weekend sleep, the difference is minimal (0.5 hours) and lacks additional insights about sleep quality or patterns."
 }
 """
-                        }
-                    ]
-                }]
-            )
+
+BATCH_PROMPT = CRITIQUE_CRITERIA.format(subject="each of the {count} visualizations above separately") + """
+Output ONLY a valid JSON array with exactly {count} objects, one per plot in order, with keys: plot (its number), title, relevance, description
+
+Example:
+[
+    {{
+        "plot": 1,
+        "title": "Student Sleep Patterns by Day Type",
+        "relevance": 4,
+        "description": "Basic boxplot showing sleep duration differences between weekdays and weekends. While it shows slightly longer weekend sleep, the difference is minimal (0.5 hours) and lacks additional insights about sleep quality or patterns."
+    }}
+]
+"""
+
+def prepare_image(plot_base64: str, media_type: str) -> Tuple[str, str]:
+    """Downscale a plot to CRITIQUE_IMAGE_MAX_EDGE and re-encode it as CRITIQUE_IMAGE_FORMAT.
+
+    Returns base64 data and media type; the original if re-encoding would not shrink it or
+    it cannot be read.
+    """
+    try:
+        from PIL import Image
+
+        raw = base64.b64decode(plot_base64)
+        image = Image.open(io.BytesIO(raw))
+        size = image.size
+        image.thumbnail((config.CRITIQUE_IMAGE_MAX_EDGE, config.CRITIQUE_IMAGE_MAX_EDGE))
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        buffer = io.BytesIO()
+        fmt = config.CRITIQUE_IMAGE_FORMAT
+        image.save(buffer, format=fmt.upper(), quality=config.CRITIQUE_IMAGE_QUALITY)
+        # Vision tokens follow pixel count, so a downscaled image is used even if its file is larger
+        if image.size == size and buffer.tell() >= len(raw):
+            return plot_base64, media_type
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), f"image/{fmt}"
+    except Exception as e:
+        print(f"Could not downscale plot for critique: {str(e)}")
+        return plot_base64, media_type
+
+def image_block(data: str, media_type: str) -> Dict[str, Any]:
+    return {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": data}}
+
+def parse_critiques(text: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """Per-plot analyses from a batch answer, None for plots it does not cover"""
+    analyses = [None] * count
+    start, end = text.find('['), text.rfind(']')
+    try:
+        items = json.loads(text[start:end + 1]) if start != -1 and end > start else []
+    except json.JSONDecodeError:
+        items = []
+    for position, item in enumerate(items if isinstance(items, list) else []):
+        if not isinstance(item, dict) or not {'title', 'relevance', 'description'} <= item.keys():
+            continue
+        number = item.pop('plot', position + 1)
+        index = number - 1 if isinstance(number, int) and 1 <= number <= count else position
+        if index < count and analyses[index] is None:
+            analyses[index] = item
+    return analyses
+
+class PlotAnalysisService:
+    def __init__(self, session_id: Optional[str] = None):
+        self.client = get_llm_client()
+        # Create logs directory if it doesn't exist
+        self.logs_dir = Path(__file__).parent.parent / 'logs'
+        self.logs_dir.mkdir(exist_ok=True)
+        log_name = f'analysis_log_{session_id}.jsonl' if session_id else 'analysis_log.jsonl'
+        self.analysis_log_path = self.logs_dir / log_name
+        self.analysis_log = AnalysisLog(self.analysis_log_path)
+        # Critiques waiting to be batched, the timer that will send them, and batches in flight
+        self._pending = []
+        self._window = None
+        self._batches = set()
+
+    async def analyze_plot(self, plot_base64: str, code: str, media_type: str = 'image/png') -> Dict[str, Any]:
+        """Critique one plot in its own vision request"""
+        try:
+            image = await asyncio.to_thread(prepare_image, plot_base64, media_type)
+            response = await self._request([image_block(*image), {"type": "text", "text": SINGLE_PLOT_PROMPT}], 1)
 
             try:
                 analysis = json.loads(response.content[0].text)
@@ -79,21 +209,108 @@ Example:
                     "description": text
                 }
 
-            analysis["code"] = code
-            analysis["timestamp"] = datetime.now().isoformat()
-            self._log_analysis(analysis)
-
-            return analysis
+            return self._finish(analysis, code)
 
         except Exception as e:
             print(f"Error analyzing plot: {str(e)}")
-            return {
-                "title": "Error in analysis",
-                "relevance": 0,
-                "code": code,
-                "description": f"Failed to analyze plot: {str(e)}",
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._failed(code, e)
+
+    def submit_critique(self, plot_base64: str, code: str, media_type: str = 'image/png') -> asyncio.Future:
+        """Queue a plot for critique; resolves to its analysis once its batch has been answered.
+
+        Plots submitted within CRITIQUE_BATCH_WINDOW seconds of the first one share a vision
+        request of up to CRITIQUE_BATCH_SIZE images. flush_critiques() sends early, e.g. once
+        a turn will produce no more plots.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((plot_base64, code, media_type, future))
+        if len(self._pending) >= config.CRITIQUE_BATCH_SIZE:
+            self.flush_critiques()
+        elif self._window is None:
+            self._window = loop.call_later(config.CRITIQUE_BATCH_WINDOW, self.flush_critiques)
+        return future
+
+    def flush_critiques(self) -> None:
+        """Send the queued plots now"""
+        if self._window is not None:
+            self._window.cancel()
+            self._window = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._critique_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _critique_batch(self, batch: List[Tuple[str, str, str, asyncio.Future]]) -> None:
+        batch = [item for item in batch if not item[3].done()]  # Skip critiques nobody awaits anymore
+        if not batch:
+            return
+        if len(batch) == 1:
+            plot_base64, code, media_type, _ = batch[0]
+            analyses = [await self.analyze_plot(plot_base64, code, media_type)]
+        else:
+            analyses = await self._analyze_batch([item[:3] for item in batch])
+        for (_, _, _, future), analysis in zip(batch, analyses):
+            if not future.done():
+                future.set_result(analysis)
+
+    async def _analyze_batch(self, plots: List[Tuple[str, str, str]]) -> List[Dict[str, Any]]:
+        """Critique several plots in one vision request, parsing the answer back per plot"""
+        started = time.perf_counter()
+        try:
+            content = []
+            for number, (plot_base64, _, media_type) in enumerate(plots, 1):
+                image = await asyncio.to_thread(prepare_image, plot_base64, media_type)
+                content.append({"type": "text", "text": f"Plot {number}:"})
+                content.append(image_block(*image))
+            content.append({"type": "text", "text": BATCH_PROMPT.format(count=len(plots))})
+            response = await self._request(content, len(plots))
+        except Exception as e:
+            print(f"Error analyzing plots: {str(e)}")
+            return [self._failed(code, e) for _, code, _ in plots]
+
+        usage = getattr(response, 'usage', None)
+        print(
+            f"Critiqued {len(plots)} plots in one request ({time.perf_counter() - started:.2f}s"
+            + (f", {usage.input_tokens} input / {usage.output_tokens} output tokens)" if usage else ")")
+        )
+        analyses = [
+            self._finish(analysis, code) if analysis is not None else None
+            for analysis, (_, code, _) in zip(parse_critiques(response.content[0].text, len(plots)), plots)
+        ]
+        missing = [index for index, analysis in enumerate(analyses) if analysis is None]
+        if missing:
+            # Plots the answer skipped or garbled are critiqued on their own
+            print(f"Batch critique left {len(missing)} of {len(plots)} plots unanswered; retrying them singly")
+            retried = await asyncio.gather(*(self.analyze_plot(*plots[index]) for index in missing))
+            for index, analysis in zip(missing, retried):
+                analyses[index] = analysis
+        return analyses
+
+    async def _request(self, content: List[Dict[str, Any]], plots: int):
+        return await self.client.create_message(
+            model=config.CRITIQUE_MODEL,
+            max_tokens=config.CRITIQUE_MAX_TOKENS * plots,
+            temperature=config.TEMPERATURE,
+            messages=[{"role": "user", "content": content}]
+        )
+
+    def _finish(self, analysis: Dict[str, Any], code: str) -> Dict[str, Any]:
+        analysis["code"] = code
+        analysis["timestamp"] = datetime.now().isoformat()
+        self._log_analysis(analysis)
+        return analysis
+
+    @staticmethod
+    def _failed(code: str, error: Exception) -> Dict[str, Any]:
+        return {
+            "title": "Error in analysis",
+            "relevance": 0,
+            "code": code,
+            "description": f"Failed to analyze plot: {str(error)}",
+            "timestamp": datetime.now().isoformat()
+        }
 
     async def log_statistical_analysis(self, description: str, code: str) -> Dict[str, Any]:
         """Log statistical analysis results"""
@@ -109,27 +326,20 @@ Example:
         return analysis
 
     def _log_analysis(self, analysis: Dict[str, Any]) -> None:
-        """Simple logging to JSON file"""
+        """Append one entry to the JSONL analysis log"""
         try:
-            try:
-                with open(self.analysis_log_path, 'r') as f:
-                    log = json.load(f)
-            except FileNotFoundError:
-                log = []
-
-            log.append(analysis)
-
-            with open(self.analysis_log_path, 'w') as f:
-                json.dump(log, f, indent=2)
-
+            self.analysis_log.append(analysis)
         except Exception as e:
             print(f"Error logging analysis: {str(e)}")
 
+    def delete_log(self) -> None:
+        """Remove the analysis log file when its session ends"""
+        self.analysis_log.delete()
+
     def clear_log(self) -> None:
         """Clear the analysis log file"""
         try:
-            with open(self.analysis_log_path, 'w') as f:
-                json.dump([], f)
+            self.analysis_log.clear()
             print(f"Analysis log cleared: {self.analysis_log_path}")
         except Exception as e:
             print(f"Error clearing analysis log: {str(e)}")
@@ -0,0 +1,167 @@
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from ..config import config
+
+# Artifacts modified this recently may still be in use by a renderer and are never pruned
+PRUNE_GRACE_SECONDS = 60
+
+PLOT_MEDIA_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'svg': 'image/svg+xml'
+}
+
+class PlotCache:
+    """Content-addressed store of rendered figures.
+
+    A figure is identified by hash(code, dataset fingerprint); each rendering of it is an
+    artifact named by format and resolution (png-100 for the UI, pdf, png-300 for reports),
+    with a JSON sidecar holding the printed output. Identical code on identical data is
+    therefore rendered once, whichever session or endpoint asks for it. The least recently
+    used artifacts are pruned once the cache outgrows PLOT_CACHE_MAX_MB; the directory may be
+    shared by several processes, so its size is re-read from disk before pruning.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = Path(cache_dir or config.PLOT_CACHE_DIR)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None else config.PLOT_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+        self._size = sum(stat.st_size for _, stat in self._artifacts())
+
+    @staticmethod
+    def figure_key(code: str, fingerprint: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(fingerprint.encode())
+        digest.update(b'\0')
+        digest.update(code.encode())
+        return digest.hexdigest()
+
+    def artifact_path(self, key: str, fmt: str, dpi: Optional[int] = None) -> Path:
+        """Where the artifact lives (whether or not it has been rendered yet)"""
+        variant = f"{fmt}-{dpi}" if dpi else fmt
+        return self.cache_dir / key[:2] / f"{key}.{variant}"
+
+    @staticmethod
+    def ui_variant() -> Tuple[str, Optional[int]]:
+        """Format and resolution of the figures shown in the UI"""
+        return config.PLOT_FORMAT, None if config.PLOT_FORMAT == 'svg' else config.PLOT_DPI
+
+    @classmethod
+    def vision_variant(cls) -> Tuple[str, Optional[int]]:
+        """Rendering sent to the vision model: the UI figure itself unless that is SVG"""
+        fmt, dpi = cls.ui_variant()
+        return ('png', config.PLOT_DPI) if fmt == 'svg' else (fmt, dpi)
+
+    @classmethod
+    def reference(cls, key: str) -> Dict[str, str]:
+        """How API responses point at a figure instead of embedding it"""
+        fmt, _ = cls.ui_variant()
+        return {'plot_id': key, 'plot_url': f"/plots/{key}.{fmt}", 'plot_format': fmt}
+
+    def get(self, key: str, fmt: str, dpi: Optional[int] = None) -> Optional[Path]:
+        path = self.artifact_path(key, fmt, dpi)
+        if not path.exists():
+            return None
+        os.utime(path)  # Mark as recently used
+        return path
+
+    def reserve(self, key: str, fmt: str, dpi: Optional[int] = None) -> Path:
+        """Unique temporary path a renderer should write a new artifact to.
+
+        Call added() once it is fully written to move it into place, or discard() if not:
+        a render that is killed or fails half-way never leaves a truncated artifact behind,
+        and identical renders running at once do not write to the same file.
+        """
+        path = self.artifact_path(key, fmt, dpi)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+
+    def discard(self, temp_path: Path) -> None:
+        temp_path.unlink(missing_ok=True)
+
+    def put_bytes(self, key: str, fmt: str, data: bytes, dpi: Optional[int] = None) -> Optional[Path]:
+        temp_path = self.reserve(key, fmt, dpi)
+        temp_path.write_bytes(data)
+        return self.added(temp_path)
+
+    def put_file(self, key: str, fmt: str, source: Path, dpi: Optional[int] = None) -> Optional[Path]:
+        temp_path = self.reserve(key, fmt, dpi)
+        shutil.copyfile(source, temp_path)
+        return self.added(temp_path)
+
+    def get_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.get(key, 'json')
+        if path is None:
+            return None
+        try:
+            return json.loads(path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put_meta(self, key: str, meta: Dict[str, Any]) -> None:
+        self.put_bytes(key, 'json', json.dumps(meta).encode('utf-8'))
+
+    def added(self, temp_path: Path) -> Optional[Path]:
+        """Move an artifact written to a reserve()d path into place, account for it and prune
+        if over budget; returns the artifact's path (None if nothing was written)"""
+        if not temp_path.exists():
+            return None
+        path = temp_path.with_name(temp_path.name.rsplit('.', 2)[0])
+        os.replace(temp_path, path)
+        with self._lock:
+            self._size += path.stat().st_size
+            if self._size > self.max_bytes:
+                self._prune()
+        return path
+
+    def _artifacts(self):
+        """(path, stat) of every file in the cache, skipping files removed while listing"""
+        for path in self.cache_dir.rglob('*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if not path.is_dir():
+                yield path, stat
+
+    def _prune(self) -> None:
+        """Remove least recently used artifacts down to 80% of the budget.
+
+        Anything modified within PRUNE_GRACE_SECONDS, such as an artifact a renderer is still
+        writing to its temporary path, is left alone; older temporary files were left behind
+        by renders that were killed and go first.
+        """
+        files = sorted(
+            self._artifacts(), key=lambda item: (not item[0].name.endswith('.tmp'), item[1].st_mtime)
+        )
+        self._size = sum(stat.st_size for _, stat in files)
+        if self._size <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.8
+        cutoff = time.time() - PRUNE_GRACE_SECONDS
+        for path, stat in files:
+            if self._size <= target:
+                break
+            if stat.st_mtime > cutoff:
+                continue
+            path.unlink(missing_ok=True)
+            self._size -= stat.st_size
+
+
+_shared_cache: Optional[PlotCache] = None
+
+def get_plot_cache() -> PlotCache:
+    """Return the process-wide PlotCache, creating it on first use"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = PlotCache()
+    return _shared_cache
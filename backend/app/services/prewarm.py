@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+import importlib
+import os
+import sys
+import threading
+import time
+
+from ..config import config
+
+REQUEST_IMPORTS_KEPT = 20
+
+
+def configure_matplotlib() -> None:
+    """Select MPL_BACKEND before anything imports pyplot, so it never probes for a GUI toolkit.
+
+    Set through the environment so spawned execution workers inherit it.
+    """
+    os.environ.setdefault('MPLBACKEND', config.MPL_BACKEND)
+
+def prewarm_imports(modules: Optional[List[str]] = None) -> Dict[str, Optional[float]]:
+    """Import modules (PREWARM_MODULES by default); returns seconds per module, None if missing"""
+    timings = {}
+    for name in modules if modules is not None else config.PREWARM_MODULES:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            timings[name] = None
+            continue
+        timings[name] = round(time.perf_counter() - started, 4)
+    return timings
+
+def _top_level_modules() -> set:
+    return {name.partition('.')[0] for name in list(sys.modules) if not name.startswith('_')}
+
+@contextmanager
+def timed_imports() -> Iterator[Dict[str, Any]]:
+    """Time a block that may import libraries; fills in 'seconds' and the new top-level 'modules'"""
+    before = _top_level_modules()
+    started = time.perf_counter()
+    imports = {}
+    try:
+        yield imports
+    finally:
+        imports['seconds'] = round(time.perf_counter() - started, 4)
+        imports['modules'] = sorted(_top_level_modules() - before)
+
+
+class StartupMetrics:
+    """Where startup time went and which imports requests still had to pay for"""
+
+    def __init__(self):
+        self.import_seconds = None
+        self.ready_seconds = None
+        self.prewarm_status = 'disabled' if not config.PREWARM_ENABLED else 'pending'
+        self.prewarm_seconds = None
+        self.prewarm_modules = {}
+        self.prewarm_error = None
+        self.workers = []
+        self.request_imports = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def mark_imported(self, started: float) -> None:
+        """The API module finished importing; started is its perf_counter() before the first import"""
+        self._started = started
+        self.import_seconds = round(time.perf_counter() - started, 4)
+
+    def mark_ready(self) -> None:
+        self.ready_seconds = round(time.perf_counter() - self._started, 4)
+
+    def prewarm_started(self) -> None:
+        self.prewarm_status = 'running'
+
+    def prewarm_finished(self, seconds: float, modules: Dict[str, Optional[float]], error: str = None) -> None:
+        self.prewarm_status = 'failed' if error else 'done'
+        self.prewarm_seconds = round(seconds, 4)
+        self.prewarm_modules = modules
+        self.prewarm_error = error
+
+    def record_worker(self, pid: int, imports: Dict[str, Optional[float]]) -> None:
+        with self._lock:
+            self.workers.append({'pid': pid, 'imports': imports})
+            self.workers = self.workers[-REQUEST_IMPORTS_KEPT:]
+
+    def record_request_imports(self, where: str, imports: Optional[Dict[str, Any]]) -> None:
+        """Keep imports a request had to wait for (only those that loaded something new)"""
+        if not imports or not imports.get('modules'):
+            return
+        print(f"Request-path imports in {where}: {', '.join(imports['modules'])} ({imports['seconds']:.2f}s)")
+        with self._lock:
+            self.request_imports.append({'where': where, 'at': time.time(), **imports})
+            self.request_imports = self.request_imports[-REQUEST_IMPORTS_KEPT:]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'import_seconds': self.import_seconds,
+                'ready_seconds': self.ready_seconds,
+                'matplotlib_backend': os.environ.get('MPLBACKEND'),
+                'prewarm': {
+                    'status': self.prewarm_status,
+                    'seconds': self.prewarm_seconds,
+                    'modules': self.prewarm_modules,
+                    'error': self.prewarm_error
+                },
+                'workers': list(self.workers),
+                'request_imports': list(self.request_imports)
+            }
+
+
+_shared_metrics: Optional[StartupMetrics] = None
+
+def get_startup_metrics() -> StartupMetrics:
+    global _shared_metrics
+    if _shared_metrics is None:
+        _shared_metrics = StartupMetrics()
+    return _shared_metrics
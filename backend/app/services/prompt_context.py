@@ -0,0 +1,152 @@
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import json
+import re
+
+from ..config import config
+from .data_service import NpEncoder
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (characters / PROMPT_CHARS_PER_TOKEN), good enough for budgeting"""
+    return int(len(text) / config.PROMPT_CHARS_PER_TOKEN) + 1
+
+def _words(text: str) -> set:
+    """Words for matching columns to the query (bare numbers match too much to count)"""
+    return {word for word in WORD_PATTERN.findall(text.lower().replace('_', ' ')) if not word.isdigit()}
+
+def _mentions(text: str, phrase: str) -> bool:
+    """Whether text contains phrase as a whole word or words (so column 'a' does not match 'data')"""
+    return re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", text) is not None
+
+def _format_number(value: Any) -> str:
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+def rank_columns(column_info: Dict[str, Dict[str, Any]], query: str) -> List[str]:
+    """Columns ordered by relevance to the query: named columns first, then word overlap,
+    then generally useful columns (few nulls, not constant, not ID-like)."""
+    query_text = query.lower() if isinstance(query, str) else ''
+    query_words = _words(query_text)
+
+    def score(item: Tuple[int, str]) -> Tuple[float, int]:
+        position, column = item
+        info = column_info[column]
+        name = str(column).lower()
+        value = 0.0
+        if name and (_mentions(query_text, name) or _mentions(query_text, name.replace('_', ' '))):
+            value += 100
+        column_words = _words(name)
+        if column_words:
+            value += 20 * len(column_words & query_words) / len(column_words)
+        value -= info.get('null_percentage', 0) / 10
+        unique = info.get('unique_count')
+        total = info.get('total_count') or 0
+        if unique is not None and total:
+            if unique <= 1:
+                value -= 5  # Constant column
+            elif unique == total:
+                value -= 3  # Likely an identifier or free text
+        return (-value, position)
+
+    return [column for _, column in sorted(enumerate(column_info), key=score)]
+
+def _column_row(column: str, info: Dict[str, Any]) -> str:
+    fields = [str(column), info.get('dtype', '?'), f"{info.get('null_percentage', 0)}%"]
+    if 'mean' in info:
+        fields.append(' '.join(
+            f"{stat}={_format_number(info.get(stat))}"
+            for stat in ('mean', 'std', 'min', 'median', 'max')
+        ))
+    else:
+        top = ', '.join(f"{value}({count})" for value, count in list(info.get('top_values', {}).items())[:3])
+        fields.append(f"unique={info.get('unique_count', '?')} top: {top}")
+    return ' | '.join(fields)
+
+def build_dataset_context(data_info: Dict[str, Any], query: Any = '',
+                          budget_tokens: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """Compact tabular schema summary of data_info that fits in budget_tokens.
+
+    Columns keep their dataset order when they all fit, so the text (and therefore the
+    prompt prefix) is identical across queries on the same dataset. Only when over budget
+    are columns ranked by relevance to the query and the least useful ones left out.
+    Returns the text and stats on what was included.
+    """
+    budget_tokens = budget_tokens or config.PROMPT_DATASET_TOKEN_BUDGET
+    column_info = data_info.get('column_info', {})
+
+    header = (
+        f"Rows: {data_info.get('total_rows')}, columns: {data_info.get('total_columns')}, "
+        f"missing cells: {data_info.get('missing_percentage')}%, "
+        f"duplicate rows: {data_info.get('duplicate_rows')}\n"
+        "Columns (name | dtype | null% | stats):"
+    )
+    rows = {column: _column_row(column, info) for column, info in column_info.items()}
+    full_size = estimate_tokens(header) + sum(estimate_tokens(row) for row in rows.values())
+
+    ranked = False
+    order = list(column_info)
+    if full_size > budget_tokens:
+        order = rank_columns(column_info, query)
+        ranked = True
+
+    # When trimming, keep a fifth of the budget to name the columns that were left out
+    row_budget = budget_tokens - budget_tokens // 5 if ranked else budget_tokens
+    lines = [header]
+    used = estimate_tokens(header)
+    included = []
+    for column in order:
+        cost = estimate_tokens(rows[column])
+        if used + cost > row_budget:
+            break
+        lines.append(rows[column])
+        included.append(column)
+        used += cost
+
+    included_set = set(included)
+    omitted = [column for column in order if column not in included_set]
+    if omitted:
+        names = ', '.join(str(column) for column in omitted)
+        room = max(0, (budget_tokens - used) * config.PROMPT_CHARS_PER_TOKEN - 60)
+        if len(names) > room:
+            names = names[:int(room)].rsplit(',', 1)[0] + ', ...'
+        lines.append(f"{len(omitted)} more columns not shown: {names}")
+        used += estimate_tokens(lines[-1])
+
+    sample_rows = data_info.get('sample_rows') or []
+    if sample_rows and config.PROMPT_SAMPLE_ROWS:
+        sample = [
+            {column: row.get(column) for column in included}
+            for row in sample_rows[:config.PROMPT_SAMPLE_ROWS]
+        ]
+        sample_text = "Sample rows:\n" + '\n'.join(json.dumps(row, cls=NpEncoder) for row in sample)
+        if used + estimate_tokens(sample_text) <= budget_tokens:
+            lines.append(sample_text)
+            used += estimate_tokens(sample_text)
+
+    return '\n'.join(lines), {
+        'columns_included': len(included),
+        'columns_omitted': len(omitted),
+        'ranked': ranked,
+        'dataset_tokens': used
+    }
+
+
+# Called with a dict describing each LLM analysis request: estimated and actual prompt sizes
+PromptHook = Callable[[Dict[str, Any]], None]
+_prompt_hooks: List[PromptHook] = []
+
+def add_prompt_hook(hook: PromptHook) -> None:
+    """Register a callback receiving the prompt size of every analysis request"""
+    _prompt_hooks.append(hook)
+
+def report_prompt_size(stats: Dict[str, Any]) -> None:
+    print(f"Prompt size: {json.dumps(stats)}")
+    for hook in _prompt_hooks:
+        try:
+            hook(stats)
+        except Exception as e:
+            print(f"Prompt hook error: {str(e)}")
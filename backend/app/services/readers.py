@@ -0,0 +1,150 @@
+from typing import Any, List, Optional, Tuple
+import gzip
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; columnar formats and zstd need it
+    pa = None
+    feather = None
+    pq = None
+
+MAGIC_BYTES = 8
+
+
+def open_decompressed(path: str, compression: Optional[str] = None):
+    """Binary file object over the decompressed content of path"""
+    if compression is None:
+        return open(path, 'rb')
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if pa is None:
+        raise ValueError(f"Reading {compression}-compressed files requires pyarrow")
+    return pa.input_stream(path, compression=compression)
+
+def _require_pyarrow(format_name: str) -> None:
+    if pa is None:
+        raise ValueError(f"Reading {format_name} files requires pyarrow")
+
+
+class DatasetReader:
+    """Recognizes and parses one upload format.
+
+    read() returns the frame and, if it profiled the rows while parsing, an
+    IncrementalSummary (else None and DataService profiles the frame). Readers given
+    `columns` only return those columns, reading no others where the format allows.
+    """
+
+    name = 'base'
+    extensions: Tuple[str, ...] = ()
+    magic: Tuple[bytes, ...] = ()
+
+    def matches_content(self, head: bytes) -> bool:
+        return any(head.startswith(prefix) for prefix in self.magic)
+
+    def matches_name(self, path: str) -> bool:
+        return str(path).lower().endswith(self.extensions)
+
+    def read(self, service, path: str, columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, Any]:
+        raise NotImplementedError
+
+
+class CsvReader(DatasetReader):
+    """Delimited text, optionally gzip/zstd-compressed and decompressed while parsing"""
+
+    def __init__(self, compression: Optional[str] = None, extensions: Tuple[str, ...] = ('.csv',),
+                 magic: Tuple[bytes, ...] = ()):
+        self.compression = compression
+        self.name = f"csv+{compression}" if compression else 'csv'
+        self.extensions = extensions
+        self.magic = magic
+
+    def read(self, service, path, columns=None):
+        dialect = service.sniff_dialect(path, self.compression)
+        print("Detected CSV dialect:", dialect)
+        return service._parse_csv(path, dialect, self.compression, columns)
+
+
+class ParquetReader(DatasetReader):
+    name = 'parquet'
+    extensions = ('.parquet', '.pq')
+    magic = (b'PAR1',)
+
+    def read(self, service, path, columns=None):
+        _require_pyarrow('Parquet')
+        return pq.read_table(path, columns=columns).to_pandas(), None
+
+
+class FeatherReader(DatasetReader):
+    """Feather v1/v2 and Arrow IPC files"""
+
+    name = 'feather'
+    extensions = ('.feather', '.arrow', '.ipc')
+    magic = (b'ARROW1', b'FEA1')
+
+    def read(self, service, path, columns=None):
+        _require_pyarrow('Feather')
+        # Not memory-mapped: the upload's spool file is deleted right after parsing
+        return feather.read_table(path, columns=columns, memory_map=False).to_pandas(), None
+
+
+class ExcelReader(DatasetReader):
+    """First sheet of an .xlsx workbook (needs openpyxl)"""
+
+    name = 'excel'
+    extensions = ('.xlsx',)
+
+    def matches_content(self, head: bytes) -> bool:
+        return False  # A zip header alone does not make a workbook; go by extension
+
+    def read(self, service, path, columns=None):
+        from .data_service import select_columns
+
+        try:
+            # openpyxl parses every cell anyway, so columns are selected after cleaning: the
+            # sheet's headers may be numbers (e.g. years) that only match once made strings
+            df = pd.read_excel(path, engine='openpyxl')
+        except ImportError:
+            raise ValueError("Reading Excel files requires openpyxl")
+        return select_columns(service.clean_column_names(df), columns), None
+
+
+# Tried in order; plain CSV goes last as the fallback for content without a known signature
+READERS: List[DatasetReader] = [
+    ParquetReader(),
+    FeatherReader(),
+    ExcelReader(),
+    CsvReader('gzip', ('.csv.gz', '.tsv.gz', '.gz'), (b'\x1f\x8b',)),
+    CsvReader('zstd', ('.csv.zst', '.tsv.zst', '.zst'), (b'\x28\xb5\x2f\xfd',)),
+    CsvReader(extensions=('.csv', '.tsv', '.txt')),
+]
+
+def register_reader(reader: DatasetReader) -> None:
+    """Add a reader for another upload format, tried before the built-in ones"""
+    READERS.insert(0, reader)
+
+def detect_reader(path: str, filename: Optional[str] = None) -> DatasetReader:
+    """Pick a reader by the file's leading bytes, then by its name, defaulting to plain CSV"""
+    with open(path, 'rb') as f:
+        head = f.read(MAGIC_BYTES)
+    for reader in READERS:
+        if reader.matches_content(head):
+            return reader
+    for reader in READERS:
+        if reader.matches_name(filename or path):
+            return reader
+    return READERS[-1]
+
+def allowed_file_types() -> List[str]:
+    """Extensions (without the dot) an upload may have: those of the registered readers"""
+    extensions = [extension.lstrip('.') for reader in READERS for extension in reader.extensions]
+    return list(dict.fromkeys(extensions))
+
+def upload_suffix(filename: str) -> str:
+    """The registered extension filename ends with (longest match), '.csv' if none"""
+    extensions = [extension for reader in READERS for extension in reader.extensions]
+    matching = [extension for extension in extensions if filename.lower().endswith(extension)]
+    return max(matching, key=len) if matching else '.csv'
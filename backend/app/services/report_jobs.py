@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, List, Optional
+import asyncio
+import shutil
+import time
+import traceback
+import uuid
+
+from ..config import config
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+class ReportJob:
+    """A report being generated in the background: its status, stage and result"""
+
+    def __init__(self, session_id: str):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.status = 'queued'  # queued | running | completed | failed | cancelled
+        self.stage = None  # writing | rendering | compiling while running
+        self.report_dir = None
+        self.pdf_path = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+    def update(self, **changes: Any) -> None:
+        for name, value in changes.items():
+            setattr(self, name, value)
+        if self.done and self.finished_at is None:
+            self.finished_at = time.time()
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def updates(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job's state now and after every change, until it finishes"""
+        last = None
+        while True:
+            async with self._changed:
+                state = self.to_dict()
+                if state == last:
+                    await self._changed.wait()
+                    continue
+            last = state
+            yield state
+            if self.done:
+                return
+
+
+class ReportJobQueue:
+    """Runs report generation as background tasks.
+
+    At most REPORT_MAX_ACTIVE_JOBS reports are generated at once; later submissions wait
+    in 'queued'. Finished jobs are kept for REPORT_JOB_TTL_SECONDS so their PDF can be
+    downloaded; a job's report directory is deleted when it fails, is cancelled or expires.
+    """
+
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self._slots = asyncio.Semaphore(config.REPORT_MAX_ACTIVE_JOBS)
+
+    def submit(self, session, chat_history: List[Dict[str, Any]]) -> ReportJob:
+        self._expire()
+        job = ReportJob(session.session_id)
+        job.report_dir = session.report_service.new_report_dir()
+        self.jobs[job.job_id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, session, chat_history))
+        # Keeps the session from being spilled until the report no longer needs its dataset
+        session.report_tasks.add(job.task)
+        job.task.add_done_callback(session.report_tasks.discard)
+        return job
+
+    async def _run(self, job: ReportJob, session, chat_history: List[Dict[str, Any]]) -> None:
+        try:
+            async with self._slots:
+                job.update(status='running')
+                report = await session.report_service.generate_report(
+                    chat_history,
+                    on_progress=lambda stage: job.update(stage=stage),
+                    report_dir=job.report_dir
+                )
+            job.update(status='completed', stage=None, pdf_path=report['pdf_path'])
+        except asyncio.CancelledError:
+            job.update(status='cancelled', stage=None)
+            self._discard_files(job)
+        except Exception as e:
+            print(f"Report job {job.job_id} failed: {str(e)}")
+            traceback.print_exc()
+            job.update(status='failed', stage=None, error=str(e))
+            self._discard_files(job)
+
+    @staticmethod
+    def _discard_files(job: ReportJob) -> None:
+        if job.report_dir is not None:
+            shutil.rmtree(job.report_dir, ignore_errors=True)
+
+    def get(self, job_id: str, session_id: str) -> Optional[ReportJob]:
+        """Look up a job, only if it belongs to the given session"""
+        self._expire()
+        job = self.jobs.get(job_id)
+        if job is None or job.session_id != session_id:
+            return None
+        return job
+
+    def cancel(self, job_id: str, session_id: str) -> bool:
+        job = self.get(job_id, session_id)
+        if job is None or job.done:
+            return False
+        job.task.cancel()
+        return True
+
+    def _expire(self) -> None:
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.done and now - job.finished_at > config.REPORT_JOB_TTL_SECONDS:
+                del self.jobs[job_id]
+                self._discard_files(job)
+
+    async def shutdown(self) -> None:
+        tasks = [job.task for job in self.jobs.values() if not job.done]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Jobs do not outlive the process, so neither do their reports
+        for job in self.jobs.values():
+            self._discard_files(job)
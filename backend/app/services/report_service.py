@@ -1,15 +1,24 @@
-from anthropic import Anthropic
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional
 from datetime import datetime
 from pathlib import Path
 from ..config import config
-import subprocess
+from .llm_client import get_llm_client
+import asyncio
+import signal
+import uuid
+import os
 import re
 
+# pdflatex runs are CPU-heavy; bound how many run at once across all sessions
+_compile_slots = asyncio.Semaphore(config.REPORT_COMPILE_CONCURRENCY)
+
+class ReportCompilationError(Exception):
+    """pdflatex failed, timed out or produced no PDF"""
+
 class ReportService:
     def __init__(self, plot_analysis_service, data_service, llm_service):
-        self.client = Anthropic(api_key=config.ANTHROPIC_API_KEY)
+        self.client = get_llm_client()
         self.plot_analysis_service = plot_analysis_service
         self.template_path = Path(__file__).parent.parent / 'templates' / 'report_template.tex'
         self.reports_dir = Path(__file__).parent.parent / 'reports'
@@ -84,8 +93,66 @@ Keep in mind:
 - Include specific numbers and statistics
 - Make clear recommendations based on the findings"""
 
-    async def generate_report(self, chat_history: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Generate a complete LaTeX report"""
+    async def _render_plot(self, clean_ref: str, code: str, report_dir: Path) -> Optional[Path]:
+        """Render a logged plot's figure into report_dir, reusing the plot cache when possible"""
+        plot_path = await self.llm_service.render_figure(code, report_dir / clean_ref)
+        if plot_path is not None:
+            print(f"Successfully generated plot at: {plot_path}")
+        else:
+            print(f"Error generating plot {clean_ref}")
+        return plot_path
+
+    async def _run_pdflatex(self, report_dir: Path) -> str:
+        """One pdflatex pass over report.tex; returns its output, killing it on timeout or cancel"""
+        process = await asyncio.create_subprocess_exec(
+            'pdflatex', '-interaction=nonstopmode', 'report.tex',
+            cwd=str(report_dir),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True  # Own process group, so helpers it spawns are killed with it
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), config.REPORT_COMPILE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ReportCompilationError(f"PDF compilation timed out after {config.REPORT_COMPILE_TIMEOUT}s")
+        finally:
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+
+        output = stdout.decode('utf-8', errors='replace')
+        if process.returncode != 0:
+            print("LaTeX Compilation Error:")
+            print(output)
+            raise ReportCompilationError(f"PDF compilation failed: {output[-2000:]}")
+        return output
+
+    async def compile_pdf(self, report_dir: Path) -> Path:
+        """Compile report.tex in report_dir (twice, for references) without blocking the event loop"""
+        async with _compile_slots:
+            for _ in range(2):
+                await self._run_pdflatex(report_dir)
+
+        pdf_path = report_dir / "report.pdf"
+        if not pdf_path.exists():
+            raise ReportCompilationError("PDF file not created")
+        return pdf_path
+
+    def new_report_dir(self) -> Path:
+        """A fresh timestamped directory path under reports/ (suffixed so concurrent reports never share one)"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return self.reports_dir / f"report_{timestamp}_{uuid.uuid4().hex[:8]}"
+
+    async def generate_report(self, chat_history: List[Dict[str, Any]],
+                              on_progress: Optional[Callable[[str], None]] = None,
+                              report_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Generate a complete LaTeX report in report_dir (new_report_dir() by default),
+        reporting each stage through on_progress"""
+        on_progress = on_progress or (lambda stage: None)
+        report_dir = report_dir or self.new_report_dir()
         try:
             # Process chat history to extract essential information
             processed_history = []
@@ -110,11 +177,8 @@ Keep in mind:
 
                     processed_history.append(entry)
 
-            analysis_log = []
-            try:
-                with open(self.plot_analysis_service.analysis_log_path, 'r') as f:
-                    analysis_log = json.load(f)
-            except FileNotFoundError:
+            analysis_log = self.plot_analysis_service.analysis_log.entries()
+            if not analysis_log:
                 print("No analysis log found, continuing with empty log")
 
             # Read LaTeX template
@@ -143,7 +207,8 @@ Generate a coherent report focusing on the most relevant visualizations for your
             print(prompt)
 
             # Get report content
-            response = self.client.messages.create(
+            on_progress('writing')
+            response = await self.client.create_message(
                 model=config.MODEL_NAME,
                 max_tokens=4096,
                 temperature=config.TEMPERATURE,
@@ -156,80 +221,48 @@ Generate a coherent report focusing on the most relevant visualizations for your
 
             report_content = response.content[0].text
 
-            # Create timestamped directory
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_dir = self.reports_dir / f"report_{timestamp}"
-            report_dir.mkdir(exist_ok=True)
+            report_dir.mkdir(parents=True, exist_ok=True)
 
             # Extract referenced plot titles
             referenced_plots = re.findall(r'\\includegraphics{\"?(.*?)\.png\"?}', report_content)
             print(f"Referenced plots in LaTeX: {referenced_plots}")
 
+            # Index the log by figure file name once; the first entry with a title wins
+            plots_by_ref = {}
+            for analysis in analysis_log:
+                plots_by_ref.setdefault(analysis['title'].replace(' ', '_'), analysis)
+
+            plot_jobs = {}
             for ref_title in referenced_plots:
                 clean_ref = ref_title.replace('"', '').replace(' ', '_')
-
-                for analysis in analysis_log:
-                    if analysis['title'].replace(' ', '_') == clean_ref:
-                        found_match = True
-
-                        plot_path = report_dir / f"{clean_ref}.png"
-                        result = await self.llm_service.execute_code(analysis['code'], str(plot_path))
-                        if result["success"]:
-                            print(f"Successfully generated plot at: {plot_path}")
-
-                            if plot_path.exists():
-                                print(f"File exists at: {plot_path}")
-                            else:
-                                print(f"WARNING: File not found at: {plot_path}")
-                        else:
-                            print(f"Error generating plot {clean_ref}: {result.get('error')}")
-                        break
+                if clean_ref in plots_by_ref:
+                    plot_jobs[clean_ref] = plots_by_ref[clean_ref]['code']
+
+            on_progress('rendering')
+            # Render every figure concurrently; worker processes each have their own pyplot state
+            rendered = await asyncio.gather(*[
+                self._render_plot(clean_ref, code, report_dir)
+                for clean_ref, code in plot_jobs.items()
+            ])
+
+            # Figures served from the cache as vector PDFs replace the PNG the LaTeX refers to
+            pdf_refs = {path.stem for path in rendered if path is not None and path.suffix == '.pdf'}
+            for ref_title in set(referenced_plots):
+                if ref_title.replace('"', '').replace(' ', '_') in pdf_refs:
+                    report_content = report_content.replace(f'{ref_title}.png', f'{ref_title}.pdf')
 
             # Compile LaTeX
             report_path = report_dir / "report.tex"
             with open(report_path, 'w') as f:
                 f.write(report_content)
 
-            try:
-                process = subprocess.run([
-                    'pdflatex',
-                    '-interaction=nonstopmode',
-                    'report.tex'
-                ],
-                cwd=str(report_dir),
-                capture_output=True,
-                text=True
-                )
-
-                if process.returncode != 0:
-                    print("LaTeX Compilation Error:")
-                    print(process.stdout)
-                    print(process.stderr)
-                    raise Exception(f"PDF compilation failed: {process.stderr}")
-
-                # Run twice
-                subprocess.run([
-                    'pdflatex',
-                    '-interaction=nonstopmode',
-                    'report.tex'
-                ],
-                cwd=str(report_dir),
-                check=True
-                )
-
-                pdf_path = report_dir / "report.pdf"
-                if pdf_path.exists():
-                    return {
-                        "content": report_content,
-                        "path": str(report_path),
-                        "pdf_path": str(pdf_path)
-                    }
-                else:
-                    raise Exception("PDF file not created")
-
-            except subprocess.CalledProcessError as e:
-                print(f"LaTeX compilation error: {e}")
-                raise Exception("PDF compilation failed")
+            on_progress('compiling')
+            pdf_path = await self.compile_pdf(report_dir)
+            return {
+                "content": report_content,
+                "path": str(report_path),
+                "pdf_path": str(pdf_path)
+            }
 
         except Exception as e:
             print(f"Error generating report: {str(e)}")
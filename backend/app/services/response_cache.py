@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from ..config import config
+
+def normalize_query(query: Any) -> str:
+    """Case, whitespace and trailing punctuation do not change what is being asked"""
+    text = query if isinstance(query, str) else json.dumps(query, sort_keys=True, default=str)
+    return re.sub(r'\s+', ' ', text).strip().rstrip('?.!').strip().lower()
+
+def _json_hash(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def response_cache_key(fingerprint: str, query: Any, history: List[Dict[str, Any]],
+                       model: str, temperature: float, system: Any = None) -> str:
+    """Key for an analysis: dataset, normalized query, earlier conversation, model, temperature
+    and the rendered system prompt (which carries the previous-analyses log)"""
+    payload = json.dumps([
+        fingerprint, normalize_query(query), _json_hash(history), model, temperature, _json_hash(system)
+    ])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """TTL + LRU bounded cache of analysis responses, with hit/miss counters"""
+
+    backend = 'none'
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        self.max_entries = max_entries or config.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or config.RESPONSE_CACHE_TTL_SECONDS
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._get(key, time.time())
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._set(key, value, time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self)
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions
+        }
+
+    def _get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Dict[str, Any], now: float) -> None:
+        raise NotImplementedError
+
+    def _clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """Per-process cache in an OrderedDict"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        super().__init__(max_entries, ttl_seconds)
+        self._entries = OrderedDict()
+
+    def _get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if now - created > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: Dict[str, Any], now: float) -> None:
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """On-disk cache shared by every API process using the same file and kept across restarts"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        super().__init__(max_entries, ttl_seconds)
+        self.path = Path(path or config.RESPONSE_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def _get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        row = self._db.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if now - created > self.ttl_seconds:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            return None
+        self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(value)
+
+    def _set(self, key: str, value: Dict[str, Any], now: float) -> None:
+        self._db.execute(
+            'INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now, now)
+        )
+        self._db.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl_seconds,))
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                'DELETE FROM responses WHERE key IN '
+                '(SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                (excess,)
+            )
+            self.evictions += excess
+
+    def _clear(self) -> None:
+        self._db.execute('DELETE FROM responses')
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+_shared_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the configured response cache, or None when RESPONSE_CACHE_BACKEND is 'none'"""
+    global _shared_cache
+    if _shared_cache is None:
+        if config.RESPONSE_CACHE_BACKEND == 'memory':
+            _shared_cache = MemoryResponseCache()
+        elif config.RESPONSE_CACHE_BACKEND == 'sqlite':
+            _shared_cache = SQLiteResponseCache()
+    return _shared_cache
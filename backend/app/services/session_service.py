@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+import asyncio
+import re
+import time
+
+from ..config import config
+from .code_executor import create_executor
+from .data_service import DataService
+from .dataset_store import get_dataset_store
+from .llm_service import LLMService
+from .plot_analysis_service import PlotAnalysisService
+from .report_service import ReportService
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class Session:
+    """Everything one analyst works with: dataset, exec namespace and analysis log"""
+
+    def __init__(self, session_id: str, executor):
+        self.session_id = session_id
+        self.data_service = DataService(get_dataset_store())
+        self.plot_analysis_service = PlotAnalysisService(session_id)
+        self.llm_service = LLMService(self.data_service, self.plot_analysis_service, executor, session_id)
+        self.report_service = ReportService(self.plot_analysis_service, self.data_service, self.llm_service)
+        self.last_access = time.time()
+        # Background task computing the exact profile after a sampled one was returned
+        self.refinement = None
+        # Report generation tasks (queued or running) rendering from this session's dataset
+        self.report_tasks = set()
+        # Held while the dataset is spilled to or restored from disk
+        self.lock = asyncio.Lock()
+
+    def memory_usage(self) -> int:
+        return self.data_service.memory_usage()
+
+    @property
+    def busy(self) -> bool:
+        """Whether the dataset is being spilled, restored, profiled in the background or
+        rendered from by a report"""
+        return (
+            self.lock.locked()
+            or (self.refinement is not None and not self.refinement.done())
+            or bool(self.report_tasks)
+        )
+
+    def cancel_tasks(self) -> None:
+        """Stop the background work still using this session's dataset"""
+        if self.refinement is not None:
+            self.refinement.cancel()
+        for task in list(self.report_tasks):
+            task.cancel()
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Bytes held by this session's dataset and by its exec namespace(s)"""
+        return {
+            'dataset_bytes': self.data_service.memory_usage(),
+            'dataset_spilled': self.data_service.is_spilled,
+            'namespace': self.llm_service.executor.namespace_memory(self.session_id)
+        }
+
+
+class SessionManager:
+    """Sessions keyed by ID, with a memory-budgeted LRU.
+
+    When resident datasets exceed SESSION_MEMORY_BUDGET_MB, the least recently used sessions
+    are spilled to Parquet under SESSION_SPILL_DIR and reloaded on their next request; both
+    run in a thread so the event loop keeps serving. Sessions idle for longer than
+    SESSION_TTL_SECONDS are discarded entirely.
+    """
+
+    def __init__(self):
+        self.executor = create_executor()
+        self.sessions = OrderedDict()
+        self.spill_dir = Path(config.SESSION_SPILL_DIR)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.store = get_dataset_store()
+
+    async def get(self, session_id: Optional[str] = None) -> Session:
+        """Return the session, creating it or reloading its spilled dataset as needed"""
+        session_id = session_id or config.DEFAULT_SESSION_ID
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("Session IDs may only contain letters, digits, '-' and '_' (max 64)")
+
+        session = self.sessions.get(session_id)
+        stored = None
+        if session is None:
+            session = Session(session_id, self.executor)
+            self.sessions[session_id] = session
+            # A session known from before a restart gets its stored dataset back
+            stored = self.store.session_dataset(session_id) if self.store else None
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_access = time.time()
+
+        # Concurrent requests for the session wait here until its dataset is back in memory
+        async with session.lock:
+            if stored and await asyncio.to_thread(session.data_service.load_stored, stored):
+                print(f"Restored session {session_id} from the dataset store")
+                session.llm_service.reset_namespace()
+
+            if session.data_service.is_spilled:
+                print(f"Reloading spilled session {session_id}")
+                await asyncio.to_thread(session.data_service.restore)
+                session.llm_service.reset_namespace()
+
+        await self.enforce_budget(keep=session_id)
+        return session
+
+    async def enforce_budget(self, keep: Optional[str] = None) -> None:
+        """Expire idle sessions, then spill LRU datasets until within the memory budget.
+
+        Sessions whose dataset is being restored, still profiled in the background or used by
+        a report being generated are left resident.
+        """
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if session_id != keep and now - session.last_access > config.SESSION_TTL_SECONDS:
+                self.remove(session_id)
+
+        budget = config.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        total = sum(session.memory_usage() for session in self.sessions.values())
+        for session_id, session in list(self.sessions.items()):
+            if total <= budget:
+                break
+            usage = session.memory_usage()
+            if session_id == keep or usage == 0 or session.busy:
+                continue
+            async with session.lock:
+                print(f"Spilling session {session_id} ({usage / 1024 / 1024:.1f} MB) to disk")
+                await asyncio.to_thread(session.data_service.spill, self.spill_dir / session_id)
+                self.executor.drop_dataset(session_id)
+            total -= usage
+
+    def remember_dataset(self, session: Session) -> None:
+        """Record the session's current dataset so it can be restored after a restart"""
+        if self.store and session.data_service.dataset_path:
+            self.store.bind_session(session.session_id, session.data_service.dataset_fingerprint)
+
+    def remove(self, session_id: str) -> None:
+        if self.store:
+            self.store.unbind_session(session_id)
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.cancel_tasks()
+        session.data_service.discard_spill()
+        session.plot_analysis_service.delete_log()
+        self.executor.drop_dataset(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Aggregate residency figures (session IDs are not exposed); safe to call from a thread"""
+        sessions = list(self.sessions.items())
+        return {
+            'sessions': len(sessions),
+            'resident_bytes': sum(session.memory_usage() for _, session in sessions),
+            'spilled_sessions': sum(session.data_service.is_spilled for _, session in sessions),
+            'namespace_private_bytes': sum(
+                self.executor.namespace_memory(session_id)['private_bytes'] for session_id, _ in sessions
+            ),
+            'memory_budget_bytes': config.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        }
+
+    async def shutdown(self) -> None:
+        for session in self.sessions.values():
+            session.data_service.discard_spill()
+        await self.executor.shutdown()
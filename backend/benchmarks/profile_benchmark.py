@@ -0,0 +1,150 @@
+"""Compare the vectorized dataset profile against the original per-column loop.
+
+Besides get_summary_stats() on its own, the upload path is timed end to end: the frame is
+written to a CSV and parsed and profiled with DataService.prepare_data(), against the same
+parse profiled the way uploads used to be (IncrementalSummary over the parsed frame).
+
+Run from the backend directory:
+    python -m benchmarks.profile_benchmark
+    python -m benchmarks.profile_benchmark --shape wide --rows 10000 --cols 1000
+    python -m benchmarks.profile_benchmark --shape tall --rows 10000000 --cols 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.config import config
+from app.services.data_service import DataService, IncrementalSummary, dataset_fingerprint
+from app.services.dtype_optimizer import optimize_dtypes
+from app.services.readers import detect_reader
+
+
+def legacy_column_info(df: pd.DataFrame) -> dict:
+    """The per-column implementation get_column_info replaced"""
+    column_info = {}
+    for column in df.columns:
+        info = {
+            'dtype': str(df[column].dtype),
+            'null_count': int(df[column].isnull().sum()),
+            'total_count': len(df[column]),
+            'null_percentage': round(df[column].isnull().sum() / len(df[column]) * 100, 2)
+        }
+
+        if pd.api.types.is_numeric_dtype(df[column]):
+            not_null_series = df[column].dropna()
+            if not not_null_series.empty:
+                info.update({
+                    'mean': float(not_null_series.mean()),
+                    'median': float(not_null_series.median()),
+                    'std': float(not_null_series.std()),
+                    'min': float(not_null_series.min()),
+                    'max': float(not_null_series.max())
+                })
+        else:
+            not_null_series = df[column].dropna()
+            info.update({
+                'unique_count': len(not_null_series.unique()),
+                'top_values': not_null_series.value_counts().head(5).to_dict()
+            })
+
+        column_info[column] = info
+
+    return column_info
+
+
+def legacy_summary_stats(df: pd.DataFrame) -> dict:
+    """The get_summary_stats implementation that recomputed isnull() per use"""
+    return {
+        'total_rows': len(df),
+        'total_columns': len(df.columns),
+        'total_cells': df.size,
+        'missing_cells': df.isnull().sum().sum(),
+        'missing_percentage': round(df.isnull().sum().sum() / df.size * 100, 2),
+        'duplicate_rows': df.duplicated().sum(),
+        'column_info': legacy_column_info(df),
+        'columns': df.columns.tolist(),
+        'sample_rows': df.head().replace({np.nan: None}).to_dict(orient='records')
+    }
+
+
+def legacy_upload_profile(data_service: DataService, path: str) -> dict:
+    """Upload parse and profile as before: the parsed frame re-chunked through IncrementalSummary"""
+    df, _ = detect_reader(path).read(data_service, path)
+    summary = IncrementalSummary()
+    for start in range(0, len(df), config.CSV_CHUNK_ROWS):
+        summary.update(df.iloc[start:start + config.CSV_CHUNK_ROWS])
+    if config.DTYPE_OPTIMIZE:
+        df, _ = optimize_dtypes(df)
+    dataset_fingerprint(df, summary.row_hashes())
+    return summary.finalize(df, data_service.get_column_info)
+
+
+def make_frame(rows: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """Mostly numeric frame with ~5% missing values and one categorical column in ten"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        if i % 10 == 9:
+            data[f'cat_{i}'] = rng.choice(['north', 'south', 'east', 'west', 'other'], rows)
+        else:
+            values = rng.normal(size=rows)
+            values[rng.random(rows) < 0.05] = np.nan
+            data[f'num_{i}'] = values
+    return pd.DataFrame(data)
+
+
+def time_call(func, argument, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    shapes = {
+        'wide': (10_000, 1_000),
+        'tall': (10_000_000, 10),
+    }
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shape', choices=['wide', 'tall', 'both'], default='both')
+    parser.add_argument('--rows', type=int, help='override the row count of the chosen shape')
+    parser.add_argument('--cols', type=int, help='override the column count of the chosen shape')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data_service = DataService()
+    selected = shapes if args.shape == 'both' else {args.shape: shapes[args.shape]}
+
+    for name, (rows, cols) in selected.items():
+        rows = args.rows or rows
+        cols = args.cols or cols
+        df = make_frame(rows, cols)
+
+        legacy = time_call(legacy_summary_stats, df, args.repeat)
+        vectorized = time_call(data_service.get_summary_stats, df, args.repeat)
+        print(
+            f"{name:>5} {rows:>10,} rows x {cols:>5,} cols | profile | "
+            f"legacy {legacy:8.3f}s | vectorized {vectorized:8.3f}s | "
+            f"speedup {legacy / vectorized:5.1f}x"
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'upload.csv')
+            df.to_csv(path, index=False)
+            legacy = time_call(lambda p: legacy_upload_profile(data_service, p), path, args.repeat)
+            vectorized = time_call(data_service.prepare_data, path, args.repeat)
+        print(
+            f"{name:>5} {rows:>10,} rows x {cols:>5,} cols | upload  | "
+            f"legacy {legacy:8.3f}s | vectorized {vectorized:8.3f}s | "
+            f"speedup {legacy / vectorized:5.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Lets the tests under tests/ import the app package from the backend directory"""
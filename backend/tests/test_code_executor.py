@@ -0,0 +1,28 @@
+import asyncio
+
+import pandas as pd
+
+from app.services.code_executor import WorkerPoolExecutor
+
+
+def test_sessions_sharing_a_stored_dataset_get_separate_namespaces(tmp_path):
+    # Two sessions that uploaded the same file are handed the same store path
+    path = str(tmp_path / 'dataset.pkl')
+    pd.DataFrame({'a': [1, 2, 3]}).to_pickle(path)
+
+    async def scenario():
+        executor = WorkerPoolExecutor(workers=1, memory_limit_mb=0)
+        try:
+            executor.set_dataset('session-a', None, source_path=path)
+            executor.set_dataset('session-b', None, source_path=path)
+            first = await executor.run("secret = 'A-private'", 'session-a')
+            leaked = await executor.run("print(globals().get('secret'))", 'session-b')
+            kept = await executor.run("print(len(df))", 'session-b')
+            return first, leaked, kept
+        finally:
+            await executor.shutdown()
+
+    first, leaked, kept = asyncio.run(scenario())
+    assert first['success']
+    assert leaked['success'] and leaked['text_output'] == 'None'
+    assert kept['text_output'] == '3'
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from app.services.data_service import DataService
+from app.services.readers import ExcelReader
+
+
+def test_excel_sheet_with_numeric_headers(tmp_path):
+    path = tmp_path / 'years.xlsx'
+    pd.DataFrame({'country': ['NL', 'BE'], 2020: [1.5, 2.5], 2021: [3.0, 4.0]}).to_excel(path, index=False)
+    service = DataService()
+
+    df, _ = ExcelReader().read(service, str(path))
+    assert list(df.columns) == ['country', '2020', '2021']
+    assert df['2021'].tolist() == [3.0, 4.0]
+
+    projected, _ = ExcelReader().read(service, str(path), columns=['2020'])
+    assert list(projected.columns) == ['2020']
+
+
+def test_excel_sheet_with_only_numeric_headers(tmp_path):
+    path = tmp_path / 'years.xlsx'
+    pd.DataFrame({2020: [1, 2], 2021: [3, 4]}).to_excel(path, index=False)
+
+    df, _ = ExcelReader().read(DataService(), str(path))
+    assert list(df.columns) == ['2020', '2021']
@@ -5,6 +5,10 @@ import { QueryInput } from './components/QueryInput';
 import { AnalysisResult } from './components/AnalysisResult';
 import { Upload } from 'lucide-react';
 import { ReportButton } from './components/ReportButton';
+import { sessionHeaders } from './session';
+import { readEvents } from './sse';
+
+const PROFILE_POLL_INTERVAL_MS = 1500;
 
 const App = () => {
   const [data, setData] = useState(null);
@@ -13,6 +17,7 @@ const App = () => {
   const [loading, setLoading] = useState(false);
   const [isScrolled, setIsScrolled] = useState(false);
   const contentRef = useRef(null);
+  const uploadCount = useRef(0);
 
   // Handle scroll events
   useEffect(() => {
@@ -89,6 +94,28 @@ const App = () => {
     }).filter(Boolean);
   };
 
+  // A sampled summary is refined in the background; poll until the exact one replaces it
+  const waitForExactProfile = async (upload) => {
+    while (uploadCount.current === upload) {
+      await new Promise((resolve) => setTimeout(resolve, PROFILE_POLL_INTERVAL_MS));
+      const response = await fetch(`${process.env.VITE_API_URL}/data/summary`, {
+        headers: sessionHeaders(),
+      });
+      if (!response.ok || uploadCount.current !== upload) {
+        return;
+      }
+      const summary = await response.json();
+      if (summary.profile?.status === 'refining') {
+        continue;
+      }
+      setData(summary);
+      setChatHistory(prev => prev.map(msg => (
+        msg.type === 'dataSummary' ? { ...msg, content: summary } : msg
+      )));
+      return;
+    }
+  };
+
   const handleFileUpload = async (result) => {
     try {
       setLoading(true);
@@ -98,6 +125,10 @@ const App = () => {
         type: 'dataSummary',
         content: result
       }]);
+      uploadCount.current += 1;
+      if (result.profile?.status === 'refining') {
+        waitForExactProfile(uploadCount.current).catch(err => console.error('Profile refresh error:', err));
+      }
     } catch (err) {
       setError(err.message);
     } finally {
@@ -105,7 +136,28 @@ const App = () => {
     }
   };
 
+  // Apply an update to the content of the response currently being streamed
+  const updateLastResponse = (update) => {
+    setChatHistory(prev => prev.map((msg, index) => (
+      index === prev.length - 1 && msg.type === 'response'
+        ? { ...msg, content: update(msg.content) }
+        : msg
+    )));
+  };
+
+  const updateLastOutput = (index, update) => {
+    setChatHistory(prev => prev.map((msg, msgIndex) => {
+      if (msgIndex !== prev.length - 1 || msg.type !== 'response') {
+        return msg;
+      }
+      const outputs = [...msg.outputs];
+      outputs[index] = update(outputs[index] || {});
+      return { ...msg, outputs };
+    }));
+  };
+
   const handleQuery = async (query) => {
+    let responseStarted = false;
     try {
       setLoading(true);
       setError(null);
@@ -118,11 +170,11 @@ const App = () => {
 
       const formattedHistory = formatChatHistory(newChatHistory);
 
-      const response = await fetch(`${process.env.VITE_API_URL}/analyze`, {
+      const response = await fetch(`${process.env.VITE_API_URL}/analyze/pipeline`, {
         method: 'POST',
-        headers: {
+        headers: sessionHeaders({
           'Content-Type': 'application/json',
-        },
+        }),
         body: JSON.stringify({
           query,
           chat_history: formattedHistory,
@@ -133,20 +185,44 @@ const App = () => {
         throw new Error('Analysis failed');
       }
 
-      const result = await response.json();
-
+      // Text, code blocks, their outputs and plot critiques arrive as the server produces them
       setChatHistory(prev => [...prev, {
         type: 'response',
         content: {
-          analysis: result.analysis,
-          code_blocks: result.code_blocks
+          analysis: '',
+          code_blocks: []
         },
         outputs: [],
+        pipelined: true,
         timestamp: new Date().toISOString()
       }]);
+      responseStarted = true;
+
+      await readEvents(response, (event) => {
+        if (event.type === 'text') {
+          updateLastResponse(content => ({ ...content, analysis: content.analysis + event.text }));
+        } else if (event.type === 'code_block') {
+          updateLastResponse(content => ({ ...content, code_blocks: [...content.code_blocks, event.code] }));
+        } else if (event.type === 'output') {
+          updateLastOutput(event.index, output => ({
+            ...output,
+            ...(event.success ? event.result : { error: event.error }),
+          }));
+        } else if (event.type === 'critique') {
+          updateLastOutput(event.index, output => ({ ...output, analysis: event.analysis }));
+        } else if (event.type === 'done') {
+          updateLastResponse(content => ({
+            ...content,
+            analysis: event.analysis,
+            code_blocks: event.code_blocks
+          }));
+        } else if (event.type === 'error') {
+          throw new Error(event.error);
+        }
+      });
     } catch (err) {
       setError(err.message);
-      setChatHistory(prev => prev.slice(0, -1));
+      setChatHistory(prev => prev.slice(0, responseStarted ? -2 : -1));
     } finally {
       setLoading(false);
     }
@@ -243,6 +319,7 @@ const App = () => {
                     <div className="bg-dark-muted rounded-lg shadow-lg p-6 border border-dark-border/10 max-w-4xl w-full">
                       <AnalysisResult
                         result={item.content}
+                        streamedOutputs={item.pipelined ? item.outputs : undefined}
                         chatHistory={chatHistory}
                         setChatHistory={setChatHistory}
                       />
@@ -1,22 +1,35 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { CodeBlock } from './CodeBlock';
 import { ChevronRight, ChevronDown } from 'lucide-react';
+import { sessionHeaders } from '../session';
 
-export const AnalysisResult = ({ result, chatHistory, setChatHistory }) => {
+export const AnalysisResult = ({ result, chatHistory, setChatHistory, streamedOutputs }) => {
   const [outputs, setOutputs] = useState([]);
-  const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [visibleBlocks, setVisibleBlocks] = useState({});
+  const [pending, setPending] = useState(0);
+  const executedCount = useRef(0);
+  const executionQueue = useRef(Promise.resolve());
 
+  const blockCount = result?.code_blocks?.length || 0;
+  // Pipelined responses are executed server-side and their outputs streamed in
+  const pipelined = streamedOutputs !== undefined;
+  const shownOutputs = pipelined ? streamedOutputs : outputs;
+
+  // Code blocks may arrive while the analysis is still streaming: queue each new one for
+  // execution as soon as it appears, in order
   useEffect(() => {
-    const execute = async () => {
-      if (result?.code_blocks?.length > 0) {
-        await executeAllCode();
-        setVisibleBlocks({});
-      }
-    };
-    execute();
-  }, [result, executeAllCode]);
+    if (pipelined) return;
+    while (executedCount.current < blockCount) {
+      const index = executedCount.current;
+      const code = result.code_blocks[index];
+      executedCount.current += 1;
+      setPending(count => count + 1);
+      executionQueue.current = executionQueue.current
+        .then(() => executeCode(code, index))
+        .finally(() => setPending(count => count - 1));
+    }
+  }, [blockCount, pipelined]);
 
 
   useEffect(() => {
@@ -41,39 +54,38 @@ export const AnalysisResult = ({ result, chatHistory, setChatHistory }) => {
     }));
   };
 
-  const executeAllCode = async () => {
-    setLoading(true);
+  const executeCode = async (code, index) => {
     setError(null);
-    const newOutputs = [];
 
     try {
-      for (const code of result.code_blocks) {
-        const response = await fetch(`${process.env.VITE_API_URL}/execute`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ code }),
-        });
-
-        if (!response.ok) {
-          throw new Error('Failed to execute code');
-        }
+      const response = await fetch(`${process.env.VITE_API_URL}/execute`, {
+        method: 'POST',
+        headers: sessionHeaders({
+          'Content-Type': 'application/json',
+        }),
+        body: JSON.stringify({ code }),
+      });
+
+      if (!response.ok) {
+        throw new Error('Failed to execute code');
+      }
 
-        const data = await response.json();
-        newOutputs.push({
+      const data = await response.json();
+      setOutputs(prev => {
+        const next = [...prev];
+        next[index] = {
           code,
           ...data.result,
-        });
-      }
-      setOutputs(newOutputs);
+        };
+        return next;
+      });
     } catch (err) {
       setError(err.message);
-    } finally {
-      setLoading(false);
     }
   };
 
+  const loading = pending > 0;
+
   return (
     <div className="space-y-6">
       {/* Analysis Text */}
@@ -85,7 +97,7 @@ export const AnalysisResult = ({ result, chatHistory, setChatHistory }) => {
 
       {/* Code Blocks*/}
       {result.code_blocks?.map((code, index) => {
-        const output = outputs[index];
+        const output = shownOutputs[index];
         const isVisible = visibleBlocks[index] || false;
 
         return (
@@ -106,16 +118,27 @@ export const AnalysisResult = ({ result, chatHistory, setChatHistory }) => {
             {/* Code Block - Collapsible */}
             {isVisible && <CodeBlock code={code} />}
 
+            {output?.error && (
+              <div className="bg-red-900/20 border-l-4 border-red-500 p-4 rounded-r">
+                <p className="text-red-400">{output.error}</p>
+              </div>
+            )}
+
             {/* Output - Always Visible */}
-            {output && (output.plot || output.text_output) && (
+            {output && (output.plot_url || output.text_output) && (
               <div className="bg-dark-surface rounded-lg shadow-lg p-6 border border-dark-border/10">
-                {output.plot && (
+                {output.plot_url && (
                   <img
-                    src={`data:image/png;base64,${output.plot}`}
+                    src={`${process.env.VITE_API_URL}${output.plot_url}`}
                     alt={`Visualization ${index + 1}`}
                     className="w-full h-auto rounded-lg max-h-[600px] object-contain"
                   />
                 )}
+                {output.render_notes?.length > 0 && (
+                  <p className="text-xs text-gray-400 mt-2">
+                    {output.render_notes.join('; ')}
+                  </p>
+                )}
                 {output.text_output && (
                   <div className="bg-black/30 rounded-lg p-4 mt-4">
                     <pre className="text-gray-300 text-sm font-mono whitespace-pre-wrap">
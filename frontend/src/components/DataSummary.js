@@ -12,6 +12,7 @@ export const DataSummary = ({ data }) => {
   const totalColumns = data.total_columns || 0;
   const missingCells = data.missing_cells || 0;
   const missingPercentage = data.missing_percentage || 0;
+  const profile = data.profile;
 
   return (
     <div className="space-y-4">
@@ -41,6 +42,14 @@ export const DataSummary = ({ data }) => {
         </button>
       </div>
 
+      {profile?.mode === 'sampled' && (
+        <p className="text-xs text-gray-400">
+          {profile.status === 'failed'
+            ? `Estimated from ${profile.sample_rows} sampled rows (exact profile failed: ${profile.error})`
+            : `Estimated from ${profile.sample_rows} sampled rows, computing exact statistics...`}
+        </p>
+      )}
+
       {/* Basic Stats - Always Visible */}
       <div className="grid grid-cols-2 md:grid-cols-4 gap-3">
         <div className="bg-dark-tertiary/50 p-2 rounded">
@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { Upload, Loader2, AlertCircle } from 'lucide-react';
+import { sessionHeaders } from '../session';
 
 export const FileUpload = ({ onUpload }) => {
   const [file, setFile] = useState(null);
@@ -19,6 +20,7 @@ export const FileUpload = ({ onUpload }) => {
     try {
       const response = await fetch(`${process.env.VITE_API_URL}/upload`, {
         method: 'POST',
+        headers: sessionHeaders(),
         body: formData,
       });
 
@@ -42,7 +44,7 @@ export const FileUpload = ({ onUpload }) => {
       <div className="relative">
         <input
           type="file"
-          accept=".csv"
+          accept=".csv,.tsv,.txt,.gz,.zst,.parquet,.pq,.feather,.arrow,.ipc,.xlsx"
           onChange={(e) => setFile(e.target.files[0])}
           className="hidden"
           id="file-upload"
@@ -56,7 +58,7 @@ export const FileUpload = ({ onUpload }) => {
           <div className="flex flex-col items-center space-y-2">
             <Upload className="w-8 h-8 text-gray-400" />
             <span className="text-sm text-gray-500">
-              {file ? file.name : "Choose a CSV file"}
+              {file ? file.name : "Choose a CSV, Parquet, Feather or Excel file"}
             </span>
           </div>
         </label>
@@ -1,10 +1,42 @@
 import React, { useState } from 'react';
 import { FileText, Loader2 } from 'lucide-react';
+import { sessionHeaders } from '../session';
+
+const POLL_INTERVAL_MS = 1500;
+
+const STAGE_LABELS = {
+  writing: 'Writing Report...',
+  rendering: 'Rendering Figures...',
+  compiling: 'Compiling PDF...',
+};
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
 
 export const ReportButton = ({ chatHistory }) => {
   const [loading, setLoading] = useState(false);
+  const [stage, setStage] = useState(null);
   const [error, setError] = useState(null);
 
+  const waitForReport = async (jobId) => {
+    while (true) {
+      await sleep(POLL_INTERVAL_MS);
+      const response = await fetch(`${process.env.VITE_API_URL}/reports/${jobId}`, {
+        headers: sessionHeaders(),
+      });
+      if (!response.ok) {
+        throw new Error('Failed to check report status');
+      }
+      const job = await response.json();
+      setStage(job.stage);
+      if (job.status === 'completed') {
+        return;
+      }
+      if (job.status === 'failed' || job.status === 'cancelled') {
+        throw new Error(job.error || `Report generation ${job.status}`);
+      }
+    }
+  };
+
   const handleGenerateReport = async () => {
     try {
       setLoading(true);
@@ -12,9 +44,9 @@ export const ReportButton = ({ chatHistory }) => {
 
       const response = await fetch(`${process.env.VITE_API_URL}/generate-report`, {
         method: 'POST',
-        headers: {
+        headers: sessionHeaders({
           'Content-Type': 'application/json',
-        },
+        }),
         body: JSON.stringify({
           chat_history: chatHistory
         }),
@@ -24,8 +56,19 @@ export const ReportButton = ({ chatHistory }) => {
         throw new Error('Failed to generate report');
       }
 
+      // The report is generated in the background; wait for it, then download the PDF
+      const job = await response.json();
+      await waitForReport(job.job_id);
+
+      const pdfResponse = await fetch(`${process.env.VITE_API_URL}/reports/${job.job_id}/pdf`, {
+        headers: sessionHeaders(),
+      });
+      if (!pdfResponse.ok) {
+        throw new Error('Failed to download report');
+      }
+
       // Handle PDF download
-      const blob = await response.blob();
+      const blob = await pdfResponse.blob();
       const url = window.URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
@@ -40,6 +83,7 @@ export const ReportButton = ({ chatHistory }) => {
       console.error('Report generation error:', err);
     } finally {
       setLoading(false);
+      setStage(null);
     }
 };
 
@@ -55,7 +99,7 @@ export const ReportButton = ({ chatHistory }) => {
         {loading ? (
           <>
             <Loader2 className="w-4 h-4 animate-spin" />
-            <span>Generating Report...</span>
+            <span>{STAGE_LABELS[stage] || 'Generating Report...'}</span>
           </>
         ) : (
           <>
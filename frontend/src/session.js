@@ -0,0 +1,16 @@
+const SESSION_STORAGE_KEY = 'ai-data-scientist-session-id';
+
+// One backend session per browser tab, so concurrent analysts never share a dataset
+export const getSessionId = () => {
+  let sessionId = window.sessionStorage.getItem(SESSION_STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = window.crypto.randomUUID();
+    window.sessionStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+};
+
+export const sessionHeaders = (headers = {}) => ({
+  ...headers,
+  'X-Session-ID': getSessionId(),
+});
@@ -0,0 +1,28 @@
+// Read a fetch() response carrying server-sent events, calling onEvent with each parsed
+// `data:` payload. fetch is used instead of EventSource so requests can be POSTs and
+// carry the session header.
+export const readEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const data = message
+        .split('\n')
+        .filter(line => line.startsWith('data: '))
+        .map(line => line.slice(6))
+        .join('\n');
+      if (data) {
+        await onEvent(JSON.parse(data));
+      }
+    }
+  }
+};